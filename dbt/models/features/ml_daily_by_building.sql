@@ -1,18 +1,23 @@
 {{ config(materialized='view', schema='features') }}
 
+-- core.rollup_daily уже уникален по (building_key, day) и собран из часовых агрегатов,
+-- повторная агрегация не нужна
 with base as (
     select
-        day as ts,
-        building_code,
-        sum(supply) as supply,
-        sum(return) as return,
-        sum(consumption) as consumption,
-        avg(supply - return) as loss
-    from core.daily_balance
-    group by day, building_code
+        r.day as ts,
+        r.building_key,
+        b.external_code as building_code,
+        r.supply,
+        r.return,
+        r.consumption,
+        r.loss
+    from core.rollup_daily r
+    join core.buildings b
+      on b.building_key = r.building_key
 )
 select
     b.ts,
+    b.building_key,
     b.building_code,
     b.supply,
     b.return,
@@ -1,18 +1,22 @@
 {{ config(materialized='view', schema='features') }}
 
+-- core.rollup_hourly уникален по (building_key, hour), повторная агрегация не нужна
 with base as (
     select
-        hour as ts,
-        building_code,
-        sum(supply) as supply,
-        sum(return) as return,
-        sum(consumption) as consumption,
-        avg(supply - return) as loss
-    from core.hourly_balance
-    group by hour, building_code
+        r.hour as ts,
+        r.building_key,
+        b.external_code as building_code,
+        r.supply,
+        r.return,
+        r.consumption,
+        r.loss
+    from core.rollup_hourly r
+    join core.buildings b
+      on b.building_key = r.building_key
 )
 select
     b.ts,
+    b.building_key,
     b.building_code,
     b.supply,
     b.return,
@@ -1,27 +1,18 @@
 {{ config(materialized='view', schema='features') }}
 
-with by_building as (
-    select
-        hb.hour as ts,
-        b.district_id,
-        b.building_id as building_id,
-        hb.consumption as consumption,
-        hb.supply as supply,
-        hb.return as return,
-        (hb.supply - hb.return) as loss
-    from core.hourly_balance hb
-    join core.buildings b
-      on b.external_code = hb.building_code
-)
-
+-- core.rollup_hourly_district ведёт ETL (etl/flows/rollups.py): строка на (district_key, hour),
+-- поэтому ни повторной агрегации, ни count(distinct) по зданиям не нужно. Фильтр по окну
+-- времени и району идёт по первичному ключу (district_key, hour); district_id — из справочника
+-- core.districts (etl/flows/load_districts.py).
 select
-    ts,
-    district_id,
-    count(distinct building_id) as buildings_reporting,
-    sum(consumption) as sum_consumption,
-    sum(supply) as sum_supply,
-    sum(return) as sum_return,
-    avg(loss) as avg_loss
-from by_building
-group by ts, district_id
-order by ts, district_id
+    r.hour as ts,
+    d.district_id,
+    r.district_key,
+    r.buildings_reporting,
+    r.consumption as sum_consumption,
+    r.supply as sum_supply,
+    r.return as sum_return,
+    r.loss_avg as avg_loss
+from core.rollup_hourly_district r
+join core.districts d
+  on d.district_key = r.district_key
@@ -0,0 +1,157 @@
+"""
+etl.flows.coverage
+------------------
+Индекс полноты данных по счётчикам: core.meter_day_coverage (meter_id, day) с
+24-битной маской часов hours_mask (бит h — есть измерение за час h суток,
+сутки и часы в Settings.default_tz).
+
+Маска обновляется в load только для вставленных измерений (bit_or по суткам,
+затем OR с уже сохранённой маской), поэтому запрос пропусков читает одну строку
+на счётчик и сутки и не зависит от числа измерений:
+
+  - core.meter_gaps(date_from, date_to) — SQL-функция: каждый счётчик и каждые
+    сутки диапазона (включая сутки без данных) с числом часов, процентом полноты
+    и списком пропущенных часов;
+  - core.meter_coverage — view по суткам, где данные есть;
+  - meter_gaps(settings, ...) — то же из Python с фильтром по счётчикам/зданиям.
+
+Таблица и индекс создаются в etl/sql/init_core.sql, а не в транзакции загрузки.
+"""
+
+from datetime import date
+from typing import Iterable, List, Optional
+
+from etl.utils.db import advisory_xact_lock, get_conn
+from etl.utils.logger import get_logger
+from etl.utils.schema import init_done, mark_init_done
+
+log = get_logger(__name__)
+
+HOURS_PER_DAY = 24
+
+
+_SQL_MARK = """
+insert into core.meter_day_coverage as c (meter_id, day, hours_mask, updated_at)
+select
+    meter_id,
+    (ts at time zone %(tz)s)::date as day,
+    bit_or(1 << extract(hour from ts at time zone %(tz)s)::int) as hours_mask,
+    now()
+from {source}
+group by 1, 2
+on conflict (meter_id, day) do update set
+    hours_mask = c.hours_mask | excluded.hours_mask,
+    updated_at = excluded.updated_at
+where c.hours_mask | excluded.hours_mask <> c.hours_mask
+"""
+
+
+def mark_coverage(cur, meter_ids, ts_list, tz: str) -> int:
+    """Добавляет часы пар (meter_id, ts) в маски их суток. Строки без новых часов не переписываются."""
+    if not meter_ids:
+        return 0
+    cur.execute(
+        _SQL_MARK.format(source="unnest(%(meter_ids)s::uuid[], %(ts)s::timestamptz[]) as m(meter_id, ts)"),
+        {"tz": tz, "meter_ids": list(meter_ids), "ts": list(ts_list)},
+    )
+    return cur.rowcount
+
+
+def ensure_coverage_initialized(cur, settings) -> bool:
+    """
+    Один раз строит индекс по всем core.measurements (первый запуск на базе с данными).
+    Выполненность отмечается в core.etl_init, а не по пустоте индекса: load заполняет его
+    раньше publish. Маски объединяются через OR, поэтому порядок относительно mark_coverage
+    в той же загрузке не важен.
+    """
+    advisory_xact_lock(cur, "core.meter_day_coverage")
+    if init_done(cur, "meter_day_coverage"):
+        return False
+    cur.execute(_SQL_MARK.format(source="core.measurements"), {"tz": settings.default_tz})
+    log.info("meter coverage initialized from core.measurements", extra={"rows": cur.rowcount})
+    mark_init_done(cur, "meter_day_coverage")
+    return True
+
+
+_SQL_GAPS_FUNCTION = f"""
+create or replace function core.meter_gaps(date_from date, date_to date)
+returns table (
+    meter_code text,
+    building_code text,
+    day date,
+    hours_present int,
+    coverage_pct numeric,
+    missing_hours int[]
+)
+language sql stable as $$
+    select
+        mt.external_code,
+        b.external_code,
+        d.day::date,
+        n.present,
+        round(100.0 * n.present / {HOURS_PER_DAY}, 1),
+        array(select h from generate_series(0, {HOURS_PER_DAY - 1}) h where x.mask & (1 << h) = 0)
+    from core.meters mt
+    join core.itp i on i.itp_id = mt.itp_id
+    join core.buildings b on b.building_id = i.building_id
+    cross join generate_series(date_from, date_to, interval '1 day') as d(day)
+    left join core.meter_day_coverage c on c.meter_id = mt.meter_id and c.day = d.day::date
+    cross join lateral (select coalesce(c.hours_mask, 0) as mask) x
+    cross join lateral (select length(replace(x.mask::bit({HOURS_PER_DAY})::text, '0', '')) as present) n
+$$;
+"""
+
+_SQL_COVERAGE_VIEW = f"""
+create or replace view core.meter_coverage as
+select
+    mt.external_code as meter_code,
+    b.external_code as building_code,
+    c.day,
+    c.hours_mask,
+    n.present as hours_present,
+    round(100.0 * n.present / {HOURS_PER_DAY}, 1) as coverage_pct,
+    array(select h from generate_series(0, {HOURS_PER_DAY - 1}) h where c.hours_mask & (1 << h) = 0) as missing_hours
+from core.meter_day_coverage c
+join core.meters mt on mt.meter_id = c.meter_id
+join core.itp i on i.itp_id = mt.itp_id
+join core.buildings b on b.building_id = i.building_id
+cross join lateral (select length(replace(c.hours_mask::bit({HOURS_PER_DAY})::text, '0', '')) as present) n;
+"""
+
+
+def publish_coverage_views(cur, settings):
+    """Индекс (с первичным наполнением), функция core.meter_gaps и view core.meter_coverage."""
+    ensure_coverage_initialized(cur, settings)
+    cur.execute(_SQL_GAPS_FUNCTION)
+    cur.execute(_SQL_COVERAGE_VIEW)
+
+
+def meter_gaps(
+    settings,
+    date_from: date,
+    date_to: date,
+    meters: Optional[Iterable[str]] = None,
+    buildings: Optional[Iterable[str]] = None,
+    only_incomplete: bool = True,
+) -> List[dict]:
+    """
+    Полнота по счётчикам и суткам [date_from, date_to] (включительно, сутки в DEFAULT_TZ):
+    meter_code, building_code, day, hours_present, coverage_pct, missing_hours.
+    only_incomplete=True — только сутки с пропусками.
+    """
+    where, params = [], [date_from, date_to]
+    if meters:
+        where.append("meter_code = any(%s)")
+        params.append(list(meters))
+    if buildings:
+        where.append("building_code = any(%s)")
+        params.append(list(buildings))
+    if only_incomplete:
+        where.append(f"hours_present < {HOURS_PER_DAY}")
+    sql = "select * from core.meter_gaps(%s, %s)"
+    if where:
+        sql += " where " + " and ".join(where)
+    sql += " order by building_code, meter_code, day"
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
@@ -0,0 +1,315 @@
+"""
+etl.flows.detect_anomalies
+--------------------------
+Детектор аномалий потерь (loss = supply - return) и ΔT = T1 - T2 по часовым
+агрегатам зданий (core.rollup_hourly), запускается после publish.
+
+Обрабатываются только часы, обновлённые с прошлого запуска: watermark по
+core.rollup_hourly.updated_at хранится в quality.detector_state. Граница
+нового watermark не заходит дальше начала самой старой активной транзакции
+(в том числе ещё ничего не записавшей) — строки, которые параллельная загрузка
+ещё не закоммитила, попадут в следующий запуск. Запуски детектора
+сериализуются advisory-блокировкой до commit.
+
+Проверки (векторно, pandas/NumPy по порции строк):
+  - delta_t_low / delta_t_high — ΔT вне норматива [DELTA_T_MIN, DELTA_T_MAX];
+  - loss_high / loss_low — z-оценка потерь относительно базовой линии здания
+    больше ANOMALY_Z (утечка) или меньше -ANOMALY_Z (обратка больше подачи);
+  - delta_t_drift — |z| ΔT относительно базовой линии здания больше ANOMALY_Z.
+Базовая линия (число часов, вес, среднее и сумма квадратов отклонений для
+loss и ΔT) хранится в quality.building_baseline строкой на здание и обновляется
+слиянием взвешенных статистик порции (Chan/Welford), без перечитывания истории:
+стоимость запуска зависит только от числа новых часов. Вес часа убывает вдвое
+за ANOMALY_HALFLIFE_HOURS, поэтому после смены режима здания (новое оборудование,
+другая схема) базовая линия подстраивается, а не помечает здание навсегда.
+Значения за пределами ±ANOMALY_Z σ не исключаются, а обрезаются до границы:
+единичный выброс почти не сдвигает линию, устойчивый сдвиг — сдвигает. В базу
+идут только часы новее last_hour здания; z-оценки считаются после
+ANOMALY_MIN_HOURS часов истории.
+
+Результат — quality.anomalies (building_key, hour, kind): для обработанных часов
+строки перезаписываются, поэтому исправленные данные снимают устаревшие аномалии.
+Первый запуск (watermark ещё нет) только строит базовые линии по всей истории
+и аномалий не пишет. Таблицы quality.* создаются в etl/sql/init_core.sql.
+"""
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from psycopg.rows import tuple_row
+
+from etl.utils.db import advisory_xact_lock, get_conn, stream_rows
+from etl.utils.logger import get_logger
+
+log = get_logger(__name__)
+
+DETECTOR = "hourly_balance"
+
+_HOURLY_COLUMNS = ["building_key", "hour", "loss", "t1_avg", "t2_avg"]
+_BASELINE_COLUMNS = [
+    "building_key", "last_hour",
+    "loss_n", "loss_w", "loss_mean", "loss_m2",
+    "dt_n", "dt_w", "dt_mean", "dt_m2",
+]
+_ANOMALY_COLUMNS = ["building_key", "hour", "kind", "value", "expected", "score"]
+
+
+def _load_baseline(cur) -> pd.DataFrame:
+    cur.execute(f"select {', '.join(_BASELINE_COLUMNS)} from quality.building_baseline")
+    baseline = pd.DataFrame(cur.fetchall(), columns=_BASELINE_COLUMNS)
+    baseline["last_hour"] = pd.to_datetime(baseline["last_hour"], utc=True)
+    for col in _BASELINE_COLUMNS[2:]:
+        baseline[col] = baseline[col].astype("float64")
+    return baseline.set_index("building_key")
+
+
+def _spread(n: pd.Series, w: pd.Series, m2: pd.Series, min_hours: int) -> pd.Series:
+    """Взвешенное стандартное отклонение базовой линии; NaN, пока истории меньше min_hours или разброс нулевой."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(m2 / w)
+    return std.where((n >= max(min_hours, 2)) & (std > 0))
+
+
+def _zscore(values: pd.Series, n: pd.Series, w: pd.Series, mean: pd.Series, m2: pd.Series, min_hours: int) -> pd.Series:
+    """z-оценка по базовой линии; NaN, пока истории меньше min_hours или разброс нулевой."""
+    return (values - mean) / _spread(n, w, m2, min_hours)
+
+
+def detect(hourly: pd.DataFrame, baseline: pd.DataFrame, settings) -> pd.DataFrame:
+    """
+    hourly: building_key, hour, loss, t1_avg, t2_avg; baseline — по building_key (состояние до порции).
+    Возвращает аномалии (_ANOMALY_COLUMNS).
+    """
+    z = settings.anomaly_z
+    df = hourly.join(baseline, on="building_key")
+    dt = df["t1_avg"] - df["t2_avg"]
+    loss_z = _zscore(df["loss"], df["loss_n"], df["loss_w"], df["loss_mean"], df["loss_m2"], settings.anomaly_min_hours)
+    dt_z = _zscore(dt, df["dt_n"], df["dt_w"], df["dt_mean"], df["dt_m2"], settings.anomaly_min_hours)
+
+    checks = (
+        ("delta_t_low", dt < settings.delta_t_min, dt, settings.delta_t_min, dt - settings.delta_t_min),
+        ("delta_t_high", dt > settings.delta_t_max, dt, settings.delta_t_max, dt - settings.delta_t_max),
+        ("delta_t_drift", dt_z.abs() > z, dt, df["dt_mean"], dt_z),
+        ("loss_high", loss_z > z, df["loss"], df["loss_mean"], loss_z),
+        ("loss_low", loss_z < -z, df["loss"], df["loss_mean"], loss_z),
+    )
+    frames = []
+    for kind, mask, value, expected, score in checks:
+        mask = mask.fillna(False).to_numpy(dtype=bool)
+        if not mask.any():
+            continue
+        expected = pd.Series(expected, index=df.index) if np.isscalar(expected) else expected
+        frames.append(
+            pd.DataFrame(
+                {
+                    "building_key": df["building_key"][mask],
+                    "hour": df["hour"][mask],
+                    "kind": kind,
+                    "value": value[mask],
+                    "expected": expected[mask],
+                    "score": score[mask],
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=_ANOMALY_COLUMNS)
+
+
+def _winsorize(keys: pd.Series, values: pd.Series, baseline: pd.DataFrame, prefix: str, settings) -> pd.Series:
+    """Обрезает значения до mean ± ANOMALY_Z σ базовой линии здания (пока σ нет — без изменений)."""
+    mean = keys.map(baseline[f"{prefix}_mean"])
+    std = _spread(
+        keys.map(baseline[f"{prefix}_n"]), keys.map(baseline[f"{prefix}_w"]), keys.map(baseline[f"{prefix}_m2"]),
+        settings.anomaly_min_hours,
+    )
+    lo, hi = mean - settings.anomaly_z * std, mean + settings.anomaly_z * std
+    return values.mask(values < lo, lo).mask(values > hi, hi)
+
+
+def _merge_stats(baseline: pd.DataFrame, keys: pd.Series, values: pd.Series, weights: pd.Series, prefix: str) -> pd.DataFrame:
+    """
+    Сливает взвешенные count/weight/mean/M2 порции в базовую линию (параллельный вариант
+    алгоритма Уэлфорда с весами). Базовая линия уже приведена к моменту last_hour порции.
+    """
+    part = pd.DataFrame({"k": keys, "v": values, "w": weights}).dropna()
+    if part.empty:
+        return baseline
+    by_key = part.groupby("k")
+    n_b = by_key["v"].count().astype("float64")
+    w_b = by_key["w"].sum()
+    mean_b = (part["v"] * part["w"]).groupby(part["k"]).sum() / w_b
+    m2_b = (part["w"] * (part["v"] - part["k"].map(mean_b)) ** 2).groupby(part["k"]).sum()
+
+    prior = baseline.reindex(w_b.index)
+    n_a = prior[f"{prefix}_n"].fillna(0.0)
+    w_a = prior[f"{prefix}_w"].fillna(0.0)
+    mean_a = prior[f"{prefix}_mean"].fillna(0.0)
+    m2_a = prior[f"{prefix}_m2"].fillna(0.0)
+
+    w = w_a + w_b
+    delta = mean_b - mean_a
+    baseline.loc[w_b.index, f"{prefix}_n"] = n_a + n_b
+    baseline.loc[w_b.index, f"{prefix}_w"] = w
+    baseline.loc[w_b.index, f"{prefix}_mean"] = mean_a + delta * w_b / w
+    baseline.loc[w_b.index, f"{prefix}_m2"] = m2_a + m2_b + delta ** 2 * w_a * w_b / w
+    return baseline
+
+
+def update_baseline(baseline: pd.DataFrame, hourly: pd.DataFrame, settings) -> pd.DataFrame:
+    """
+    Добавляет в базовую линию часы новее last_hour здания. Прежний вес и M2 затухают до нового
+    last_hour, вес часа порции — 0.5 ** (часов до last_hour / ANOMALY_HALFLIFE_HOURS);
+    значения обрезаются по базовой линии до порции (_winsorize).
+    """
+    last = hourly["building_key"].map(baseline["last_hour"])
+    fresh = last.isna() | (hourly["hour"] > last)
+    if not fresh.any():
+        return baseline
+    part = hourly[fresh]
+    keys = part["building_key"]
+    loss = _winsorize(keys, part["loss"], baseline, "loss", settings)
+    dt = _winsorize(keys, part["t1_avg"] - part["t2_avg"], baseline, "dt", settings)
+
+    baseline = baseline.reindex(baseline.index.union(keys.unique()))
+    newest = part.groupby("building_key")["hour"].max()
+    halflife = pd.Timedelta(hours=settings.anomaly_halflife_hours)
+    # затухание накопленного: от прежнего last_hour до нового (у новых зданий накопленного нет)
+    decay = 0.5 ** ((newest - baseline.loc[newest.index, "last_hour"]) / halflife).fillna(0.0)
+    for col in ("loss_w", "loss_m2", "dt_w", "dt_m2"):
+        baseline.loc[newest.index, col] = baseline.loc[newest.index, col] * decay
+    weights = 0.5 ** ((keys.map(newest) - part["hour"]) / halflife)
+
+    baseline = _merge_stats(baseline, keys, loss, weights, "loss")
+    baseline = _merge_stats(baseline, keys, dt, weights, "dt")
+    baseline.loc[newest.index, "last_hour"] = newest
+    return baseline
+
+
+def _records(df: pd.DataFrame, columns) -> list:
+    records = df[list(columns)].astype(object)
+    return list(records.where(records.notna(), None).itertuples(index=False, name=None))
+
+
+def _write_anomalies(cur, hourly: pd.DataFrame, anomalies: pd.DataFrame):
+    # обработанные часы перезаписываются целиком: исправленные данные снимают старые аномалии
+    cur.execute(
+        """
+        delete from quality.anomalies a
+        using unnest(%s::int[], %s::timestamptz[]) as p(building_key, hour)
+        where a.building_key = p.building_key and a.hour = p.hour
+        """,
+        (hourly["building_key"].tolist(), list(hourly["hour"].dt.to_pydatetime())),
+    )
+    if anomalies.empty:
+        return
+    cur.executemany(
+        f"""
+        insert into quality.anomalies ({", ".join(_ANOMALY_COLUMNS)})
+        values ({", ".join(["%s"] * len(_ANOMALY_COLUMNS))})
+        """,
+        _records(anomalies, _ANOMALY_COLUMNS),
+    )
+
+
+def _write_baseline(cur, baseline: pd.DataFrame, keys):
+    rows = baseline.loc[sorted(keys)].reset_index().rename(columns={"index": "building_key"})
+    for col in ("loss_n", "dt_n"):
+        rows[col] = rows[col].fillna(0).astype("int64")
+    cur.executemany(
+        f"""
+        insert into quality.building_baseline ({", ".join(_BASELINE_COLUMNS)}, updated_at)
+        values ({", ".join(["%s"] * len(_BASELINE_COLUMNS))}, now())
+        on conflict (building_key) do update set
+            {", ".join(f"{c} = excluded.{c}" for c in _BASELINE_COLUMNS[1:])},
+            updated_at = excluded.updated_at
+        """,
+        _records(rows, _BASELINE_COLUMNS),
+    )
+
+
+def flow_detect_anomalies(settings) -> Dict[str, int]:
+    """Проверяет часы core.rollup_hourly, обновлённые с прошлого запуска. Возвращает число аномалий по видам."""
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        try:
+            cur.execute("select to_regclass('core.rollup_hourly') is not null as present")
+            if not cur.fetchone()["present"]:
+                log.info("detect_anomalies: core.rollup_hourly not found, nothing to check")
+                return {}
+            # параллельный запуск (publish нескольких процессов) ждёт commit этого: watermark и базовые
+            # линии читаются и пишутся одним запуском за раз
+            advisory_xact_lock(cur, f"quality.detector_state:{DETECTOR}")
+
+            cur.execute("select watermark from quality.detector_state where detector = %s", (DETECTOR,))
+            row = cur.fetchone()
+            watermark = row["watermark"] if row else None
+            # незакоммиченные строки параллельных загрузок получат updated_at не раньше начала их транзакции;
+            # транзакция могла ещё ничего не записать (нет backend_xid), поэтому берутся все активные
+            cur.execute(
+                """
+                select least(
+                    (select max(updated_at) from core.rollup_hourly),
+                    (select min(xact_start) - interval '1 microsecond'
+                     from pg_stat_activity
+                     where xact_start is not null
+                       and datname = current_database()
+                       and backend_type = 'client backend'
+                       and pid <> pg_backend_pid())
+                ) as upper
+                """
+            )
+            upper = cur.fetchone()["upper"]
+            if upper is None or (watermark is not None and upper <= watermark):
+                log.info("detect_anomalies: no refreshed hours")
+                return {}
+
+            baseline = _load_baseline(cur)
+            touched, counts, hours = set(), {}, 0
+            for rows in stream_rows(
+                conn,
+                """
+                select building_key, hour, loss, t1_avg, t2_avg
+                from core.rollup_hourly
+                where updated_at > coalesce(%s, '-infinity'::timestamptz)
+                  and updated_at <= %s
+                order by building_key, hour
+                """,
+                (watermark, upper),
+                chunk_size=settings.stream_chunk_size,
+                name="detect_hourly",
+                row_factory=tuple_row,
+            ):
+                hourly = pd.DataFrame(rows, columns=_HOURLY_COLUMNS)
+                hourly["hour"] = pd.to_datetime(hourly["hour"], utc=True)
+                for col in _HOURLY_COLUMNS[2:]:
+                    hourly[col] = hourly[col].astype("float64")
+                hours += len(hourly)
+
+                if watermark is not None:
+                    # первый запуск (watermark нет): история только обучает базовые линии
+                    anomalies = detect(hourly, baseline, settings)
+                    _write_anomalies(cur, hourly, anomalies)
+                    for kind, n in anomalies["kind"].value_counts().items():
+                        counts[kind] = counts.get(kind, 0) + int(n)
+                baseline = update_baseline(baseline, hourly, settings)
+                touched.update(hourly["building_key"].unique().tolist())
+
+            if touched:
+                _write_baseline(cur, baseline, touched & set(baseline.index))
+            cur.execute(
+                """
+                insert into quality.detector_state (detector, watermark, updated_at)
+                values (%s, %s, now())
+                on conflict (detector) do update set watermark = excluded.watermark, updated_at = excluded.updated_at
+                """,
+                (DETECTOR, upper),
+            )
+            conn.commit()
+            log.info(
+                "detect_anomalies completed",
+                extra={"hours": hours, "buildings": len(touched), "bootstrap": watermark is None, "anomalies": counts},
+            )
+            return counts
+        except Exception as e:
+            conn.rollback()
+            log.error("detect_anomalies failed", extra={"error": str(e)})
+            raise
@@ -4,83 +4,87 @@ etl.flows.enrich_features
 Добавляет вычисляемые признаки (например, timezone, hour, day_of_week)
 в таблицу stage.stage_parsed_measurements или в отдельную таблицу features.
 
-Здесь простая функция: для каждого parsed row записывает дополнительные поля:
+Для каждого parsed row записываются дополнительные поля (строки stage читаются
+порциями по STREAM_CHUNK_SIZE через server-side курсор):
   - ts_hour (timestamp truncated to hour)
   - dow (day of week)
   - is_weekend (boolean)
 
-(Мы не меняем существующую структуру parsed_measurements, а создаём/обновляем
-вспомогательную таблицу stage.stage_parsed_measurements_enriched для упрощения)
+Попутно расширяется календарь features.time_attributes на диапазон дат load_id
+(см. etl.flows.time_attributes).
+
+(Мы не меняем существующую структуру parsed_measurements, а пишем во
+вспомогательную таблицу stage.stage_parsed_measurements_enriched, секционированную
+по load_id — см. etl/utils/stage_partitions.py)
 """
 
-from etl.utils.db import get_conn
+from psycopg.rows import tuple_row
+
+from etl.utils.db import get_conn, stream_rows
+from etl.utils import work_queue
 from etl.utils.logger import get_logger
+from etl.utils.stage_partitions import ensure_load_partition, truncate_load_partition
+from etl.flows.time_attributes import extend_time_attributes
 
 log = get_logger(__name__)
 
 
-def _ensure_enriched_table(cur):
-    cur.execute("create schema if not exists stage;")
-    cur.execute(
-        """
-        create table if not exists stage.stage_parsed_measurements_enriched (
-            load_id uuid not null,
-            row_num int not null,
-            ts_hour timestamptz,
-            dow int,
-            is_weekend boolean,
-            inserted_at timestamptz default now()
-        );
-        """
-    )
-
-
-def flow_enrich_features(settings, load_id: str):
+def flow_enrich_features(settings, load_id: str, worker: str = None):
     log.info("enrich_features start", extra={"load_id": load_id})
+    ensure_load_partition(settings, "stage_parsed_measurements_enriched", load_id)
     with get_conn(settings) as conn, conn.cursor() as cur:
         try:
-            _ensure_enriched_table(cur)
-
-            # удаляем старые обогащения для идемпотентности
-            cur.execute("delete from stage.stage_parsed_measurements_enriched where load_id = %s", (load_id,))
+            # старые обогащения load_id — truncate его секции (идемпотентность без мёртвых строк)
+            truncate_load_partition(cur, "stage_parsed_measurements_enriched", load_id)
 
-            # получаем parsed rows
-            cur.execute(
+            # читаем parsed rows порциями через server-side курсор и пишем каждую порцию до чтения следующей
+            inserted = 0
+            ts_from = ts_to = None
+            for rows in stream_rows(
+                conn,
                 """
-                select load_id, row_num, ts
+                select row_num, ts
                 from stage.stage_parsed_measurements
                 where load_id = %s
                 order by row_num
                 """,
                 (load_id,),
-            )
-            rows = cur.fetchall()
-            inserted = 0
-            for r in rows:
-                row_num = r["row_num"]
-                ts = r["ts"]
-                if ts is None:
-                    ts_hour = None
-                    dow = None
-                    is_weekend = None
-                else:
+                chunk_size=settings.stream_chunk_size,
+                name="enrich_stage",
+                row_factory=tuple_row,
+            ):
+                records = []
+                for row_num, ts in rows:
+                    if ts is None:
+                        records.append((load_id, row_num, None, None, None))
+                        continue
                     # ts — это Python datetime (pydatetime)
-                    ts_hour = ts.replace(minute=0, second=0, microsecond=0)
                     dow = ts.weekday()  # 0=Mon .. 6=Sun
-                    is_weekend = True if dow >= 5 else False
+                    records.append((load_id, row_num, ts.replace(minute=0, second=0, microsecond=0), dow, dow >= 5))
+                    ts_from = ts if ts_from is None or ts < ts_from else ts_from
+                    ts_to = ts if ts_to is None or ts > ts_to else ts_to
 
-                cur.execute(
+                cur.executemany(
                     """
                     insert into stage.stage_parsed_measurements_enriched
                         (load_id, row_num, ts_hour, dow, is_weekend)
                     values (%s, %s, %s, %s, %s)
                     """,
-                    (load_id, row_num, ts_hour, dow, is_weekend),
+                    records,
                 )
-                inserted += 1
+                inserted += len(records)
 
+            calendar_added = extend_time_attributes(cur, settings, ts_from, ts_to)
+
+            # воркер очереди фиксирует результат, только пока аренда загрузки его
+            work_queue.assert_lease(cur, load_id, worker)
             conn.commit()
-            log.info("enrich_features: записаны атрибуты времени для load_id=%s", load_id, extra={"inserted": inserted})
+            log.info(
+                "enrich_features: записаны атрибуты времени для load_id=%s",
+                load_id,
+                extra={"inserted": inserted, "calendar_added": calendar_added},
+            )
+            return inserted
         except Exception as e:
             conn.rollback()
             log.error("enrich_features failed", extra={"load_id": load_id, "error": str(e)})
@@ -0,0 +1,172 @@
+"""
+etl.flows.export_parquet
+------------------------
+Экспорт ML-витрин в Parquet для обучающих джобов (чтобы не читать их из OLTP Postgres).
+
+Датасеты (каталог Settings.export_dir):
+  - ml_hourly_by_building/day=YYYY-MM-DD/building=<building_code>/part-0.parquet
+  - ml_hourly_by_district/day=YYYY-MM-DD/district=<district_id>/part-0.parquet
+
+Экспорт инкрементальный: перезаписываются только партиции (день в DEFAULT_TZ +
+здание/район), затронутые текущими load_id, и переданные явно (extra_partitions —
+например, районы, чей состав зданий изменил справочник etl/flows/load_districts.py). Каждый датасет сопровождается
+_manifest.json со списком партиций, временем обновления и возрастающей версией —
+читатели сравнивают version/updated_at и подхватывают новые партиции.
+Файлы пишутся во временный и атомарно переименовываются.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import orjson
+
+from etl.utils.db import get_conn
+from etl.utils.logger import get_logger
+
+log = get_logger(__name__)
+
+NULL_PARTITION = "__null__"
+
+# (view в features, колонка второго уровня партиционирования, имя ключа в пути)
+EXPORTS = (
+    ("ml_hourly_by_building", "building_code", "building"),
+    ("ml_hourly_by_district", "district_id", "district"),
+)
+
+
+def _touched_partitions(cur, settings, load_ids: List[str]) -> Dict[str, set]:
+    """Возвращает {partition_column: {(day, key), ...}} для данных load_ids."""
+    cur.execute(
+        """
+        select distinct
+            (s.ts at time zone %s)::date as day,
+            s.building_code,
+            b.district_id
+        from stage.stage_parsed_measurements s
+        left join core.buildings b on b.external_code = s.building_code
+        where s.load_id = any(%s::uuid[])
+          and s.ts is not null
+          and s.quality is distinct from 'bad'
+        """,
+        (settings.default_tz, list(load_ids)),
+    )
+    touched = defaultdict(set)
+    for r in cur.fetchall():
+        touched["building_code"].add((r["day"], r["building_code"]))
+        touched["district_id"].add((r["day"], r["district_id"]))
+    return touched
+
+
+def _view_exists(cur, name: str) -> bool:
+    cur.execute("select to_regclass(%s) is not null as present", (f"features.{name}",))
+    return cur.fetchone()["present"]
+
+
+def _write_parquet(rows: List[dict], path: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    pq.write_table(pa.Table.from_pylist(rows), tmp)
+    os.replace(tmp, path)
+
+
+def _load_manifest(path: str, dataset: str, partitioning: List[str]) -> dict:
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    return {"dataset": dataset, "partitioning": partitioning, "version": 0, "partitions": {}}
+
+
+def _save_manifest(manifest: dict, path: str):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    os.replace(tmp, path)
+
+
+def _export_view(cur, settings, view: str, column: str, path_key: str, partitions: set, load_ids: List[str]) -> int:
+    days = sorted(d for d, _ in partitions)
+    keys = sorted({k for _, k in partitions if k is not None})
+    with_null = any(k is None for _, k in partitions)
+
+    cur.execute(
+        f"""
+        select v.*, (v.ts at time zone %(tz)s)::date as _day
+        from features.{view} v
+        where v.ts >= (%(day_from)s::timestamp at time zone %(tz)s)
+          and v.ts < (%(day_to)s::timestamp at time zone %(tz)s)
+          and (v.{column} = any(%(keys)s) or (%(with_null)s and v.{column} is null))
+        """,
+        {
+            "tz": settings.default_tz,
+            "day_from": days[0],
+            "day_to": days[-1] + timedelta(days=1),
+            "keys": keys,
+            "with_null": with_null,
+        },
+    )
+    grouped = defaultdict(list)
+    for r in cur.fetchall():
+        day = r.pop("_day")
+        if (day, r[column]) in partitions:
+            grouped[(day, r[column])].append(r)
+
+    root = os.path.join(settings.export_dir, view)
+    manifest_path = os.path.join(root, "_manifest.json")
+    os.makedirs(root, exist_ok=True)
+    manifest = _load_manifest(manifest_path, view, ["day", path_key])
+    now = datetime.now(timezone.utc).isoformat()
+
+    written = 0
+    for day, key in sorted(partitions, key=lambda p: (p[0], str(p[1]))):
+        rel = os.path.join(f"day={day.isoformat()}", f"{path_key}={key if key is not None else NULL_PARTITION}")
+        file_path = os.path.join(root, rel, "part-0.parquet")
+        rows = grouped.get((day, key))
+        if rows:
+            _write_parquet(rows, file_path)
+            manifest["partitions"][rel] = {"rows": len(rows), "updated_at": now, "load_ids": list(load_ids)}
+            written += 1
+        else:
+            # данных больше нет — партиция не должна отдавать устаревшие строки
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+            manifest["partitions"].pop(rel, None)
+
+    manifest["version"] = int(manifest.get("version", 0)) + 1
+    manifest["updated_at"] = now
+    _save_manifest(manifest, manifest_path)
+    return written
+
+
+def flow_export_parquet(
+    settings, load_ids: Optional[List[str]], extra_partitions: Optional[Dict[str, set]] = None
+) -> Dict[str, int]:
+    """
+    Перезаписывает Parquet-партиции витрин, затронутые load_ids, и extra_partitions
+    ({partition_column: {(day, key), ...}}).
+    """
+    load_ids = list(load_ids or [])
+    extra_partitions = {k: v for k, v in (extra_partitions or {}).items() if v}
+    if not load_ids and not extra_partitions:
+        log.info("export_parquet: no load_ids, nothing to export")
+        return {}
+
+    result = {}
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        touched = _touched_partitions(cur, settings, load_ids) if load_ids else defaultdict(set)
+        for column, partitions in extra_partitions.items():
+            touched[column] |= set(partitions)
+        for view, column, path_key in EXPORTS:
+            partitions = touched.get(column)
+            if not partitions:
+                continue
+            if not _view_exists(cur, view):
+                log.warning("export_parquet: view features.%s not found (dbt not run?)", view)
+                continue
+            result[view] = _export_view(cur, settings, view, column, path_key, partitions, load_ids)
+            log.info("export_parquet: %s partitions written", result[view], extra={"view": view})
+    return result
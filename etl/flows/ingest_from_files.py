@@ -12,6 +12,8 @@ etl.flows.ingest_from_files
   - detected_to timestamp with time zone
   - rows int
   - inserted_at timestamptz default now()
+  - purged_at timestamptz — stage-данные загрузки удалены по retention
+  - status, attempts, leased_by, lease_until, heartbeat_at, last_error — очередь загрузок (etl/utils/work_queue.py)
 
 Возвращает (через лог) список load_id'ов и возращает список из функций.
 """
@@ -21,10 +23,12 @@ import uuid
 from datetime import datetime
 from typing import List, Tuple, Optional
 
-import pandas as pd
-
 from etl.utils.logger import get_logger
 from etl.utils.db import get_conn
+from etl.utils.io import open_table_file
+from etl.utils.stage_partitions import create_load_partitions
+from etl.utils.validation import parse_timestamps
+from etl.utils.work_queue import ensure_queue_columns
 
 log = get_logger(__name__)
 
@@ -47,62 +51,71 @@ def _ensure_stage_tables(cur):
         );
         """
     )
+    # stage-секции загрузки удалены по retention (etl/utils/stage_partitions.py); строка реестра остаётся
+    cur.execute("alter table stage.stage_raw_files add column if not exists purged_at timestamptz;")
+    # колонки очереди загрузок (status, attempts, аренда) для --worker / --coordinator
+    ensure_queue_columns(cur)
 
 
-def _scan_file_for_range(path: str) -> Tuple[Optional[datetime], Optional[datetime], int]:
+def _scan_file_for_range(path: str, default_tz: str = "UTC") -> Tuple[Optional[datetime], Optional[datetime], int]:
     """
     Простейший эвристический определитель диапазона дат в файле.
-    Попытка прочитать весь первый лист через pandas и найти min/max
+    Читает все листы (книга открывается один раз) и ищет min/max
     в колонках похожих на дату (ts, timestamp, date, время и т.п.)
-    Возвращает (min_ts, max_ts, rows)
+    Возвращает (min_ts, max_ts, rows) по всем листам.
     """
-    try:
-        df = pd.read_excel(path, sheet_name=0, engine="openpyxl")
-    except Exception:
-        # попытаемся без engine
-        df = pd.read_excel(path, sheet_name=0)
-
-    rows = len(df.index)
-
-    # Найдём возможные колонки даты/времени
-    date_cols = [c for c in df.columns if any(k in c.lower() for k in ("ts", "time", "date", "дата", "время"))]
-    if not date_cols:
-        return None, None, rows
-
-    # Попробуем привести к datetime и взять min/max
-    for c in date_cols:
-        try:
-            s = pd.to_datetime(df[c], errors="coerce")
-            if s.notna().any():
-                mn = s.min()
-                mx = s.max()
-                return mn.to_pydatetime(), mx.to_pydatetime(), rows
-        except Exception:
-            continue
+    rows = 0
+    mn = mx = None
+    with open_table_file(path) as (sheet_names, read_sheet):
+        for name in sheet_names:
+            df = read_sheet(name)
+            rows += len(df.index)
+
+            # Найдём возможные колонки даты/времени
+            date_cols = [c for c in df.columns if any(k in str(c).lower() for k in ("ts", "time", "date", "дата", "время"))]
+
+            # Попробуем привести к datetime и взять min/max (первая подходящая колонка листа)
+            for c in date_cols:
+                try:
+                    s = parse_timestamps(df[c], default_tz, cache_key=str(c).strip().lower())
+                    if s.notna().any():
+                        smn, smx = s.min().to_pydatetime(), s.max().to_pydatetime()
+                        mn = smn if mn is None or smn < mn else mn
+                        mx = smx if mx is None or smx > mx else mx
+                        break
+                except Exception:
+                    continue
 
-    return None, None, rows
+    return mn, mx, rows
 
 
-def flow_ingest_from_files(settings) -> List[str]:
+def flow_ingest_from_files(settings, raw_dir: Optional[str] = None, paths: Optional[List[str]] = None) -> List[str]:
     """
-    Находит файлы в data/raw, регистрирует их в stage.stage_raw_files.
+    Находит файлы в raw_dir (по умолчанию Settings.raw_dir, иначе ./data/raw),
+    регистрирует их в stage.stage_raw_files. Если передан paths — регистрирует
+    только эти файлы (режим --watch), каталог не сканируется.
     Возвращает список load_id'ов (uuid strings).
     """
-    log.info("ingest start: scanning raw dir %s", RAW_DIR)
     files = []
-    if not os.path.isdir(RAW_DIR):
-        log.warning("Raw dir %s not found", RAW_DIR)
-        return []
-
-    for fname in os.listdir(RAW_DIR):
-        if fname.startswith("~$"):  # временные файлы Excel
-            continue
-        if not (fname.lower().endswith(".xlsx") or fname.lower().endswith(".xls") or fname.lower().endswith(".csv")):
-            continue
-        files.append(os.path.join(RAW_DIR, fname))
+    if paths is not None:
+        files = [p for p in paths if os.path.isfile(p)]
+        raw_dir = "<paths>"
+    else:
+        raw_dir = raw_dir or getattr(settings, "raw_dir", None) or RAW_DIR
+        log.info("ingest start: scanning raw dir %s", raw_dir)
+        if not os.path.isdir(raw_dir):
+            log.warning("Raw dir %s not found", raw_dir)
+            return []
+
+        for fname in os.listdir(raw_dir):
+            if fname.startswith("~$"):  # временные файлы Excel
+                continue
+            if not (fname.lower().endswith(".xlsx") or fname.lower().endswith(".xls") or fname.lower().endswith(".csv")):
+                continue
+            files.append(os.path.join(raw_dir, fname))
 
     if not files:
-        log.info("No files found in %s", RAW_DIR)
+        log.info("No files found in %s", raw_dir)
         return []
 
     load_ids = []
@@ -115,7 +128,7 @@ def flow_ingest_from_files(settings) -> List[str]:
                 load_id = str(uuid.uuid4())
                 # try to detect date range / rows
                 try:
-                    dfrom, dto, rows = _scan_file_for_range(path)
+                    dfrom, dto, rows = _scan_file_for_range(path, settings.default_tz)
                 except Exception as e:
                     log.warning("Can't scan file for range %s: %s", path, e)
                     dfrom, dto, rows = None, None, None
@@ -135,5 +148,7 @@ def flow_ingest_from_files(settings) -> List[str]:
             log.error("ingest failed", extra={"error": str(e)})
             raise
 
+    # секции stage создаются до обработки загрузок: create partition блокирует всю таблицу
+    create_load_partitions(settings, load_ids)
     log.info("Ingest produced load_ids", extra={"count": len(load_ids), "ids": load_ids})
     return load_ids
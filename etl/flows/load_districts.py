@@ -0,0 +1,157 @@
+"""
+etl.flows.load_districts
+------------------------
+Справочник «здание -> район» из файла DISTRICTS_FILE (CSV/Excel, первый лист).
+
+Колонки: building_code, district_id и необязательная district_name
+(допускаются русские заголовки: здание / район / название района).
+
+Загрузка — одним пакетом через unnest: районы upsert'ятся в core.districts
+(целочисленный district_key), здания — в core.buildings (district_id и
+district_key; здания, которых ещё нет, создаются). Переписываются только
+здания, у которых район изменился; для районов, которых это коснулось (старых
+и новых), пересобирается core.rollup_hourly_district. Здания, отсутствующие
+в файле, район сохраняют.
+
+Партиции Parquet-экспорта этих районов (день, district_id) — и те, где строки
+появились, и те, где исчезли, — возвращаются вызывающему для перезаписи
+(etl.flows.export_parquet, extra_partitions).
+"""
+
+import os
+from typing import Set, Tuple
+
+from etl.utils.db import get_conn
+from etl.utils.io import open_table_file
+from etl.utils.logger import get_logger
+from etl.flows.rollups import rebuild_district_rollup
+
+log = get_logger(__name__)
+
+_COLUMN_ALIASES = {
+    "building_code": ("building_code", "building", "здание", "код здания"),
+    "district_id": ("district_id", "district", "район", "код района"),
+    "district_name": ("district_name", "название района"),
+}
+
+
+def _read_reference(path: str):
+    with open_table_file(path) as (sheets, read):
+        df = read(sheets[0])
+    columns = {str(c).strip().lower(): c for c in df.columns}
+    rename = {}
+    for target, aliases in _COLUMN_ALIASES.items():
+        found = next((columns[a] for a in aliases if a in columns), None)
+        if found is not None:
+            rename[found] = target
+    df = df.rename(columns=rename)
+    missing = [c for c in ("building_code", "district_id") if c not in df.columns]
+    if missing:
+        raise ValueError(f"Districts file {path} has no columns {missing}")
+    if "district_name" not in df.columns:
+        df["district_name"] = None
+
+    df = df[["building_code", "district_id", "district_name"]].dropna(subset=["building_code", "district_id"])
+    for col in ("building_code", "district_id"):
+        df[col] = df[col].astype(str).str.strip()
+    name = df["district_name"].astype(object)
+    df["district_name"] = name.where(name.notna(), None).map(lambda v: str(v).strip() or None if v is not None else None)
+    df = df[(df["building_code"] != "") & (df["district_id"] != "")]
+    # здание в файле несколько раз — действует последняя строка
+    return df.drop_duplicates(subset=["building_code"], keep="last")
+
+
+def _district_partitions(cur, settings, district_keys) -> Set[Tuple]:
+    """(день в DEFAULT_TZ, district_id), по которым у районов есть строки core.rollup_hourly_district."""
+    cur.execute(
+        """
+        select distinct (r.hour at time zone %s)::date as day, d.district_id
+        from core.rollup_hourly_district r
+        join core.districts d on d.district_key = r.district_key
+        where r.district_key = any(%s)
+        """,
+        (settings.default_tz, list(district_keys)),
+    )
+    return {(r["day"], r["district_id"]) for r in cur.fetchall()}
+
+
+def flow_load_districts(settings, path: str = None) -> Set[Tuple]:
+    """
+    Загружает справочник районов. Возвращает партиции экспорта (day, district_id)
+    районов, чей состав зданий изменился (пустое множество — изменений нет).
+    """
+    path = path or settings.districts_file
+    if not path:
+        return set()
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Districts file not found: {path}")
+
+    ref = _read_reference(path)
+    if ref.empty:
+        log.warning("load_districts: reference is empty", extra={"path": path})
+        return set()
+
+    districts = ref.drop_duplicates(subset=["district_id"], keep="last")
+
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        try:
+            cur.execute(
+                """
+                insert into core.districts as d (district_id, name)
+                select * from unnest(%s::text[], %s::text[])
+                on conflict (district_id) do update set name = coalesce(excluded.name, d.name)
+                where d.name is distinct from coalesce(excluded.name, d.name)
+                """,
+                (list(districts["district_id"]), list(districts["district_name"])),
+            )
+            codes, district_ids = list(ref["building_code"]), list(ref["district_id"])
+
+            # старые районы зданий, которые переезжают: их агрегат тоже нужно пересобрать
+            cur.execute(
+                """
+                select distinct b.district_key
+                from unnest(%s::text[], %s::text[]) as r(building_code, district_id)
+                join core.buildings b on b.external_code = r.building_code
+                join core.districts d on d.district_id = r.district_id
+                where b.district_key is not null and b.district_key <> d.district_key
+                """,
+                (codes, district_ids),
+            )
+            affected = {r["district_key"] for r in cur.fetchall()}
+
+            cur.execute(
+                """
+                insert into core.buildings as b (external_code, district_id, district_key)
+                select r.building_code, r.district_id, d.district_key
+                from unnest(%s::text[], %s::text[]) as r(building_code, district_id)
+                join core.districts d on d.district_id = r.district_id
+                on conflict (external_code) do update set
+                    district_id = excluded.district_id,
+                    district_key = excluded.district_key
+                where b.district_key is distinct from excluded.district_key
+                   or b.district_id is distinct from excluded.district_id
+                returning b.district_key
+                """,
+                (codes, district_ids),
+            )
+            changed = cur.fetchall()
+            affected |= {r["district_key"] for r in changed}
+
+            partitions, rollup_rows = set(), 0
+            if affected:
+                # дни, где у района были строки до пересборки, тоже перезаписываются (строки могли исчезнуть)
+                partitions = _district_partitions(cur, settings, affected)
+                rollup_rows = rebuild_district_rollup(cur, sorted(affected))
+                partitions |= _district_partitions(cur, settings, affected)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            log.error("Failed to load districts", extra={"path": path, "error": str(e)})
+            raise
+
+    log.info(
+        "load_districts completed",
+        extra={"districts": len(districts), "buildings_changed": len(changed),
+               "district_rollup_rows": rollup_rows, "export_partitions": len(partitions)},
+    )
+    return partitions
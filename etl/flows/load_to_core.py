@@ -1,6 +1,11 @@
-import uuid
+from psycopg.rows import tuple_row
+
+from etl.utils import work_queue
 from etl.utils.logger import get_logger
-from etl.utils.db import get_conn
+from etl.utils.db import get_conn, stream_rows
+from etl.flows.coverage import ensure_coverage_initialized, mark_coverage
+from etl.flows.rollups import ensure_rollups_initialized, lock_aggregates, mark_measurement_hours, refresh_rollups
+from etl.utils.readings import derive_intervals, fetch_reading_window, save_readings
 
 log = get_logger(__name__)
 
@@ -59,65 +64,195 @@ def get_or_create_meter(cur, itp_id: str, meter_code: str, metric: str, unit: st
     return row["meter_id"]
 
 
-def flow_load_to_core(settings, load_id: str):
+def _resolve_meters(cur, rows, cache: dict) -> dict:
+    """
+    Возвращает meter_id для каждого meter_code порции. Справочники создаются только
+    для кодов, которых ещё нет в cache (cache живёт всю загрузку).
+    """
+    for _ts, building_code, itp_code, meter_code, metric, _value, unit, _reading in rows:
+        if meter_code in cache["meter"]:
+            continue
+        building_id = cache["building"].get(building_code)
+        if building_id is None:
+            building_id = cache["building"][building_code] = get_or_create_building(cur, building_code)
+        itp_id = cache["itp"].get(itp_code)
+        if itp_id is None:
+            itp_id = cache["itp"][itp_code] = get_or_create_itp(cur, building_id, itp_code)
+        cache["meter"][meter_code] = get_or_create_meter(cur, itp_id, meter_code, metric, unit)
+    return cache["meter"]
+
+
+LOAD_MODES = ("upsert", "insert")
+
+# upsert: обновляются только строки, у которых значение действительно изменилось —
+# неизменённые повторы не переписываются (нет лишних версий строк, WAL и записей в индексы).
+# returning отдаёт только вставленные/изменённые строки; xmax = 0 у только что вставленных.
+_SQL_UPSERT = """
+insert into core.measurements as m (meter_id, ts, value, inserted_at)
+select meter_id, ts, value, now()
+from unnest(%s::uuid[], %s::timestamptz[], %s::double precision[]) as c(meter_id, ts, value)
+on conflict (meter_id, ts) do {action}
+returning m.meter_id, m.ts, (m.xmax = 0) as inserted
+"""
+
+_CONFLICT_ACTIONS = {
+    "upsert": "update set value = excluded.value, inserted_at = now() where m.value is distinct from excluded.value",
+    "insert": "nothing",
+}
+
+
+def upsert_measurements(cur, records, mode: str = "upsert", tz: str = "UTC") -> dict:
+    """
+    Пишет (meter_id, ts, value) одним запросом и помечает часы изменённых строк для refresh_rollups;
+    часы вставленных строк добавляются в индекс полноты core.meter_day_coverage (сутки в tz).
+    mode: upsert — исправленные значения обновляются; insert — существующие строки не трогаются.
+    Возвращает {"inserted", "updated", "unchanged"}.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown LOAD_MODE '{mode}'. Allowed: {LOAD_MODES}")
+    # один запрос не может изменить строку дважды — в пределах порции побеждает последняя
+    latest = {(meter_id, ts): value for meter_id, ts, value in records}
+    if not latest:
+        return {"inserted": 0, "updated": 0, "unchanged": 0}
+
+    keys = list(latest)
+    cur.execute(
+        _SQL_UPSERT.format(action=_CONFLICT_ACTIONS[mode]),
+        ([k[0] for k in keys], [k[1] for k in keys], list(latest.values())),
+    )
+    changed = cur.fetchall()
+    mark_measurement_hours(cur, [r["meter_id"] for r in changed], [r["ts"] for r in changed])
+    new_rows = [r for r in changed if r["inserted"]]
+    mark_coverage(cur, [r["meter_id"] for r in new_rows], [r["ts"] for r in new_rows], tz)
+
+    inserted = len(new_rows)
+    return {"inserted": inserted, "updated": len(changed) - inserted, "unchanged": len(latest) - len(changed)}
+
+
+def load_readings(cur, settings, load_id: str) -> dict:
+    """
+    Интервалы накопительных счётчиков загрузки (etl/utils/readings.py): показания сохраняются
+    в core.meter_readings, разности пересчитываются по окну истории вокруг загрузки — в том числе
+    первый интервал более поздней загрузки, если эта пришла не по порядку. Интервалы пишутся
+    в режиме upsert независимо от LOAD_MODE (это производные значения); интервалы, ставшие
+    заменой счётчика, удаляются. Выполняется под lock_aggregates.
+    """
+    saved = save_readings(cur, load_id)
+    intervals, replaced = derive_intervals(fetch_reading_window(cur, load_id))
+    if intervals.empty and replaced.empty:
+        return {"readings": saved, "inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    codes = sorted(set(intervals["meter_code"]) | set(replaced["meter_code"]))
+    cur.execute("select external_code, meter_id from core.meters where external_code = any(%s)", (codes,))
+    meters = {r["external_code"]: r["meter_id"] for r in cur.fetchall()}
+
+    intervals = intervals[intervals["meter_code"].isin(meters)]
+    counts = upsert_measurements(
+        cur,
+        zip(intervals["meter_code"].map(meters), intervals["ts"], intervals["value"].astype(float)),
+        "upsert",
+        settings.default_tz,
+    )
+
+    replaced = replaced[replaced["meter_code"].isin(meters)]
+    deleted = []
+    if not replaced.empty:
+        cur.execute(
+            """
+            delete from core.measurements m
+            using unnest(%s::uuid[], %s::timestamptz[]) as d(meter_id, ts)
+            where m.meter_id = d.meter_id and m.ts = d.ts
+            returning m.meter_id, m.ts
+            """,
+            (list(replaced["meter_code"].map(meters)), list(replaced["ts"])),
+        )
+        deleted = cur.fetchall()
+        mark_measurement_hours(cur, [r["meter_id"] for r in deleted], [r["ts"] for r in deleted])
+    return {"readings": saved, **counts, "deleted": len(deleted)}
+
+
+def flow_load_to_core(settings, load_id: str, worker: str = None):
     """
     Загружаем данные из stage.stage_parsed_measurements → core.measurements.
     Автоматически создаём справочники (buildings, itp, meters).
+    Stage читается порциями по STREAM_CHUNK_SIZE через server-side курсор;
+    каждая порция записывается до чтения следующей (LOAD_MODE: upsert / insert).
+    worker — воркер очереди: загрузка фиксируется, только пока его аренда действует (work_queue.assert_lease).
+    Возвращает число вставленных и изменённых строк.
     """
 
     with get_conn(settings) as conn, conn.cursor() as cur:
         log.info("Загружаем данные для load_id=%s", load_id)
+        try:
+            # строки, не прошедшие DQ, в core не попадают; фоллбеки кодов — как в parse
+            stage_rows = stream_rows(
+                conn,
+                """
+                select
+                    ts,
+                    coalesce(building_code, 'UNKNOWN_BUILDING') as building_code,
+                    coalesce(itp_code, coalesce(building_code, 'UNKNOWN_BUILDING') || '_ITP') as itp_code,
+                    coalesce(meter_code, coalesce(itp_code, coalesce(building_code, 'UNKNOWN_BUILDING') || '_ITP') || '_METER') as meter_code,
+                    coalesce(metric, 'consumption') as metric,
+                    value,
+                    coalesce(unit, 'm3') as unit,
+                    reading
+                from stage.stage_parsed_measurements
+                where load_id = %s
+                  and quality is distinct from 'bad'
+                order by row_num
+                """,
+                (load_id,),
+                chunk_size=settings.stream_chunk_size,
+                name="load_stage",
+                row_factory=tuple_row,
+            )
 
-        # читаем данные из stage
-        cur.execute("""
-            select row_num, ts, building_code, itp_code, meter_code, metric, value, unit
-            from stage.stage_parsed_measurements
-            where load_id = %s
-            order by row_num
-        """, (load_id,))
-        rows = cur.fetchall()
-
-        if not rows:
-            log.warning("Нет данных в stage для load_id=%s", load_id)
-            return
-
-        inserted = 0
-        for row in rows:
-            row_num = row["row_num"]
-            ts = row["ts"]
-            building_code = row["building_code"] or "UNKNOWN_BUILDING"
-            itp_code = row["itp_code"] or f"{building_code}_ITP"
-            meter_code = row["meter_code"] or f"{itp_code}_METER"
-            metric = row["metric"] or "consumption"
-            value = row["value"]
-            unit = row["unit"] or "m3"
-
-
-            try:
-                building_id = get_or_create_building(cur, building_code)
-                itp_id = get_or_create_itp(cur, building_id, itp_code)
-                meter_id = get_or_create_meter(cur, itp_id, meter_code, metric, unit)
-
-                measurement_id = str(uuid.uuid4())
-                cur.execute("""
-                    insert into core.measurements (measurement_id, meter_id, ts, value, inserted_at)
-                    values (%s, %s, %s, %s, now())
-                    on conflict (meter_id, ts) do nothing
-                """, (measurement_id, meter_id, ts, value))
-                inserted += cur.rowcount
-            except Exception as e:
-                log.error(
-                    "Ошибка при вставке",
-                    extra={
-                        "load_id": load_id,
-                        "row_num": row_num,
-                        "building": building_code,
-                        "itp": itp_code,
-                        "meter": meter_code,
-                        "metric": metric,
-                        "error": str(e),
-                    }
+            cache = {"building": {}, "itp": {}, "meter": {}}
+            read = 0
+            totals = {"inserted": 0, "updated": 0, "unchanged": 0}
+            for rows in stage_rows:
+                meters = _resolve_meters(cur, rows, cache)
+                # строки накопительных показаний (reading) пишутся позже, разностями (load_readings)
+                counts = upsert_measurements(
+                    cur, [(meters[r[3]], r[0], r[5]) for r in rows if r[7] is None],
+                    settings.load_mode, settings.default_tz,
                 )
+                for key, n in counts.items():
+                    totals[key] += n
+                read += len(rows)
+
+            if not read:
+                log.warning("Нет данных в stage для load_id=%s", load_id)
+                return 0
+
+            log.info(
+                "Загружено в core.measurements для load_id=%s",
+                load_id,
+                extra={"read": read, "mode": settings.load_mode, **totals},
+            )
+
+            # дальше — общее для всех загрузок состояние: до commit выполняется одной загрузкой за раз
+            lock_aggregates(cur)
+
+            # интервалы накопительных счётчиков — по истории показаний, которую меняют и другие загрузки
+            readings = load_readings(cur, settings, load_id)
+            if readings["readings"]:
+                log.info("Пересчитаны интервалы показаний для load_id=%s", load_id, extra=readings)
+            totals["inserted"] += readings["inserted"]
+            totals["updated"] += readings["updated"] + readings["deleted"]
 
-        log.info("Загружено %s строк в core.measurements для load_id=%s", inserted, load_id)
-        conn.commit()
+            # история до первого инкрементального пересчёта (один раз, см. core.etl_init)
+            ensure_rollups_initialized(cur, settings)
+            ensure_coverage_initialized(cur, settings)
+            # агрегаты пересчитываются только по часам, где измерения вставлены или изменены
+            counts = refresh_rollups(cur, settings)
+            log.info("Обновлены агрегаты для load_id=%s", load_id, extra=counts)
+            # воркер с истёкшей арендой не фиксирует загрузку: её уже обрабатывает другой
+            work_queue.assert_lease(cur, load_id, worker)
+            conn.commit()
+            return totals["inserted"] + totals["updated"]
+        except Exception as e:
+            conn.rollback()
+            log.error("load_to_core failed", extra={"load_id": load_id, "error": str(e)})
+            raise
@@ -1,12 +1,21 @@
 import os
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import re
 import unicodedata
 from decimal import Decimal
 import pandas as pd
 
+from etl.utils import work_queue
 from etl.utils.logger import get_logger
 from etl.utils.db import get_conn
+from etl.utils.io import open_table_file
+from etl.utils.quality import validate_batch, write_report
+from etl.utils.readings import CUMULATIVE_METRIC, mark_readings
+from etl.utils.stage_partitions import ensure_load_partition, truncate_load_partition
+from etl.utils.units import convert_to_canonical, unit_dimension
+from etl.utils.validation import parse_timestamps
 
 log = get_logger(__name__)
 
@@ -41,20 +50,36 @@ def _col_matches(cols, keywords):
 # -----------------------
 # Нормализация кода/метрик
 # -----------------------
-def normalize_metric(metric: str) -> str:
-    """Преобразует разные рус/англ названия в единый словарь метрик."""
+# явные названия тепловой энергии (а не теплоносителя): HEAT по имени только для них
+_HEAT_NAMES = ("тепловая энергия", "тепловой энергии", "теплоэнерг", "количество теплоты", "кол-во теплоты",
+               "heat energy", "energy", "энергия", "гкал")
+
+
+def normalize_metric(metric: str, unit: str = None) -> str:
+    """
+    Преобразует разные рус/англ названия в единый словарь метрик.
+    unit уточняет классификацию: единица энергии — HEAT, объём/расход — не HEAT,
+    даже если в названии есть «тепл» («Расход теплоносителя», м3).
+    """
     if metric is None:
         return None
     m = str(metric).strip().lower()
     if m == "":
         return None
     # точечные проверки / вхождения
+    if "показан" in m or "cumulative" in m or "накоплен" in m or "нарастающ" in m:
+        return "CONSUMPTION_CUMULATIVE"
     if "подач" in m or "supply" in m:
         return "SUPPLY"
     if "обрат" in m or "return" in m:
         return "RETURN"
+    dimension = unit_dimension(unit)
+    if dimension == "energy":
+        return "HEAT"
     if "расход" in m or "consumption" in m or "за период" in m or "потреблен" in m:
         return "CONSUMPTION"
+    if dimension not in ("volume", "flow") and any(k in m for k in _HEAT_NAMES):
+        return "HEAT"
     if "t1" in m or "т1" in m:
         return "T1"
     if "t2" in m or "т2" in m:
@@ -93,29 +118,44 @@ def normalize_meter_code(code: str) -> str:
 # -----------------------
 # Разбор файла (основная логика)
 # -----------------------
-def _parse_file(path, load_id):
-    source_file = os.path.basename(path)
-    # читаем первый лист
-    df = pd.read_excel(path, sheet_name=0, engine="openpyxl")
+TS_KEYWORDS = ("ts", "timestamp", "time", "дата", "время", "date")
+VALUE_KEYWORDS = ("value", "значение", "потребление", "потребление за период", "показания")
+
+
+def _parse_frame(df, source_file, load_id, default_tz="UTC", sheet_name=None):
+    """
+    Разбирает один лист. Возвращает строки с sheet_name и sheet_row_num (номер строки в листе);
+    лист без колонок даты и значения считается служебным — возвращается пустой список.
+    """
+    df.columns = [str(c) for c in df.columns]
     cols = list(df.columns)
+    if df.empty or not (_col_matches(cols, TS_KEYWORDS) or _col_matches(cols, VALUE_KEYWORDS)):
+        return []
 
-    ts_col = _col_matches(cols, ("ts", "timestamp", "time", "дата", "время", "date"))
+    ts_col = _col_matches(cols, TS_KEYWORDS)
     building_col = _col_matches(cols, ("building", "дом", "здание"))
     itp_col = _col_matches(cols, ("itp", "итп"))
     meter_col = _col_matches(cols, ("meter", "счетчик", "счетчик", "meter_code"))
     metric_col = _col_matches(cols, ("metric", "метрика", "тип", "параметр"))
-    value_col = _col_matches(cols, ("value", "значение", "потребление", "потребление за период", "показания"))
+    value_col = _col_matches(cols, VALUE_KEYWORDS)
     unit_col = _col_matches(cols, ("unit", "ед", "u", "единица"))
 
+    # timestamp'ы разбираем всей колонкой: формат выводится один раз, построчно — только промахи
+    ts_values = None
+    if ts_col:
+        ts_values = parse_timestamps(
+            df[ts_col],
+            default_tz,
+            # листы разбираются параллельно: формат кешируется отдельно для каждого файла (load_id) и листа
+            cache_key=(load_id, sheet_name, str(ts_col).strip().lower()),
+            groups=df[meter_col] if meter_col else None,
+        )
+
     rows_out = []
-    for idx, row in df.iterrows():
+    for pos, (_idx, row) in enumerate(df.iterrows()):
         ts = None
-        if ts_col:
-            ts = pd.to_datetime(row[ts_col], errors="coerce")
-            if pd.notna(ts):
-                ts = ts.to_pydatetime()
-            else:
-                ts = None
+        if ts_values is not None and pd.notna(ts_values.iat[pos]):
+            ts = ts_values.iat[pos].to_pydatetime()
 
         # raw values
         raw_building = row[building_col] if building_col and not pd.isna(row[building_col]) else None
@@ -143,17 +183,18 @@ def _parse_file(path, load_id):
         if not meter_code:
             meter_code = source_file.replace(".xlsx", "").replace(".xls", "")
 
-        metric = normalize_metric(raw_metric)
+        unit = str(raw_unit).strip() if raw_unit and not pd.isna(raw_unit) else None
+
+        metric = normalize_metric(raw_metric, unit)
         if not metric:
             # если явно не извлечено — считаем как потребление
             metric = "CONSUMPTION"
 
-        unit = str(raw_unit).strip() if raw_unit and not pd.isna(raw_unit) else None
-
         rows_out.append(
             {
                 "load_id": load_id,
-                "row_num": int(idx) + 1,
+                "sheet_name": sheet_name,
+                "sheet_row_num": pos + 1,
                 "ts": ts,
                 "building_code": building_code,
                 "itp_code": itp_code,
@@ -166,8 +207,85 @@ def _parse_file(path, load_id):
     return rows_out
 
 
-def flow_parse_and_normalize(settings, load_id: str):
+def _parse_file(path, load_id, default_tz="UTC", max_workers=4):
+    """
+    Разбирает все листы с данными. Книга открывается один раз; чтение листов из неё
+    сериализовано (openpyxl не потокобезопасен), а нормализация листов идёт в пуле потоков
+    параллельно с чтением следующих. row_num сквозной по файлу (листы — по порядку в книге).
+    """
+    source_file = os.path.basename(path)
+    lock = threading.Lock()
+
+    with open_table_file(path) as (sheet_names, read_sheet):
+
+        def parse_sheet(name):
+            with lock:
+                df = read_sheet(name)
+            return _parse_frame(df, source_file, load_id, default_tz, name)
+
+        workers = max(1, min(max_workers, len(sheet_names)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parse-sheet") as pool:
+            per_sheet = list(pool.map(parse_sheet, sheet_names))
+
+    rows_out = []
+    for name, rows in zip(sheet_names, per_sheet):
+        offset = len(rows_out)
+        for r in rows:
+            r["row_num"] = offset + r["sheet_row_num"]
+        rows_out.extend(rows)
+        if rows:
+            log.info("parsed sheet", extra={"source_file": source_file, "sheet": name, "rows": len(rows)})
+    return rows_out
+
+
+_STAGE_COLUMNS = (
+    "load_id",
+    "source_file",
+    "sheet_name",
+    "sheet_row_num",
+    "row_num",
+    "ts",
+    "building_code",
+    "itp_code",
+    "meter_code",
+    "metric",
+    "value",
+    "unit",
+    "reading",
+    "quality",
+    "reason",
+)
+
+
+def _validate(settings, batch, load_id):
+    """
+    Прогоняет батч через expectations suite (etl/utils/quality.py) и пишет отчёт.
+    Suite не задан (EXPECTATIONS_SUITE пуст) — отчёта нет, но строки без ts/value всё равно
+    помечаются 'bad' (в core.measurements эти колонки not null). Заданный, но отсутствующий
+    suite — ошибка parse, а не молчаливый пропуск проверок.
+    """
+    suite_path = settings.expectations_suite
+    if not suite_path:
+        log.warning("Expectations suite not configured, only null checks", extra={"load_id": load_id})
+        reason = pd.Series("", index=batch.index, dtype=object)
+        for col in ("ts", "value"):
+            reason = reason.where(batch[col].notna(), reason + f"not_null({col});")
+        reason = reason.str.rstrip(";")
+        return batch.assign(quality=reason.eq("").map({True: "ok", False: "bad"}), reason=reason.where(reason != "", None)), {}
+    if not os.path.isfile(suite_path):
+        raise FileNotFoundError(f"Expectations suite not found: {suite_path}")
+
+    batch, report = validate_batch(batch, suite_path)
+    report["load_id"] = load_id
+    write_report(report, settings.quality_reports_dir, f"stage_parsed_{load_id}")
+    if report["rows_bad"]:
+        log.warning("DQ: bad rows in parsed batch", extra={"load_id": load_id, "bad": report["rows_bad"]})
+    return batch, report
+
+
+def flow_parse_and_normalize(settings, load_id: str, worker: str = None):
     log.info("parse start", extra={"load_id": load_id})
+    ensure_load_partition(settings, "stage_parsed_measurements", load_id)
     with get_conn(settings) as conn, conn.cursor() as cur:
         try:
             # достаем путь файла
@@ -180,34 +298,38 @@ def flow_parse_and_normalize(settings, load_id: str):
             path = row["file_path"]
             source_file = os.path.basename(path)
 
-            parsed_rows = _parse_file(path, load_id)
-
-            cur.execute("delete from stage.stage_parsed_measurements where load_id = %s", (load_id,))
-            inserted = 0
-            for r in parsed_rows:
-                cur.execute(
-                    """
-                    insert into stage.stage_parsed_measurements
-                        (load_id, source_file, row_num, ts, building_code, itp_code, meter_code, metric, value, unit)
-                    values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """,
-                    (
-                        r["load_id"],
-                        source_file,
-                        r["row_num"],
-                        r["ts"],
-                        r["building_code"],
-                        r["itp_code"],
-                        r["meter_code"],
-                        r["metric"],
-                        r["value"],
-                        r["unit"],
-                    ),
-                )
-                inserted += 1
+            parsed_rows = _parse_file(path, load_id, settings.default_tz)
+            batch = pd.DataFrame(parsed_rows, columns=_STAGE_COLUMNS[:1] + _STAGE_COLUMNS[2:-3])
+            batch.insert(1, "source_file", source_file)
+            # значения и подписи единиц — в базовые единицы метрики (векторно, по группам metric/unit)
+            batch["value"], batch["unit"] = convert_to_canonical(batch["metric"], batch["unit"], batch["value"])
+            batch["reading"] = batch["value"].where(batch["metric"] == CUMULATIVE_METRIC)
+            batch, report = _validate(settings, batch, load_id)
+            # накопительные показания -> строки потребления; разности по истории показаний считает load
+            batch = mark_readings(batch)
+
+            # повторная обработка — truncate секции load_id (секция создана до начала транзакции)
+            truncate_load_partition(cur, "stage_parsed_measurements", load_id)
+            # NaN/NaT -> None, чтобы psycopg записал NULL
+            records = batch[list(_STAGE_COLUMNS)].astype(object)
+            records = records.where(records.notna(), None)
+            cur.executemany(
+                f"""
+                insert into stage.stage_parsed_measurements ({", ".join(_STAGE_COLUMNS)})
+                values ({", ".join(["%s"] * len(_STAGE_COLUMNS))})
+                """,
+                list(records.itertuples(index=False, name=None)),
+            )
+            inserted = len(records)
 
+            # воркер очереди фиксирует результат, только пока аренда загрузки его
+            work_queue.assert_lease(cur, load_id, worker)
             conn.commit()
-            log.info("parse completed", extra={"load_id": load_id, "ok": inserted})
+            log.info(
+                "parse completed",
+                extra={"load_id": load_id, "rows": inserted, "ok": report.get("rows_ok"), "bad": report.get("rows_bad")},
+            )
+            return inserted
         except Exception as e:
             conn.rollback()
             log.error("parse failed", extra={"load_id": load_id, "error": str(e)})
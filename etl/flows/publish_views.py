@@ -1,9 +1,25 @@
 from etl.utils.db import get_conn
 from etl.utils.logger import get_logger
+from etl.flows.coverage import publish_coverage_views
+from etl.flows.rollups import ensure_rollups_initialized
 
 log = get_logger(__name__)
 
 
+def _drop_matview(cur, schema: str, name: str):
+    cur.execute(
+        """
+        select 1
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        where n.nspname = %s and c.relname = %s and c.relkind = 'm'
+        """,
+        (schema, name),
+    )
+    if cur.fetchone():
+        cur.execute(f"drop materialized view {schema}.{name} cascade;")
+
+
 def flow_publish_views(settings):
     log.info("publish_views start")
 
@@ -25,32 +41,54 @@ def flow_publish_views(settings):
     left join core.buildings b on i.building_id = b.building_id;
     """
 
+    # Балансы — тонкие views над пирамидой core.rollup_* (см. etl.flows.rollups):
+    # сырые измерения сканируются только при инкрементальном обновлении rollup_hourly.
+    sql_hourly = """
+    create or replace view core.hourly_balance as
+    select
+        b.external_code as building_code,
+        r.building_key,
+        r.hour,
+        r.supply,
+        r.return,
+        r.consumption,
+        r.loss,
+        r.t1_avg,
+        r.t2_avg
+    from core.rollup_hourly r
+    join core.buildings b on b.building_key = r.building_key;
+    """
+
     sql_daily = """
-    create materialized view core.daily_balance as
+    create or replace view core.daily_balance as
     select
-        building_code,
-        date_trunc('day', timestamp) as day,
-        sum(case when metric = 'SUPPLY' then value else 0 end) as supply,
-        sum(case when metric = 'RETURN' then value else 0 end) as return,
-        sum(case when metric = 'CONSUMPTION' then value else 0 end) as consumption,
-        sum(case when metric = 'SUPPLY' then value else 0 end) -
-        sum(case when metric = 'RETURN' then value else 0 end) as loss
-    from core.measurements_flat
-    group by building_code, date_trunc('day', timestamp);
+        b.external_code as building_code,
+        r.building_key,
+        r.day,
+        r.supply,
+        r.return,
+        r.consumption,
+        r.loss,
+        r.t1_avg,
+        r.t2_avg
+    from core.rollup_daily r
+    join core.buildings b on b.building_key = r.building_key;
     """
 
-    sql_hourly = """
-    create materialized view core.hourly_balance as
+    sql_monthly = """
+    create or replace view core.monthly_balance as
     select
-        building_code,
-        date_trunc('hour', timestamp) as hour,
-        sum(case when metric = 'SUPPLY' then value else 0 end) as supply,
-        sum(case when metric = 'RETURN' then value else 0 end) as return,
-        sum(case when metric = 'CONSUMPTION' then value else 0 end) as consumption,
-        sum(case when metric = 'SUPPLY' then value else 0 end) -
-        sum(case when metric = 'RETURN' then value else 0 end) as loss
-    from core.measurements_flat
-    group by building_code, date_trunc('hour', timestamp);
+        b.external_code as building_code,
+        r.building_key,
+        r.month,
+        r.supply,
+        r.return,
+        r.consumption,
+        r.loss,
+        r.t1_avg,
+        r.t2_avg
+    from core.rollup_monthly r
+    join core.buildings b on b.building_key = r.building_key;
     """
 
     with get_conn(settings) as conn, conn.cursor() as cur:
@@ -60,13 +98,18 @@ def flow_publish_views(settings):
             cur.execute("drop view if exists core.measurements_flat cascade;")
             cur.execute(sql_measurements_flat)
 
-            # daily
-            cur.execute("drop materialized view if exists core.daily_balance cascade;")
-            cur.execute(sql_daily)
+            # пирамида агрегатов: при первом запуске наполняем её из уже загруженных измерений
+            ensure_rollups_initialized(cur, settings)
 
-            # hourly
-            cur.execute("drop materialized view if exists core.hourly_balance cascade;")
+            # раньше балансы были materialized views — такие объекты удаляем
+            for name in ("hourly_balance", "daily_balance", "monthly_balance"):
+                _drop_matview(cur, "core", name)
             cur.execute(sql_hourly)
+            cur.execute(sql_daily)
+            cur.execute(sql_monthly)
+
+            # полнота данных по счётчикам: core.meter_gaps(date_from, date_to) и core.meter_coverage
+            publish_coverage_views(cur, settings)
 
             conn.commit()
             log.info("Published views/materialized views in schema core")
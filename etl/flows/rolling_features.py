@@ -0,0 +1,144 @@
+"""
+etl.flows.rolling_features
+--------------------------
+Инкрементальное хранилище скользящих признаков по зданиям:
+features.rolling_by_building (building_key, ts) с колонками
+
+  - consumption, consumption_24h, consumption_7d — потребление за час и скользящие суммы;
+  - t1, t2, delta_t — средние температуры подачи/обратки за час и ΔT = T1 - T2;
+  - delta_t_low / delta_t_high — ΔT вне норматива [DELTA_T_MIN, DELTA_T_MAX].
+
+Источник — core.rollup_hourly (см. etl.flows.rollups), сырые измерения не читаются.
+На каждую загрузку пересчитываются только окна, которые пересекают её диапазон:
+строки с ts в [lo, hi + 7d) по данным из [lo - 7d, hi + 7d).
+Primary key (building_key, ts) служит индексом для выборки обучающих данных.
+Таблица создаётся в etl/sql/init_core.sql, а не в транзакции загрузки.
+Окна соседних загрузок пересекаются, поэтому пересчёт (delete + insert диапазона)
+сериализуется advisory-блокировкой.
+"""
+
+from datetime import timedelta
+
+import pandas as pd
+
+from etl.utils.db import advisory_xact_lock, get_conn
+from etl.utils import work_queue
+from etl.utils.logger import get_logger
+
+log = get_logger(__name__)
+
+# самое длинное окно; определяет и lookback для чтения, и горизонт пересчёта вперёд
+LOOKBACK = timedelta(days=7)
+
+_COLUMNS = (
+    "building_key",
+    "ts",
+    "consumption",
+    "consumption_24h",
+    "consumption_7d",
+    "t1",
+    "t2",
+    "delta_t",
+    "delta_t_low",
+    "delta_t_high",
+)
+
+
+def compute_rolling(hourly: pd.DataFrame, delta_t_min: float, delta_t_max: float) -> pd.DataFrame:
+    """
+    hourly: building_key, hour, consumption, t1_avg, t2_avg (по одной строке на здание и час).
+    Окна — по времени, поэтому пропуски часов не сдвигают границы окна.
+    """
+    df = hourly.sort_values(["building_key", "hour"]).reset_index(drop=True)
+    grouped = df.groupby("building_key", sort=False)
+    out = pd.DataFrame(
+        {
+            "building_key": df["building_key"],
+            "ts": df["hour"],
+            "consumption": df["consumption"],
+            "consumption_24h": grouped.rolling("24h", on="hour")["consumption"].sum().to_numpy(),
+            "consumption_7d": grouped.rolling("7D", on="hour")["consumption"].sum().to_numpy(),
+            "t1": df["t1_avg"],
+            "t2": df["t2_avg"],
+        }
+    )
+    out["delta_t"] = out["t1"] - out["t2"]
+    no_dt = out["delta_t"].isna()
+    out["delta_t_low"] = (out["delta_t"] < delta_t_min).astype("boolean").mask(no_dt)
+    out["delta_t_high"] = (out["delta_t"] > delta_t_max).astype("boolean").mask(no_dt)
+    return out
+
+
+def flow_rolling_features(settings, load_id: str, worker: str = None) -> int:
+    """Пересчитывает скользящие признаки для зданий и диапазона, затронутых load_id."""
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        try:
+            advisory_xact_lock(cur, "features.rolling_by_building")
+            cur.execute(
+                """
+                select
+                    array_agg(distinct b.building_key) as keys,
+                    date_trunc('hour', min(s.ts)) as ts_from,
+                    date_trunc('hour', max(s.ts)) as ts_to
+                from stage.stage_parsed_measurements s
+                join core.buildings b on b.external_code = s.building_code
+                where s.load_id = %s
+                  and s.ts is not null
+                  and s.quality is distinct from 'bad'
+                """,
+                (load_id,),
+            )
+            bounds = cur.fetchone()
+            if not bounds or not bounds["keys"]:
+                log.info("rolling_features: nothing to update", extra={"load_id": load_id})
+                return 0
+
+            keys, lo, hi = bounds["keys"], bounds["ts_from"], bounds["ts_to"]
+            write_from, write_to = lo, hi + LOOKBACK
+
+            cur.execute(
+                """
+                select building_key, hour, consumption, t1_avg, t2_avg
+                from core.rollup_hourly
+                where building_key = any(%s)
+                  and hour > %s
+                  and hour < %s
+                """,
+                (keys, lo - LOOKBACK, write_to),
+            )
+            hourly = pd.DataFrame(cur.fetchall(), columns=["building_key", "hour", "consumption", "t1_avg", "t2_avg"])
+            if hourly.empty:
+                return 0
+            hourly["hour"] = pd.to_datetime(hourly["hour"], utc=True)
+
+            features = compute_rolling(hourly, settings.delta_t_min, settings.delta_t_max)
+            features = features[features["ts"] >= pd.Timestamp(write_from)]
+            records = features[list(_COLUMNS)].astype(object)
+            records = records.where(records.notna(), None)
+
+            cur.execute(
+                """
+                delete from features.rolling_by_building
+                where building_key = any(%s) and ts >= %s and ts < %s
+                """,
+                (keys, write_from, write_to),
+            )
+            cur.executemany(
+                f"""
+                insert into features.rolling_by_building ({", ".join(_COLUMNS)})
+                values ({", ".join(["%s"] * len(_COLUMNS))})
+                """,
+                list(records.itertuples(index=False, name=None)),
+            )
+            # воркер очереди фиксирует результат, только пока аренда загрузки его
+            work_queue.assert_lease(cur, load_id, worker)
+            conn.commit()
+            log.info(
+                "rolling_features updated",
+                extra={"load_id": load_id, "buildings": len(keys), "rows": len(records)},
+            )
+            return len(records)
+        except Exception as e:
+            conn.rollback()
+            log.error("rolling_features failed", extra={"load_id": load_id, "error": str(e)})
+            raise
@@ -0,0 +1,323 @@
+"""
+etl.flows.rollups
+-----------------
+Пирамида агрегатов hour -> day -> month по зданиям (ключ — целочисленный
+core.buildings.building_key):
+
+  - core.rollup_hourly  — считается из core.measurements (единственный уровень,
+                          который читает сырые измерения); хранит и district_key здания;
+  - core.rollup_daily   — считается из core.rollup_hourly;
+  - core.rollup_monthly — считается из core.rollup_daily;
+  - core.rollup_hourly_district — часовые суммы по районам (ключ district_key),
+                          считается из core.rollup_hourly по индексу (district_key, hour).
+
+Обновление инкрементальное: загрузка помечает (building_key, hour) реально
+вставленных/изменённых измерений во временной таблице _touched_hours, после
+чего refresh_rollups пересчитывает только эти часы, а затем только содержащие
+их сутки и месяцы.
+Границы суток/месяцев считаются в Settings.default_tz.
+
+Пересчёт сериализуется advisory-блокировкой AGGREGATES_LOCK до конца транзакции
+загрузки: insert ... select читает снимок READ COMMITTED и не видит часы соседней
+незакоммиченной загрузки, поэтому без блокировки параллельные загрузки (backfill,
+воркеры очереди) перетирали бы суточные/месячные/районные строки друг друга.
+Загрузка, дождавшаяся блокировки, пересчитывает свои часы уже по данным
+закоммиченной предыдущей.
+
+Таблицы и индексы создаются в etl/sql/init_core.sql (bootstrap схемы), а не в
+транзакции загрузки: DDL брал бы эксклюзивную блокировку на каждой загрузке.
+"""
+
+from etl.utils.db import advisory_xact_lock
+from etl.utils.logger import get_logger
+from etl.utils.schema import init_done, mark_init_done
+
+log = get_logger(__name__)
+
+AGGREGATES_LOCK = "core.rollups"
+
+
+def lock_aggregates(cur):
+    """Блокировка пересчёта агрегатов до конца текущей транзакции (повторный вызов не блокирует)."""
+    advisory_xact_lock(cur, AGGREGATES_LOCK)
+
+
+def _ensure_touched_table(cur):
+    cur.execute(
+        """
+        create temp table if not exists _touched_hours (
+            building_key int not null,
+            hour timestamptz not null,
+            primary key (building_key, hour)
+        ) on commit delete rows;
+        """
+    )
+
+
+def mark_measurement_hours(cur, meter_ids, ts_list) -> int:
+    """
+    Помечает как затронутые (building_key, hour) для пар (meter_id, ts) — load передаёт
+    только реально вставленные или изменённые измерения.
+    """
+    _ensure_touched_table(cur)
+    if not meter_ids:
+        return 0
+    cur.execute(
+        """
+        insert into _touched_hours (building_key, hour)
+        select distinct b.building_key, date_trunc('hour', c.ts)
+        from unnest(%s::uuid[], %s::timestamptz[]) as c(meter_id, ts)
+        join core.meters mt on mt.meter_id = c.meter_id
+        join core.itp i on i.itp_id = mt.itp_id
+        join core.buildings b on b.building_id = i.building_id
+        on conflict do nothing
+        """,
+        (list(meter_ids), list(ts_list)),
+    )
+    return cur.rowcount
+
+
+def mark_all_hours(cur) -> int:
+    """Помечает все часы, по которым есть измерения (полная пересборка пирамиды)."""
+    _ensure_touched_table(cur)
+    cur.execute(
+        """
+        insert into _touched_hours (building_key, hour)
+        select distinct b.building_key, date_trunc('hour', m.ts)
+        from core.measurements m
+        join core.meters mt on mt.meter_id = m.meter_id
+        join core.itp i on i.itp_id = mt.itp_id
+        join core.buildings b on b.building_id = i.building_id
+        on conflict do nothing
+        """
+    )
+    return cur.rowcount
+
+
+_SQL_REFRESH_HOURLY = """
+insert into core.rollup_hourly as r
+    (building_key, hour, district_key, supply, return, consumption, loss, t1_avg, t2_avg, n_measurements, updated_at)
+select
+    t.building_key,
+    t.hour,
+    b.district_key,
+    coalesce(sum(m.value) filter (where mt.metric = 'SUPPLY'), 0) as supply,
+    coalesce(sum(m.value) filter (where mt.metric = 'RETURN'), 0) as return,
+    coalesce(sum(m.value) filter (where mt.metric = 'CONSUMPTION'), 0) as consumption,
+    coalesce(sum(m.value) filter (where mt.metric = 'SUPPLY'), 0) -
+    coalesce(sum(m.value) filter (where mt.metric = 'RETURN'), 0) as loss,
+    avg(m.value) filter (where mt.metric = 'T1') as t1_avg,
+    avg(m.value) filter (where mt.metric = 'T2') as t2_avg,
+    count(*) as n_measurements,
+    now()
+from _touched_hours t
+join core.buildings b on b.building_key = t.building_key
+join core.itp i on i.building_id = b.building_id
+join core.meters mt on mt.itp_id = i.itp_id
+join core.measurements m
+  on m.meter_id = mt.meter_id
+ and m.ts >= t.hour
+ and m.ts < t.hour + interval '1 hour'
+group by t.building_key, t.hour, b.district_key
+on conflict (building_key, hour) do update set
+    district_key = excluded.district_key,
+    supply = excluded.supply,
+    return = excluded.return,
+    consumption = excluded.consumption,
+    loss = excluded.loss,
+    t1_avg = excluded.t1_avg,
+    t2_avg = excluded.t2_avg,
+    n_measurements = excluded.n_measurements,
+    updated_at = excluded.updated_at
+"""
+
+_SQL_REFRESH_DAILY = """
+insert into core.rollup_daily as r
+    (building_key, day, supply, return, consumption, loss, t1_avg, t2_avg, n_hours, updated_at)
+select
+    d.building_key,
+    d.day,
+    sum(h.supply),
+    sum(h.return),
+    sum(h.consumption),
+    sum(h.loss),
+    avg(h.t1_avg),
+    avg(h.t2_avg),
+    count(*),
+    now()
+from (
+    select distinct building_key, date_trunc('day', hour, %(tz)s) as day
+    from _touched_hours
+) d
+join core.rollup_hourly h
+  on h.building_key = d.building_key
+ and h.hour >= d.day
+ and h.hour < ((d.day at time zone %(tz)s) + interval '1 day') at time zone %(tz)s
+group by d.building_key, d.day
+on conflict (building_key, day) do update set
+    supply = excluded.supply,
+    return = excluded.return,
+    consumption = excluded.consumption,
+    loss = excluded.loss,
+    t1_avg = excluded.t1_avg,
+    t2_avg = excluded.t2_avg,
+    n_hours = excluded.n_hours,
+    updated_at = excluded.updated_at
+"""
+
+_SQL_REFRESH_MONTHLY = """
+insert into core.rollup_monthly as r
+    (building_key, month, supply, return, consumption, loss, t1_avg, t2_avg, n_days, updated_at)
+select
+    mo.building_key,
+    mo.month,
+    sum(d.supply),
+    sum(d.return),
+    sum(d.consumption),
+    sum(d.loss),
+    avg(d.t1_avg),
+    avg(d.t2_avg),
+    count(*),
+    now()
+from (
+    select distinct building_key, date_trunc('month', hour, %(tz)s) as month
+    from _touched_hours
+) mo
+join core.rollup_daily d
+  on d.building_key = mo.building_key
+ and d.day >= mo.month
+ and d.day < ((mo.month at time zone %(tz)s) + interval '1 month') at time zone %(tz)s
+group by mo.building_key, mo.month
+on conflict (building_key, month) do update set
+    supply = excluded.supply,
+    return = excluded.return,
+    consumption = excluded.consumption,
+    loss = excluded.loss,
+    t1_avg = excluded.t1_avg,
+    t2_avg = excluded.t2_avg,
+    n_days = excluded.n_days,
+    updated_at = excluded.updated_at
+"""
+
+# районы затронутых часов; сумма по зданиям района за час — через индекс (district_key, hour)
+# core.rollup_hourly, строка на здание, поэтому buildings_reporting = count(*)
+_SQL_REFRESH_HOURLY_DISTRICT = """
+insert into core.rollup_hourly_district as r
+    (district_key, hour, buildings_reporting, supply, return, consumption, loss, loss_avg, updated_at)
+select
+    h.district_key,
+    h.hour,
+    count(*),
+    sum(h.supply),
+    sum(h.return),
+    sum(h.consumption),
+    sum(h.loss),
+    avg(h.loss),
+    now()
+from {source} d
+join core.rollup_hourly h
+  on h.district_key = d.district_key
+ and h.hour = d.hour
+group by h.district_key, h.hour
+on conflict (district_key, hour) do update set
+    buildings_reporting = excluded.buildings_reporting,
+    supply = excluded.supply,
+    return = excluded.return,
+    consumption = excluded.consumption,
+    loss = excluded.loss,
+    loss_avg = excluded.loss_avg,
+    updated_at = excluded.updated_at
+"""
+
+_TOUCHED_DISTRICT_HOURS = """(
+    select distinct b.district_key, t.hour
+    from _touched_hours t
+    join core.buildings b on b.building_key = t.building_key
+    where b.district_key is not null
+)"""
+
+
+def rebuild_district_rollup(cur, district_keys=None) -> int:
+    """
+    Полный пересчёт core.rollup_hourly_district для district_keys (None — все районы):
+    после изменения справочника районов (etl/flows/load_districts.py) district_key
+    в core.rollup_hourly синхронизируется с core.buildings, строки районов пересобираются.
+    """
+    lock_aggregates(cur)
+    keys = None if district_keys is None else list(district_keys)
+    cur.execute(
+        """
+        update core.rollup_hourly r
+        set district_key = b.district_key
+        from core.buildings b
+        where b.building_key = r.building_key
+          and r.district_key is distinct from b.district_key
+          and (%(keys)s::int[] is null
+               or b.district_key = any(%(keys)s::int[])
+               or r.district_key = any(%(keys)s::int[]))
+        """,
+        {"keys": keys},
+    )
+    cur.execute(
+        "delete from core.rollup_hourly_district where %(keys)s::int[] is null or district_key = any(%(keys)s::int[])",
+        {"keys": keys},
+    )
+    cur.execute(
+        _SQL_REFRESH_HOURLY_DISTRICT.format(
+            source="""(
+                select distinct district_key, hour
+                from core.rollup_hourly
+                where district_key is not null
+                  and (%(keys)s::int[] is null or district_key = any(%(keys)s::int[]))
+            )"""
+        ),
+        {"keys": keys},
+    )
+    return cur.rowcount
+
+
+def refresh_rollups(cur, settings) -> dict:
+    """
+    Пересчитывает уровни пирамиды для часов из _touched_hours.
+    Каждый уровень строится только из предыдущего. Возвращает число обновлённых строк по уровням.
+    """
+    _ensure_touched_table(cur)
+    lock_aggregates(cur)
+    params = {"tz": settings.default_tz}
+
+    cur.execute(_SQL_REFRESH_HOURLY)
+    hourly = cur.rowcount
+    cur.execute(_SQL_REFRESH_DAILY, params)
+    daily = cur.rowcount
+    cur.execute(_SQL_REFRESH_MONTHLY, params)
+    monthly = cur.rowcount
+    cur.execute(_SQL_REFRESH_HOURLY_DISTRICT.format(source=_TOUCHED_DISTRICT_HOURS))
+    district = cur.rowcount
+
+    cur.execute("delete from _touched_hours")
+    return {"hourly": hourly, "daily": daily, "monthly": monthly, "hourly_district": district}
+
+
+def ensure_rollups_initialized(cur, settings) -> bool:
+    """
+    Один раз наполняет пирамиду из всех core.measurements (первый запуск на базе с уже
+    загруженными данными). Выполненность отмечается в core.etl_init, а не по пустоте
+    таблиц: load заполняет rollup_hourly раньше publish, и проверка на пустоту пропускала
+    бы историю. Вызывается из load до первого инкрементального пересчёта и из publish.
+    Возвращает True, если была выполнена полная сборка.
+    """
+    # второй процесс дождётся первого и увидит его отметку
+    lock_aggregates(cur)
+    if init_done(cur, "rollups"):
+        if not init_done(cur, "rollup_hourly_district"):
+            # районный агрегат появился позже пирамиды — собираем его один раз по готовым часам
+            log.info("district rollup initialized", extra={"rows": rebuild_district_rollup(cur)})
+            mark_init_done(cur, "rollup_hourly_district")
+        return False
+    mark_all_hours(cur)
+    counts = refresh_rollups(cur, settings)
+    mark_init_done(cur, "rollups")
+    mark_init_done(cur, "rollup_hourly_district")
+    log.info("rollups initialized from core.measurements", extra=counts)
+    return True
+
@@ -0,0 +1,70 @@
+"""
+etl.flows.time_attributes
+-------------------------
+Календарное измерение features.time_attributes с часовой гранулярностью.
+
+Таблица содержит по одной строке на час (ts — начало часа, timestamptz) и
+атрибуты, посчитанные в Settings.default_tz:
+  - hour (0..23, локальный час)
+  - day_night ('day' для DAY_START <= hour < DAY_END, иначе 'night')
+  - month (1..12)
+  - season ('winter', 'spring', 'summer', 'autumn')
+  - is_weekend (суббота/воскресенье)
+
+dbt-модели ml_*_by_building делают left join по ts, поэтому primary key по ts
+превращает соединение в поиск по индексу.
+
+Для каждого диапазона загрузки генерируются все его часы с on conflict do
+nothing: уже существующие часы не переписываются, а параллельные загрузки
+несмежных диапазонов (backfill, воркеры) не оставляют пропусков между собой.
+Таблица создаётся в etl/sql/init_core.sql, а не в транзакции загрузки.
+"""
+
+
+_SQL_FILL_RANGE = """
+insert into features.time_attributes (ts, hour, day_night, month, season, is_weekend)
+select
+    g.ts,
+    extract(hour from l.local_ts)::int as hour,
+    case
+        when extract(hour from l.local_ts) >= %(day_start)s
+         and extract(hour from l.local_ts) < %(day_end)s then 'day'
+        else 'night'
+    end as day_night,
+    extract(month from l.local_ts)::int as month,
+    case
+        when extract(month from l.local_ts) in (12, 1, 2) then 'winter'
+        when extract(month from l.local_ts) in (3, 4, 5) then 'spring'
+        when extract(month from l.local_ts) in (6, 7, 8) then 'summer'
+        else 'autumn'
+    end as season,
+    extract(isodow from l.local_ts) >= 6 as is_weekend
+from generate_series(
+        date_trunc('hour', %(ts_from)s::timestamptz),
+        date_trunc('hour', %(ts_to)s::timestamptz),
+        interval '1 hour'
+     ) as g(ts)
+cross join lateral (select g.ts at time zone %(tz)s as local_ts) l
+on conflict (ts) do nothing
+"""
+
+
+def extend_time_attributes(cur, settings, ts_from, ts_to) -> int:
+    """
+    Дополняет features.time_attributes часами [ts_from, ts_to] (существующие часы не трогаются).
+    Возвращает число добавленных строк.
+    """
+    if ts_from is None or ts_to is None:
+        return 0
+
+    cur.execute(
+        _SQL_FILL_RANGE,
+        {
+            "ts_from": ts_from,
+            "ts_to": ts_to,
+            "tz": settings.default_tz,
+            "day_start": settings.day_start,
+            "day_end": settings.day_end,
+        },
+    )
+    return cur.rowcount
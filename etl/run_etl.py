@@ -1,21 +1,51 @@
 # etl/run_etl.py
+"""
+CLI пайплайна. На уровне модуля импортируются только лёгкие модули (stdlib, config,
+logger, утилиты состояния; psycopg — при первом подключении, см. etl.utils.db):
+flows (pandas/pyarrow) и dotenv импортируются в тех шагах, которым они нужны,
+а bootstrap схемы выполняется после разбора аргументов и пропускается, если схема
+актуальна (см. etl.utils.schema.bootstrap). Замер: scripts/bench_startup.sh.
+"""
 import os
 import argparse
-from dotenv import load_dotenv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+import orjson
 from etl.utils.config import Settings
-from etl.flows.ingest_from_files import flow_ingest_from_files
-from etl.flows.parse_and_normalize import flow_parse_and_normalize
-from etl.flows.enrich_features import flow_enrich_features
-from etl.flows.load_to_core import flow_load_to_core
-from etl.flows.publish_views import flow_publish_views
 from etl.utils.logger import get_logger
-from etl.utils.schema import ensure_schema
-from etl.utils.db import init_db
+from etl.utils import work_queue
+from etl.utils.db import get_conn
+from etl.utils.stage_partitions import drop_expired_loads
+from etl.utils.step_state import LOAD_STEPS, completed_steps, load_steps_for, mark_done, pending_load_ids, run_step
 
 log = get_logger(__name__)
 
 STEP_ORDER = ["ingest", "parse", "enrich", "load", "publish"]
 
+
+def _step_flow(step: str):
+    """Flow шага; модуль импортируется при первом обращении."""
+    if step == "parse":
+        from etl.flows.parse_and_normalize import flow_parse_and_normalize
+
+        return flow_parse_and_normalize
+    if step == "enrich":
+        from etl.flows.enrich_features import flow_enrich_features
+
+        return flow_enrich_features
+    if step == "load":
+        from etl.flows.load_to_core import flow_load_to_core
+
+        return flow_load_to_core
+    if step == "rolling":
+        from etl.flows.rolling_features import flow_rolling_features
+
+        return flow_rolling_features
+    raise ValueError(f"Step '{step}' is not a per-load_id step")
+
+
 def _parse_steps(step_arg: str):
     if not step_arg:
         return STEP_ORDER
@@ -26,16 +56,308 @@ def _parse_steps(step_arg: str):
         raise ValueError(f"Invalid steps requested: {invalid}. Allowed: {STEP_ORDER}")
     return parts
 
+def _ingest(s, **kwargs):
+    """Регистрирует файлы и отмечает шаг ingest выполненным для новых load_id."""
+    from etl.flows.ingest_from_files import flow_ingest_from_files
+
+    ids = flow_ingest_from_files(s, **kwargs)
+    if ids:
+        mark_done(s, ids, "ingest")
+    return ids
+
+
+def _process_load_id(s, lid: str, steps, dry_run: bool = False, rerun: bool = False, lease=None) -> bool:
+    """
+    Прогоняет parse/enrich/load (и rolling вместе с load) для одного load_id. Возвращает False при ошибке шага.
+    Состояние шагов пишется в stage.load_steps: без rerun обработка продолжается с первого
+    незавершённого шага, а уже завершённые шаги до него пропускаются.
+    Итог отражается в статусе очереди (stage.stage_raw_files.status).
+    lease — аренда воркера очереди: шаги фиксируются и статус пишется, только пока она его;
+    после потери аренды следующие шаги не запускаются.
+    """
+    worker = lease.worker if lease else None
+    requested = load_steps_for(steps)
+    if not rerun:
+        done = completed_steps(s, lid)
+        first_pending = next((i for i, st in enumerate(requested) if st not in done), len(requested))
+        if first_pending:
+            log.info("resume: skipping completed steps", extra={"load_id": lid, "skipped": requested[:first_pending]})
+        requested = requested[first_pending:]
+
+    for step in requested:
+        if lease and lease.lost:
+            log.warning("lease lost: stopping before %s", step, extra={"load_id": lid, "worker": worker})
+            return False
+        if step in ("load", "rolling") and dry_run:
+            log.info("dry-run: skipping %s", step, extra={"load_id": lid})
+            continue
+        try:
+            run_step(s, lid, step, lambda step=step: _step_flow(step)(s, lid, worker=worker))
+            log.info("%s completed", step, extra={"load_id": lid})
+        except Exception as e:
+            log.exception("%s failed", step, extra={"load_id": lid})
+            work_queue.finish(s, lid, "failed", f"{step}: {e}", worker=worker)
+            return False
+
+    # загрузка готова, только когда завершены все шаги (частичный прогон оставляет её в очереди)
+    complete = set(LOAD_STEPS) <= completed_steps(s, lid)
+    return work_queue.finish(s, lid, "done" if complete else "pending", worker=worker)
+
+
+def _publish(s, load_ids):
+    from etl.flows.detect_anomalies import flow_detect_anomalies
+    from etl.flows.export_parquet import flow_export_parquet
+    from etl.flows.load_districts import flow_load_districts
+    from etl.flows.publish_views import flow_publish_views
+
+    district_partitions = set()
+    if s.districts_file:
+        try:
+            district_partitions = flow_load_districts(s)
+        except Exception:
+            log.exception("load_districts failed")
+    try:
+        flow_publish_views(s)
+        log.info("publish_views completed")
+    except Exception:
+        log.exception("publish_views failed")
+    try:
+        flow_detect_anomalies(s)
+    except Exception:
+        log.exception("detect_anomalies failed")
+    try:
+        flow_export_parquet(s, load_ids, extra_partitions={"district_id": district_partitions})
+    except Exception:
+        log.exception("export_parquet failed")
+
+
+def _apply_retention(s):
+    """Удаляет stage-секции загрузок старше STAGE_RETENTION_DAYS (0 — выключено)."""
+    if s.stage_retention_days <= 0:
+        return
+    try:
+        drop_expired_loads(s, s.stage_retention_days)
+    except Exception:
+        log.exception("stage retention failed")
+
+
+def _discover_days(raw_root: str, date_from: date, date_to: date):
+    """Каталоги raw_root/YYYY-MM-DD в диапазоне [date_from, date_to] (отсутствующие дни пропускаются)."""
+    days = []
+    d = date_from
+    while d <= date_to:
+        path = os.path.join(raw_root, d.isoformat())
+        if os.path.isdir(path):
+            days.append((d, path))
+        else:
+            log.warning("backfill: no raw dir for day, skipping", extra={"day": d.isoformat(), "path": path})
+        d += timedelta(days=1)
+    return days
+
+
+class _BackfillState:
+    """Файл состояния backfill: какие дни уже обработаны (для возобновления после сбоя)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = {}
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                self.done = orjson.loads(f.read()).get("done", {})
+
+    def mark_done(self, day: date, load_ids):
+        with self._lock:
+            self.done[day.isoformat()] = {
+                "load_ids": list(load_ids),
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+            }
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps({"done": self.done}, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+            os.replace(tmp, self.path)
+
+
+def _backfill_day(s, day: date, path: str, steps, dry_run: bool):
+    """
+    Регистрирует файлы дня (если ingest в steps) и обрабатывает его незавершённые загрузки —
+    в том числе зарегистрированные прошлым прерванным запуском или без ingest.
+    """
+    if "ingest" in steps:
+        _ingest(s, raw_dir=path)
+    ids = pending_load_ids(s, steps, raw_dir=path)
+    ok = all([_process_load_id(s, lid, steps, dry_run) for lid in ids])
+    return ids, ok
+
+
+def backfill(s, date_from: date, date_to: date, steps=None, workers: int = 4, dry_run: bool = False, force: bool = False) -> int:
+    """
+    Историческая догрузка в одном процессе: дни RAW_DIR/YYYY-MM-DD обрабатываются
+    пулом из workers потоков, publish выполняется один раз в конце. Параллельно идут
+    parse/enrich и запись измерений; пересчёт агрегатов и скользящих признаков
+    сериализуется advisory-блокировками (etl.flows.rollups.lock_aggregates).
+    Обработанные дни записываются в RUN_LOGS_DIR/backfill_state.json и при повторном
+    запуске пропускаются (force=True — обработать заново).
+    Возвращает число дней, завершившихся с ошибкой.
+    """
+    steps = steps or STEP_ORDER
+    state = _BackfillState(os.path.join(s.run_logs_dir, "backfill_state.json"))
+    days = _discover_days(s.raw_dir, date_from, date_to)
+    pending = [(d, p) for d, p in days if force or d.isoformat() not in state.done]
+    log.info(
+        "backfill start",
+        extra={"from": date_from.isoformat(), "to": date_to.isoformat(), "days": len(days),
+               "pending": len(pending), "workers": workers},
+    )
+
+    started = time.monotonic()
+    all_ids, failed = [], 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backfill") as pool:
+        futures = {pool.submit(_backfill_day, s, d, p, steps, dry_run): d for d, p in pending}
+        for n, fut in enumerate(as_completed(futures), start=1):
+            day = futures[fut]
+            try:
+                ids, ok = fut.result()
+            except Exception:
+                log.exception("backfill day failed", extra={"day": day.isoformat()})
+                ids, ok = [], False
+            all_ids.extend(ids)
+            if not ok:
+                failed += 1
+            elif ids:
+                state.mark_done(day, ids)
+            else:
+                # день без загрузок (нет файлов или шаги не выбраны) не считается обработанным
+                log.warning("backfill: nothing to process for day", extra={"day": day.isoformat()})
+            log.info(
+                "backfill progress",
+                extra={"day": day.isoformat(), "ok": ok, "load_ids": len(ids), "done": n, "total": len(pending),
+                       "elapsed_sec": round(time.monotonic() - started, 1)},
+            )
+
+    if "publish" in steps and all_ids:
+        _publish(s, all_ids)
+    _apply_retention(s)
+
+    log.info("backfill completed", extra={"days": len(pending), "failed": failed, "load_ids": len(all_ids)})
+    return failed
+
+
+def _registered_paths(s):
+    with get_conn(s) as conn, conn.cursor() as cur:
+        cur.execute("select to_regclass('stage.stage_raw_files') is not null as present")
+        if not cur.fetchone()["present"]:
+            return []
+        cur.execute("select distinct file_path from stage.stage_raw_files")
+        return [r["file_path"] for r in cur.fetchall()]
+
+
+def watch(s, steps=None, dry_run: bool = False, max_cycles: int = None):
+    """
+    Демон: следит за RAW_DIR и прогоняет пайплайн только для новых (устоявшихся) файлов.
+    Процесс живёт между запусками, поэтому импорты pandas/flows и схема уже прогреты.
+    Файлы, уже зарегистрированные в stage.stage_raw_files, при старте считаются обработанными.
+    """
+    from etl.utils.watcher import RawDirWatcher
+
+    steps = steps or STEP_ORDER
+    watcher = RawDirWatcher(s.raw_dir, s.watch_poll_sec, s.watch_settle_sec, known=_registered_paths(s))
+    log.info("watch start", extra={"raw_dir": s.raw_dir, "steps": steps})
+    cycles = 0
+    while max_cycles is None or cycles < max_cycles:
+        cycles += 1
+        try:
+            paths = watcher.poll()
+            if paths:
+                started = time.monotonic()
+                ids = _ingest(s, paths=paths) if "ingest" in steps else []
+                for lid in ids:
+                    _process_load_id(s, lid, steps, dry_run)
+                if "publish" in steps and ids:
+                    _publish(s, ids)
+                _apply_retention(s)
+                log.info(
+                    "watch: processed new files",
+                    extra={"files": len(paths), "load_ids": len(ids), "elapsed_sec": round(time.monotonic() - started, 2)},
+                )
+        except Exception:
+            log.exception("watch cycle failed")
+        watcher.wait()
+
+
+def work(s, exit_when_empty: bool = False) -> int:
+    """
+    Воркер очереди: забирает load_id из stage.stage_raw_files (for update skip locked),
+    держит аренду heartbeat'ом и выполняет parse/enrich/load. Воркеров может быть сколько
+    угодно на одном или нескольких хостах. exit_when_empty — выйти, когда забирать больше
+    нечего и никто ничего не обрабатывает. Возвращает число обработанных загрузок.
+    """
+    wid = work_queue.worker_id()
+    log.info("worker start", extra={"worker": wid, "lease_sec": s.queue_lease_sec})
+    processed = 0
+    while True:
+        lid = work_queue.claim(s, wid, s.queue_lease_sec, s.queue_max_attempts)
+        if lid is None:
+            counts = work_queue.queue_counts(s, s.queue_max_attempts)
+            if exit_when_empty and not counts["claimable"] and not counts["running"]:
+                break
+            time.sleep(s.watch_poll_sec)
+            continue
+        with work_queue.Lease(s, lid, wid, s.queue_lease_sec) as lease:
+            _process_load_id(s, lid, LOAD_STEPS, lease=lease)
+        if lease.lost:
+            log.warning("worker: lease expired during processing", extra={"load_id": lid, "worker": wid})
+        processed += 1
+    log.info("worker finished: queue drained", extra={"worker": wid, "processed": processed})
+    return processed
+
+
+def coordinate(s, steps) -> int:
+    """
+    Координатор очереди (один на кластер): ingest регистрирует файлы в очереди, затем
+    ожидание, пока воркеры не разберут её, и один publish по загрузкам, завершённым
+    за время работы координатора. Возвращает число окончательно упавших загрузок.
+    """
+    started_at = work_queue.server_time(s)
+    ids = _ingest(s) if "ingest" in steps else []
+    log.info("coordinator: queued load_ids", extra={"count": len(ids)})
+
+    while True:
+        counts = work_queue.queue_counts(s, s.queue_max_attempts)
+        if not counts["claimable"] and not counts["running"]:
+            break
+        log.info("coordinator: waiting for workers", extra=counts)
+        time.sleep(s.watch_poll_sec)
+
+    done = work_queue.done_since(s, started_at)
+    if "publish" in steps and done:
+        _publish(s, done)
+    _apply_retention(s)
+    log.info("coordinator: queue drained", extra={"done": len(done), **counts})
+    return counts["failed"]
+
+
 def main(argv=None):
-    load_dotenv()
-    s = Settings.from_env()
-    ensure_schema(s)
-    init_db(s)
     parser = argparse.ArgumentParser(prog="run_etl", description="Run ETL pipeline")
     parser.add_argument("--steps", type=str, default=",".join(STEP_ORDER),
                         help="Comma-separated steps to run: ingest,parse,enrich,load,publish (default all)")
-    parser.add_argument("--load-id", type=str, default=None, help="Run pipeline only for this load_id (UUID string). If omitted, run for all ingested load_ids (if ingest step ran) or all found in quality_load_log.")
+    parser.add_argument("--load-id", type=str, default=None, help="Run pipeline only for this load_id (UUID string). If omitted, run for ingested load_ids plus all load_ids with incomplete steps in stage.load_steps.")
+    parser.add_argument("--rerun", action="store_true", help="Re-run requested steps even if stage.load_steps marks them as done.")
     parser.add_argument("--dry-run", action="store_true", help="Dry run mode: do not write to core tables (some steps may still write staged tables).")
+    parser.add_argument("--backfill", nargs=2, metavar=("START_DATE", "END_DATE"), default=None,
+                        help="Backfill RAW_DIR/YYYY-MM-DD directories for the date range (inclusive) in one process.")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Backfill: number of days processed concurrently.")
+    parser.add_argument("--force", action="store_true", help="Backfill: reprocess days already marked as done.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Run as a daemon: process new files in RAW_DIR as they land (same as RUN_MODE=watch).")
+    parser.add_argument("--worker", action="store_true",
+                        help="Queue worker: claim load_ids from stage.stage_raw_files and run parse/enrich/load (same as RUN_MODE=worker).")
+    parser.add_argument("--coordinator", action="store_true",
+                        help="Queue coordinator: ingest, wait until workers drain the queue, publish once (same as RUN_MODE=coordinator).")
+    parser.add_argument("--exit-when-empty", action="store_true",
+                        help="Worker: exit once nothing is left to claim and nothing is running.")
     args = parser.parse_args(argv)
 
     try:
@@ -44,6 +366,40 @@ def main(argv=None):
         log.error("Failed to parse steps: %s", e)
         return 2
 
+    from dotenv import load_dotenv
+    from etl.utils.schema import bootstrap
+
+    load_dotenv()
+    s = Settings.from_env()
+    # DDL выполняется только если схема изменилась с прошлого запуска (хеш в core.etl_schema_version)
+    bootstrap(s)
+
+    if args.backfill:
+        try:
+            date_from, date_to = (date.fromisoformat(d) for d in args.backfill)
+        except ValueError as e:
+            log.error("Invalid backfill dates: %s", e)
+            return 2
+        if date_from > date_to:
+            log.error("Invalid backfill range: START_DATE > END_DATE")
+            return 2
+        failed = backfill(s, date_from, date_to, steps, args.workers, args.dry_run, args.force)
+        return 1 if failed else 0
+
+    if args.worker or s.run_mode == "worker":
+        if args.dry_run:
+            log.error("--dry-run is not supported for queue workers")
+            return 2
+        work(s, args.exit_when_empty)
+        return 0
+
+    if args.coordinator or s.run_mode == "coordinator":
+        return 1 if coordinate(s, steps) else 0
+
+    if args.watch or s.run_mode == "watch":
+        watch(s, steps, args.dry_run)
+        return 0
+
     log.info("Starting ETL pipeline", extra={"steps": steps, "load_id": args.load_id, "dry_run": args.dry_run})
 
     load_ids = []
@@ -51,24 +407,23 @@ def main(argv=None):
         if "ingest" in steps:
             # ingest returns list of load_id (strings)
             try:
-                ids = flow_ingest_from_files(s)
+                ids = _ingest(s)
                 log.info("Ingest produced load_ids", extra={"count": len(ids), "ids": ids})
             except Exception:
                 log.exception("Ingest step failed")
                 ids = []
-            if args.load_id:
-                # if user provided load_id, use intersection if possible
-                load_ids = [args.load_id] if args.load_id in ids else ([args.load_id] if args.load_id else ids)
-            else:
-                load_ids = ids
         else:
-            # if no ingest step, but load-id provided — we run for that one only
-            if args.load_id:
-                load_ids = [args.load_id]
-            else:
-                # Try to find recent load_ids from quality_load_log if present (non-empty)
-                # To avoid adding DB dependency here, we will default to empty list (user should pass --load-id or run ingest).
-                load_ids = []
+            ids = []
+
+        if args.load_id:
+            # if user provided load_id — run for that one only
+            load_ids = [args.load_id]
+        else:
+            # новые load_id + ранее зарегистрированные с незавершёнными шагами (возобновление после сбоя)
+            pending = pending_load_ids(s, steps)
+            load_ids = ids + [lid for lid in pending if lid not in ids]
+            if pending:
+                log.info("Pending load_ids found in stage.load_steps", extra={"count": len(pending)})
     except Exception:
         log.exception("Failed to determine load_ids to process")
         load_ids = []
@@ -78,42 +433,12 @@ def main(argv=None):
         log.warning("No load_ids found for processing. Skipping parse/enrich/load steps.")
     # Process each load_id step-by-step
     for lid in load_ids:
-        # parse
-        if "parse" in steps:
-            try:
-                flow_parse_and_normalize(s, lid)
-                log.info("parse completed", extra={"load_id": lid})
-            except Exception:
-                log.exception("parse failed", extra={"load_id": lid})
-                # continue with next load_id
-                continue
-
-        if "enrich" in steps:
-            try:
-                flow_enrich_features(s, lid)
-                log.info("enrich completed", extra={"load_id": lid})
-            except Exception:
-                log.exception("enrich failed", extra={"load_id": lid})
-                continue
-
-        if "load" in steps:
-            if args.dry_run:
-                log.info("dry-run: skipping load_to_core", extra={"load_id": lid})
-            else:
-                try:
-                    flow_load_to_core(s, lid)
-                    log.info("load_to_core completed", extra={"load_id": lid})
-                except Exception:
-                    log.exception("load_to_core failed", extra={"load_id": lid})
-                    continue
+        _process_load_id(s, lid, steps, args.dry_run, args.rerun)
 
     # publish step is global (not per-load_id)
     if "publish" in steps:
-        try:
-            flow_publish_views(s)
-            log.info("publish_views completed")
-        except Exception:
-            log.exception("publish_views failed")
+        _publish(s, load_ids)
+    _apply_retention(s)
 
     log.info("ETL pipeline completed")
     return 0
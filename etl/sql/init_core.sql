@@ -4,25 +4,38 @@ create schema if not exists stage;
 create schema if not exists features;
 create schema if not exists quality;
 
+-- Скрипт идемпотентный: таблицы не пересоздаются, чтобы не терять
+-- накопленные измерения и инкрементальные агрегаты (core.rollup_*).
+
 -- core: справочник зданий
-drop table if exists core.buildings cascade;
-create table core.buildings (
+create table if not exists core.buildings (
     building_id uuid primary key default gen_random_uuid(),
+    building_key int generated by default as identity unique,
     external_code text unique not null,
     district_id text
 );
+-- целочисленный ключ для агрегатов (для БД, созданных до его появления)
+alter table core.buildings add column if not exists building_key int generated by default as identity unique;
+
+-- core: справочник районов (загружается etl/flows/load_districts.py из DISTRICTS_FILE).
+-- district_id — внешний код района, district_key — целочисленный ключ для агрегатов
+create table if not exists core.districts (
+    district_key int generated by default as identity primary key,
+    district_id text unique not null,
+    name text
+);
+alter table core.buildings add column if not exists district_key int references core.districts(district_key);
+create index if not exists idx_buildings_district_key on core.buildings(district_key);
 
 -- core: ИТП
-drop table if exists core.itp cascade;
-create table core.itp (
+create table if not exists core.itp (
     itp_id uuid primary key default gen_random_uuid(),
     building_id uuid not null references core.buildings(building_id),
     external_code text unique not null
 );
 
 -- core: счётчики
-drop table if exists core.meters cascade;
-create table core.meters (
+create table if not exists core.meters (
     meter_id uuid primary key default gen_random_uuid(),
     itp_id uuid not null references core.itp(itp_id),
     external_code text unique not null,
@@ -31,8 +44,7 @@ create table core.meters (
 );
 
 -- core: измерения
-drop table if exists core.measurements cascade;
-create table core.measurements (
+create table if not exists core.measurements (
     measurement_id uuid primary key default gen_random_uuid(),
     meter_id uuid not null references core.meters(meter_id),
     ts timestamptz not null,
@@ -41,19 +53,236 @@ create table core.measurements (
     unique (meter_id, ts)
 );
 
--- stage: парсинг файлов
-drop table if exists stage.stage_parsed_measurements cascade;
-create table stage.stage_parsed_measurements (
+-- stage: парсинг файлов. Секция на каждый load_id (etl/utils/stage_partitions.py):
+-- повторная обработка — truncate секции, retention — drop секции.
+create table if not exists stage.stage_parsed_measurements (
     load_id uuid not null,
     source_file text not null,
+    sheet_name text,
+    sheet_row_num int,
     row_num int not null,
-    ts timestamptz not null,
+    ts timestamptz,
     building_code text not null,
     itp_code text not null,
     meter_code text not null,
     metric text not null,
-    value double precision not null,
-    unit text not null,
+    value double precision,
+    unit text,
+    reading double precision,
+    quality text,
+    reason text,
+    inserted_at timestamptz default now(),
+    primary key (load_id, row_num)
+) partition by list (load_id);
+-- DQ-разметка строк (etl/utils/quality.py): строки с пропусками сохраняются с quality='bad'
+alter table stage.stage_parsed_measurements
+    add column if not exists quality text,
+    add column if not exists reason text,
+    add column if not exists inserted_at timestamptz default now(),
+    alter column ts drop not null,
+    alter column value drop not null,
+    alter column unit drop not null;
+
+-- происхождение строки в многолистовых книгах: лист и номер строки в нём (row_num — сквозной по файлу)
+alter table stage.stage_parsed_measurements
+    add column if not exists sheet_name text,
+    add column if not exists sheet_row_num int;
+
+-- исходное накопительное показание для строк, переведённых в потребление за интервал (etl/utils/readings.py)
+alter table stage.stage_parsed_measurements
+    add column if not exists reading double precision;
+
+-- stage: временные атрибуты строк (etl/flows/enrich_features.py), секционирована так же
+create table if not exists stage.stage_parsed_measurements_enriched (
+    load_id uuid not null,
+    row_num int not null,
+    ts_hour timestamptz,
+    dow int,
+    is_weekend boolean,
+    inserted_at timestamptz default now(),
     primary key (load_id, row_num)
+) partition by list (load_id);
+
+-- реестр файлов (etl/flows/ingest_from_files.py) и очередь загрузок; purged_at — stage-секции загрузки
+-- удалены по retention. Колонки очереди добавляет bootstrap (etl/utils/work_queue.ensure_queue_columns)
+create table if not exists stage.stage_raw_files (
+    load_id uuid primary key,
+    file_path text not null,
+    file_name text not null,
+    detected_from timestamptz,
+    detected_to timestamptz,
+    rows int,
+    inserted_at timestamptz default now()
+);
+alter table stage.stage_raw_files add column if not exists purged_at timestamptz;
+
+-- features: календарное измерение с часовой гранулярностью (etl/flows/time_attributes.py)
+create table if not exists features.time_attributes (
+    ts timestamptz primary key,
+    hour int not null,
+    day_night text not null,
+    month int not null,
+    season text not null,
+    is_weekend boolean not null
+);
+
+-- core: пирамида агрегатов hour -> day -> month по зданиям (etl/flows/rollups.py)
+create table if not exists core.rollup_hourly (
+    building_key int not null,
+    hour timestamptz not null,
+    district_key int,
+    supply double precision not null default 0,
+    return double precision not null default 0,
+    consumption double precision not null default 0,
+    loss double precision not null default 0,
+    t1_avg double precision,
+    t2_avg double precision,
+    n_measurements int not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (building_key, hour)
+);
+create table if not exists core.rollup_daily (
+    building_key int not null,
+    day timestamptz not null,
+    supply double precision not null default 0,
+    return double precision not null default 0,
+    consumption double precision not null default 0,
+    loss double precision not null default 0,
+    t1_avg double precision,
+    t2_avg double precision,
+    n_hours int not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (building_key, day)
+);
+create table if not exists core.rollup_monthly (
+    building_key int not null,
+    month timestamptz not null,
+    supply double precision not null default 0,
+    return double precision not null default 0,
+    consumption double precision not null default 0,
+    loss double precision not null default 0,
+    t1_avg double precision,
+    t2_avg double precision,
+    n_days int not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (building_key, month)
 );
+create index if not exists idx_rollup_hourly_hour on core.rollup_hourly(hour);
+-- детектор аномалий (etl/flows/detect_anomalies.py) выбирает часы по watermark updated_at
+create index if not exists idx_rollup_hourly_updated_at on core.rollup_hourly(updated_at);
+create index if not exists idx_rollup_daily_day on core.rollup_daily(day);
 
+-- район здания в часовом агрегате (для БД, созданных до районного агрегата) и покрывающий
+-- индекс, по которому core.rollup_hourly_district пересчитывается без чтения строк таблицы
+alter table core.rollup_hourly add column if not exists district_key int;
+update core.rollup_hourly r
+set district_key = b.district_key
+from core.buildings b
+where b.building_key = r.building_key
+  and r.district_key is distinct from b.district_key;
+create index if not exists idx_rollup_hourly_district
+    on core.rollup_hourly (district_key, hour)
+    include (supply, return, consumption, loss);
+
+-- core: часовые суммы по районам (строка на district_key и час)
+create table if not exists core.rollup_hourly_district (
+    district_key int not null,
+    hour timestamptz not null,
+    buildings_reporting int not null default 0,
+    supply double precision not null default 0,
+    return double precision not null default 0,
+    consumption double precision not null default 0,
+    loss double precision not null default 0,
+    loss_avg double precision,
+    updated_at timestamptz not null default now(),
+    primary key (district_key, hour)
+);
+
+-- одноразовые первичные наполнения (пирамида агрегатов, индекс полноты): отметка о выполнении,
+-- не зависящая от того, пусты ли таблицы (etl/utils/schema.py: init_done / mark_init_done)
+create table if not exists core.etl_init (
+    name text primary key,
+    done_at timestamptz not null default now()
+);
+
+-- features: скользящие признаки по зданиям (etl/flows/rolling_features.py)
+create table if not exists features.rolling_by_building (
+    building_key int not null,
+    ts timestamptz not null,
+    consumption double precision,
+    consumption_24h double precision,
+    consumption_7d double precision,
+    t1 double precision,
+    t2 double precision,
+    delta_t double precision,
+    delta_t_low boolean,
+    delta_t_high boolean,
+    updated_at timestamptz not null default now(),
+    primary key (building_key, ts)
+);
+
+-- stage: состояние шагов по load_id (etl/utils/step_state.py); attempts — число запусков шага
+create table if not exists stage.load_steps (
+    load_id uuid not null,
+    step text not null,
+    status text not null,
+    started_at timestamptz not null default now(),
+    finished_at timestamptz,
+    duration_ms int,
+    rows int,
+    error text,
+    attempts int not null default 0,
+    primary key (load_id, step)
+);
+
+-- история накопительных показаний счётчиков (etl/utils/readings.py): по ней load считает интервалы
+create table if not exists core.meter_readings (
+    meter_code text not null,
+    ts timestamptz not null,
+    reading double precision not null,
+    load_id uuid,
+    updated_at timestamptz not null default now(),
+    primary key (meter_code, ts)
+);
+
+-- индекс полноты: 24-битная маска часов на счётчик и сутки (etl/flows/coverage.py)
+create table if not exists core.meter_day_coverage (
+    meter_id uuid not null,
+    day date not null,
+    hours_mask int not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (meter_id, day)
+);
+create index if not exists idx_meter_day_coverage_day on core.meter_day_coverage(day);
+
+-- quality: детектор аномалий (etl/flows/detect_anomalies.py) — watermark по core.rollup_hourly.updated_at,
+-- базовые линии зданий (число часов, вес с затуханием, среднее, M2) и найденные аномалии
+create table if not exists quality.detector_state (
+    detector text primary key,
+    watermark timestamptz not null,
+    updated_at timestamptz not null default now()
+);
+create table if not exists quality.building_baseline (
+    building_key int primary key,
+    last_hour timestamptz,
+    loss_n bigint not null default 0,
+    loss_w double precision,
+    loss_mean double precision,
+    loss_m2 double precision,
+    dt_n bigint not null default 0,
+    dt_w double precision,
+    dt_mean double precision,
+    dt_m2 double precision,
+    updated_at timestamptz not null default now()
+);
+create table if not exists quality.anomalies (
+    building_key int not null,
+    hour timestamptz not null,
+    kind text not null,
+    value double precision,
+    expected double precision,
+    score double precision,
+    detected_at timestamptz not null default now(),
+    primary key (building_key, hour, kind)
+);
+create index if not exists idx_anomalies_detected_at on quality.anomalies(detected_at);
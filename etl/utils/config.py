@@ -2,6 +2,14 @@ import os
 from dataclasses import dataclass
 from typing import List
 
+# корень репозитория: относительные пути к файлам проекта не зависят от рабочего каталога
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def repo_path(path: str) -> str:
+    """Относительный путь -> путь от корня репозитория (пустой и абсолютный — как есть)."""
+    return path if not path or os.path.isabs(path) else os.path.join(REPO_ROOT, path)
+
 
 @dataclass
 class Settings:
@@ -21,6 +29,22 @@ class Settings:
     log_level: str
     ingest_year: int
     ingest_month: int
+    expectations_suite: str
+    quality_reports_dir: str
+    export_dir: str
+    run_logs_dir: str
+    run_mode: str
+    watch_poll_sec: float
+    watch_settle_sec: float
+    stream_chunk_size: int
+    load_mode: str
+    stage_retention_days: int
+    queue_lease_sec: float
+    queue_max_attempts: int
+    districts_file: str
+    anomaly_z: float
+    anomaly_min_hours: int
+    anomaly_halflife_hours: float
 
     @staticmethod
     def from_env() -> "Settings":
@@ -53,4 +77,20 @@ class Settings:
             log_level=os.getenv("LOG_LEVEL", "INFO").upper(),
             ingest_year=int(os.getenv("INGEST_YEAR", os.getenv("YEAR", "2025"))),
             ingest_month=int(os.getenv("INGEST_MONTH", os.getenv("MONTH", "4"))),
+            expectations_suite=repo_path(os.getenv("EXPECTATIONS_SUITE", "expectations/suites/stage_parsed_measurements.json")),
+            quality_reports_dir=os.getenv("QUALITY_REPORTS_DIR", "artifacts/quality_reports"),
+            export_dir=os.getenv("EXPORT_DIR", "artifacts/exports"),
+            run_logs_dir=os.getenv("RUN_LOGS_DIR", "artifacts/run_logs"),
+            run_mode=os.getenv("RUN_MODE", "once").lower(),
+            watch_poll_sec=float(os.getenv("WATCH_POLL_SEC", "5")),
+            watch_settle_sec=float(os.getenv("WATCH_SETTLE_SEC", "10")),
+            stream_chunk_size=int(os.getenv("STREAM_CHUNK_SIZE", "10000")),
+            load_mode=os.getenv("LOAD_MODE", "upsert").lower(),
+            stage_retention_days=int(os.getenv("STAGE_RETENTION_DAYS", "0")),
+            queue_lease_sec=float(os.getenv("QUEUE_LEASE_SEC", "300")),
+            queue_max_attempts=int(os.getenv("QUEUE_MAX_ATTEMPTS", "3")),
+            districts_file=os.getenv("DISTRICTS_FILE", ""),
+            anomaly_z=float(os.getenv("ANOMALY_Z", "4")),
+            anomaly_min_hours=int(os.getenv("ANOMALY_MIN_HOURS", "168")),
+            anomaly_halflife_hours=float(os.getenv("ANOMALY_HALFLIFE_HOURS", "336")),
         )
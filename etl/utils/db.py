@@ -1,10 +1,12 @@
-import psycopg
-from psycopg.rows import dict_row
+import os
 from contextlib import contextmanager
 from etl.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# путь от модуля, а не от текущего каталога: CLI можно запускать не из корня репозитория
+INIT_CORE_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql", "init_core.sql")
+
 
 def get_conn(settings_or_url):
     """
@@ -17,6 +19,10 @@ def get_conn(settings_or_url):
     else:
         database_url = str(settings_or_url)
 
+    # psycopg импортируется при первом подключении: CLI без обращения к БД (--help) его не грузит
+    import psycopg
+    from psycopg.rows import dict_row
+
     try:
         conn = psycopg.connect(
             database_url,
@@ -43,10 +49,19 @@ def exec_sql(conn, sql: str, params=None):
 
 def init_db(settings):
     with get_conn(settings) as conn:
-        exec_sql(conn, open("etl/sql/init_core.sql", "r", encoding="utf-8").read())
+        with open(INIT_CORE_SQL, "r", encoding="utf-8") as f:
+            exec_sql(conn, f.read())
         conn.commit()
 
 
+def advisory_xact_lock(cur, name: str):
+    """
+    Транзакционная advisory-блокировка по имени (снимается при commit/rollback).
+    Сериализует участки, которые параллельные процессы/потоки не должны выполнять одновременно.
+    """
+    cur.execute("select pg_advisory_xact_lock(hashtext(%s))", (name,))
+
+
 def fetchall(conn, sql: str, params=None):
     """
     Выполняет SQL и возвращает все строки (dict).
@@ -60,6 +75,28 @@ def fetchall(conn, sql: str, params=None):
             raise
 
 
+def stream_rows(conn, sql: str, params=None, chunk_size: int = 10000, name: str = "etl_stream", row_factory=None):
+    """
+    Читает результат через именованный (server-side) курсор порциями по chunk_size строк.
+    Генератор отдаёт списки строк; в памяти держится только текущая порция.
+    Курсор живёт в текущей транзакции conn, поэтому между порциями можно писать через другой курсор.
+    """
+    cur = conn.cursor(name=name, row_factory=row_factory) if row_factory else conn.cursor(name=name)
+    try:
+        cur.itersize = chunk_size
+        cur.execute(sql, params or ())
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    except Exception as e:
+        logger.error("Failed to stream SQL: %s", sql, exc_info=e)
+        raise
+    finally:
+        cur.close()
+
+
 @contextmanager
 def get_cursor(settings_or_url):
     """
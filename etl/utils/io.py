@@ -1,7 +1,8 @@
 import hashlib
 import os
 import glob
-from typing import List, Iterable
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 
 def sha256_file(path: str) -> str:
@@ -28,3 +29,21 @@ def list_files(root: str, patterns: Iterable[str]) -> List[str]:
         files.extend(glob.glob(os.path.join(root, p)))
     files = [f for f in files if os.path.isfile(f)]
     return sorted(files)
+
+
+@contextmanager
+def open_table_file(path: str) -> Iterator[Tuple[List[Optional[str]], Callable]]:
+    """
+    Открывает Excel/CSV один раз и отдаёт (имена листов, read(sheet_name) -> DataFrame).
+    Для Excel все листы читаются из одной открытой книги (pd.ExcelFile); read не потокобезопасен.
+    Для CSV — один «лист» с именем None.
+    """
+    import pandas as pd
+
+    if path.lower().endswith(".csv"):
+        yield [None], lambda _name: pd.read_csv(path, sep=None, engine="python")
+        return
+
+    engine = "openpyxl" if path.lower().endswith((".xlsx", ".xlsm")) else None
+    with pd.ExcelFile(path, engine=engine) as xl:
+        yield list(xl.sheet_names), lambda name: xl.parse(name)
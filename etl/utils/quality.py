@@ -0,0 +1,218 @@
+# etl/utils/quality.py
+"""
+Лёгкий исполнитель expectations-suite (формат Great Expectations) над
+распарсенным батчем до записи в stage.
+
+Suite компилируется один раз в список векторных проверок:
+  - expect_column_values_to_not_be_null    -> маска isna()
+  - expect_column_values_to_be_between     -> NumPy-маска диапазона (+ row_condition)
+  - expect_column_min_to_be_between        -> построчно: value >= min_value (+ row_condition)
+  - expect_compound_columns_to_be_unique   -> хеш строк (hash_pandas_object) + duplicated
+  - expect_table_columns_to_match_ordered_list -> проверка уровня таблицы (только отчёт)
+
+Строки помечаются колонками quality ('ok' / 'bad') и reason (список
+несработавших проверок через ';'). Неизвестные типы ожиданий и условия
+пропускаются и попадают в отчёт как skipped.
+"""
+import os
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import orjson
+import pandas as pd
+
+from etl.utils.logger import get_logger
+
+log = get_logger(__name__)
+
+# Колонки, которые заполняет сам движок или БД, — их отсутствие в батче не ошибка
+_ENGINE_COLUMNS = ("quality", "reason", "inserted_at")
+
+_IN_CONDITION = re.compile(r"^\s*(\w+)\s+in\s+\((.*)\)\s*$", re.IGNORECASE)
+_EQ_CONDITION = re.compile(r"^\s*(\w+)\s*==?\s*'([^']*)'\s*$")
+_QUOTED = re.compile(r"'([^']*)'")
+
+
+class Check(NamedTuple):
+    label: str
+    expectation: dict
+    # fn(df) -> маска строк, нарушающих ожидание (None для проверок уровня таблицы)
+    row_fn: Optional[Callable[[pd.DataFrame], np.ndarray]]
+    # fn(df) -> (success, details) для проверок уровня таблицы
+    table_fn: Optional[Callable[[pd.DataFrame], Tuple[bool, dict]]] = None
+
+
+def _compile_condition(kwargs: dict) -> Optional[Callable[[pd.DataFrame], np.ndarray]]:
+    """row_condition -> fn(df) с булевой маской строк, к которым применяется ожидание."""
+    cond = kwargs.get("row_condition")
+    if not cond:
+        return lambda df: np.ones(len(df), dtype=bool)
+
+    m = _IN_CONDITION.match(cond)
+    if m:
+        col, values = m.group(1), _QUOTED.findall(m.group(2))
+        return lambda df: df[col].isin(values).to_numpy() if col in df.columns else np.zeros(len(df), dtype=bool)
+
+    m = _EQ_CONDITION.match(cond)
+    if m:
+        col, value = m.group(1), m.group(2)
+        return lambda df: (df[col] == value).to_numpy() if col in df.columns else np.zeros(len(df), dtype=bool)
+
+    return None
+
+
+def _numeric(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def _compile_expectation(exp: dict) -> Optional[Check]:
+    etype = exp.get("expectation_type")
+    kwargs = exp.get("kwargs", {})
+
+    if etype == "expect_column_values_to_not_be_null":
+        col = kwargs["column"]
+        return Check(
+            f"not_null({col})",
+            exp,
+            lambda df: df[col].isna().to_numpy() if col in df.columns else np.ones(len(df), dtype=bool),
+        )
+
+    if etype in ("expect_column_values_to_be_between", "expect_column_min_to_be_between"):
+        col = kwargs["column"]
+        cond = _compile_condition(kwargs)
+        if cond is None:
+            return None
+        lo, hi = kwargs.get("min_value"), kwargs.get("max_value")
+        if etype == "expect_column_min_to_be_between":
+            # минимум по подмножеству >= min_value <=> каждая строка подмножества >= min_value
+            hi = None
+        name = "between" if etype == "expect_column_values_to_be_between" else "min"
+
+        def between(df, col=col, cond=cond, lo=lo, hi=hi):
+            v = _numeric(df, col)
+            bad = np.zeros(len(df), dtype=bool)
+            with np.errstate(invalid="ignore"):
+                if lo is not None:
+                    bad |= v < lo
+                if hi is not None:
+                    bad |= v > hi
+            return bad & cond(df)
+
+        return Check(f"{name}({col})", exp, between)
+
+    if etype == "expect_compound_columns_to_be_unique":
+        cols = list(kwargs["column_list"])
+
+        def unique(df, cols=cols):
+            present = [c for c in cols if c in df.columns]
+            if not present or df.empty:
+                return np.zeros(len(df), dtype=bool)
+            hashes = pd.util.hash_pandas_object(df[present], index=False).to_numpy()
+            # первая копия остаётся валидной, дубликаты помечаются
+            return pd.Series(hashes).duplicated(keep="first").to_numpy()
+
+        return Check(f"unique({','.join(cols)})", exp, unique)
+
+    if etype == "expect_table_columns_to_match_ordered_list":
+        expected = [c for c in kwargs["column_list"] if c not in _ENGINE_COLUMNS]
+
+        def columns(df, expected=expected):
+            missing = [c for c in expected if c not in df.columns]
+            unexpected = [c for c in df.columns if c not in kwargs["column_list"]]
+            return not missing and not unexpected, {"missing": missing, "unexpected": unexpected}
+
+        return Check("table_columns", exp, None, columns)
+
+    return None
+
+
+@lru_cache(maxsize=8)
+def load_suite(path: str) -> Tuple[str, Tuple[Check, ...], Tuple[dict, ...]]:
+    """
+    Читает и компилирует suite. Результат кешируется по пути:
+    (suite_name, скомпилированные проверки, пропущенные ожидания).
+    """
+    with open(path, "rb") as f:
+        suite = orjson.loads(f.read())
+
+    checks: List[Check] = []
+    skipped: List[dict] = []
+    for exp in suite.get("expectations", []):
+        try:
+            check = _compile_expectation(exp)
+        except KeyError:
+            check = None
+        if check is None:
+            skipped.append(exp)
+        else:
+            checks.append(check)
+    return suite.get("expectation_suite_name", os.path.basename(path)), tuple(checks), tuple(skipped)
+
+
+def validate_batch(df: pd.DataFrame, suite_path: str) -> Tuple[pd.DataFrame, dict]:
+    """
+    Выполняет suite над батчем. Возвращает (df с колонками quality/reason, отчёт).
+    """
+    suite_name, checks, skipped = load_suite(suite_path)
+    n = len(df)
+    row_nums = df["row_num"].to_numpy() if "row_num" in df.columns else np.arange(1, n + 1)
+    any_bad = np.zeros(n, dtype=bool)
+    reason = pd.Series("", index=df.index, dtype=object)
+    results = []
+
+    for check in checks:
+        if check.row_fn is None:
+            success, details = check.table_fn(df)
+            results.append({"expectation_type": check.expectation["expectation_type"], "success": success, **details})
+            continue
+
+        bad = check.row_fn(df)
+        count = int(bad.sum())
+        if count:
+            any_bad |= bad
+            reason = reason.where(~bad, reason + check.label + ";")
+        results.append(
+            {
+                "expectation_type": check.expectation["expectation_type"],
+                "kwargs": check.expectation.get("kwargs", {}),
+                "success": count == 0,
+                "unexpected_count": count,
+                "unexpected_percent": round(100.0 * count / n, 4) if n else 0.0,
+                "partial_unexpected_rows": row_nums[bad][:20].tolist(),
+            }
+        )
+
+    out = df.copy()
+    out["quality"] = np.where(any_bad, "bad", "ok")
+    reason = reason.str.rstrip(";")
+    out["reason"] = reason.where(reason != "", None)
+
+    report = {
+        "suite": suite_name,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "rows": n,
+        "rows_ok": int(n - any_bad.sum()),
+        "rows_bad": int(any_bad.sum()),
+        "success": not any_bad.any() and all(r["success"] for r in results),
+        "results": results,
+        "skipped": [e.get("expectation_type") for e in skipped],
+    }
+    return out, report
+
+
+def write_report(report: dict, reports_dir: str, name: str) -> Optional[str]:
+    """Сохраняет отчёт в reports_dir/<name>.json. Ошибки записи только логируются."""
+    try:
+        os.makedirs(reports_dir, exist_ok=True)
+        path = os.path.join(reports_dir, f"{name}.json")
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        return path
+    except Exception as e:
+        log.warning("Can't write quality report %s: %s", name, e)
+        return None
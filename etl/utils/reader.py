@@ -0,0 +1,146 @@
+# etl/utils/reader.py
+"""
+Потоковое чтение временных рядов в Arrow/NumPy с постоянным потреблением памяти.
+
+Данные читаются через именованный server-side курсор (etl.utils.db.stream_rows)
+кортежами (без dict на строку) и отдаются батчами фиксированного размера:
+
+    for batch in read_timeseries(settings, buildings=["BUILDING_GVS"], ts_from=..., ts_to=...,
+                                 columns=["ts", "meter_code", "value"]):
+        ...  # pyarrow.RecordBatch
+
+Источники:
+  - "measurements" — core.measurements (+ коды счётчика/здания, метрика);
+  - "hourly" / "daily" / "monthly" — балансы core.rollup_* (см. etl.flows.rollups).
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from psycopg.rows import tuple_row
+
+from etl.utils.db import get_conn, stream_rows
+
+_SOURCES = {
+    "measurements": {
+        "from": """
+            core.measurements m
+            join core.meters mt on mt.meter_id = m.meter_id
+            join core.itp i on i.itp_id = mt.itp_id
+            join core.buildings b on b.building_id = i.building_id
+        """,
+        "ts": "m.ts",
+        "meter": "mt.external_code",
+        "order": "mt.external_code, m.ts",
+        "columns": {
+            "ts": ("m.ts", "timestamp"),
+            "meter_id": ("m.meter_id::text", "string"),
+            "meter_code": ("mt.external_code", "string"),
+            "building_key": ("b.building_key", "int32"),
+            "building_code": ("b.external_code", "string"),
+            "metric": ("mt.metric", "string"),
+            "unit": ("mt.unit", "string"),
+            "value": ("m.value", "float64"),
+        },
+    },
+}
+
+for _level, _table, _ts in (
+    ("hourly", "core.rollup_hourly", "hour"),
+    ("daily", "core.rollup_daily", "day"),
+    ("monthly", "core.rollup_monthly", "month"),
+):
+    _SOURCES[_level] = {
+        "from": f"{_table} r join core.buildings b on b.building_key = r.building_key",
+        "ts": f"r.{_ts}",
+        "meter": None,
+        "order": f"r.building_key, r.{_ts}",
+        "columns": {
+            "ts": (f"r.{_ts}", "timestamp"),
+            "building_key": ("r.building_key", "int32"),
+            "building_code": ("b.external_code", "string"),
+            "supply": ("r.supply", "float64"),
+            "return": ("r.return", "float64"),
+            "consumption": ("r.consumption", "float64"),
+            "loss": ("r.loss", "float64"),
+            "t1_avg": ("r.t1_avg", "float64"),
+            "t2_avg": ("r.t2_avg", "float64"),
+        },
+    }
+
+
+def _arrow_type(kind: str):
+    import pyarrow as pa
+
+    return {
+        "timestamp": pa.timestamp("us", tz="UTC"),
+        "string": pa.string(),
+        "int32": pa.int32(),
+        "float64": pa.float64(),
+    }[kind]
+
+
+def _build_query(source: str, columns: List[str], meters, buildings, ts_from, ts_to, ordered: bool):
+    spec = _SOURCES[source]
+    where, params = [], []
+    if ts_from is not None:
+        where.append(f"{spec['ts']} >= %s")
+        params.append(ts_from)
+    if ts_to is not None:
+        where.append(f"{spec['ts']} < %s")
+        params.append(ts_to)
+    if buildings:
+        where.append("b.external_code = any(%s)")
+        params.append(list(buildings))
+    if meters:
+        if not spec["meter"]:
+            raise ValueError(f"Source '{source}' has no meter dimension")
+        where.append(f"{spec['meter']} = any(%s)")
+        params.append(list(meters))
+
+    select = ", ".join(f"{spec['columns'][c][0]} as {c}" for c in columns)
+    sql = f"select {select} from {spec['from']}"
+    if where:
+        sql += " where " + " and ".join(where)
+    if ordered:
+        sql += f" order by {spec['order']}"
+    return sql, params
+
+
+def read_timeseries(
+    settings,
+    meters: Optional[Iterable[str]] = None,
+    buildings: Optional[Iterable[str]] = None,
+    ts_from=None,
+    ts_to=None,
+    columns: Optional[List[str]] = None,
+    source: str = "measurements",
+    batch_size: int = 65536,
+    ordered: bool = True,
+) -> Iterator:
+    """
+    Отдаёт pyarrow.RecordBatch по batch_size строк (последний — короче).
+    meters/buildings — внешние коды; [ts_from, ts_to) — полуинтервал; columns — проекция
+    (по умолчанию все колонки источника). ordered=True сортирует по (счётчик|здание, ts).
+    """
+    import pyarrow as pa
+
+    if source not in _SOURCES:
+        raise ValueError(f"Unknown source '{source}'. Allowed: {sorted(_SOURCES)}")
+    available = _SOURCES[source]["columns"]
+    columns = list(columns or available)
+    unknown = [c for c in columns if c not in available]
+    if unknown:
+        raise ValueError(f"Unknown columns for '{source}': {unknown}. Allowed: {list(available)}")
+
+    schema = pa.schema([(c, _arrow_type(available[c][1])) for c in columns])
+    sql, params = _build_query(source, columns, meters, buildings, ts_from, ts_to, ordered)
+
+    with get_conn(settings) as conn:
+        for rows in stream_rows(conn, sql, params, chunk_size=batch_size, name="etl_reader", row_factory=tuple_row):
+            arrays = [pa.array(col, type=field.type) for col, field in zip(zip(*rows), schema)]
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def read_timeseries_numpy(settings, **kwargs) -> Iterator[Dict[str, Any]]:
+    """То же, что read_timeseries, но батчи — dict {колонка: numpy.ndarray}."""
+    for batch in read_timeseries(settings, **kwargs):
+        yield {name: batch.column(i).to_numpy(zero_copy_only=False) for i, name in enumerate(batch.schema.names)}
@@ -0,0 +1,135 @@
+# etl/utils/readings.py
+"""
+Накопительные показания счётчиков (CONSUMPTION_CUMULATIVE) -> потребление за интервал.
+
+Показания нельзя суммировать в агрегатах, поэтому они переводятся в разности
+между соседними показаниями одного счётчика (метрика CONSUMPTION). Parse только
+помечает такие строки: metric = CONSUMPTION, исходное показание — в колонке
+reading, value пустое. Разности считает load под блокировкой агрегатов по всей
+истории показаний core.meter_readings, а не по одной загрузке:
+
+  - показания загрузки сохраняются в core.meter_readings;
+  - для каждого счётчика читается окно от предыдущего сохранённого показания до
+    первой загрузки и до следующего после её последнего — загрузка, пришедшая не
+    по порядку (backfill, параллельные воркеры), пересчитывает и первый интервал
+    более поздней загрузки, которая раньше была без предыдущего показания;
+  - разности считаются векторно: сортировка по (meter_code, ts) и groupby().shift().
+
+Отрицательная разность:
+  - переполнение регистра, если предыдущее показание близко к ёмкости
+    (10^число_разрядов) — разность считается через ёмкость;
+  - иначе замена счётчика: интервала нет (meter_replaced), показание становится
+    новой базой для следующих разностей.
+У первого показания счётчика в истории интервала нет (no_prior_reading).
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+CUMULATIVE_METRIC = "CONSUMPTION_CUMULATIVE"
+INTERVAL_METRIC = "CONSUMPTION"
+
+# переполнение: предыдущее показание >= 90% ёмкости регистра, новое < 10%
+_ROLLOVER_HIGH = 0.9
+_ROLLOVER_LOW = 0.1
+
+# показания загрузки, прошедшие DQ (повтор (meter_code, ts) в загрузке — побеждает последняя строка)
+_SQL_SAVE = """
+insert into core.meter_readings as r (meter_code, ts, reading, load_id)
+select distinct on (meter_code, ts) meter_code, ts, reading, load_id
+from stage.stage_parsed_measurements
+where load_id = %s
+  and reading is not null
+  and ts is not null
+  and quality is distinct from 'bad'
+order by meter_code, ts, row_num desc
+on conflict (meter_code, ts) do update set
+    reading = excluded.reading,
+    load_id = excluded.load_id,
+    updated_at = now()
+where r.reading is distinct from excluded.reading
+"""
+
+# окно каждого счётчика: предыдущее показание до загрузки .. следующее после неё
+_SQL_WINDOW = """
+with b as (
+    select meter_code, min(ts) as first_ts, max(ts) as last_ts
+    from stage.stage_parsed_measurements
+    where load_id = %s
+      and reading is not null
+      and ts is not null
+      and quality is distinct from 'bad'
+    group by meter_code
+)
+select r.meter_code, r.ts, r.reading
+from b
+cross join lateral (
+    select
+        coalesce((select max(p.ts) from core.meter_readings p
+                  where p.meter_code = b.meter_code and p.ts < b.first_ts), b.first_ts) as lo,
+        coalesce((select min(n.ts) from core.meter_readings n
+                  where n.meter_code = b.meter_code and n.ts > b.last_ts), b.last_ts) as hi
+) w
+join core.meter_readings r on r.meter_code = b.meter_code and r.ts between w.lo and w.hi
+order by r.meter_code, r.ts
+"""
+
+
+def mark_readings(batch: pd.DataFrame) -> pd.DataFrame:
+    """
+    Прошедшие DQ накопительные показания батча -> строки потребления без значения:
+    metric = CONSUMPTION, value пустое (его считает load, см. derive_intervals), reading — показание.
+    """
+    cum = (
+        (batch["metric"] == CUMULATIVE_METRIC)
+        & (batch["quality"] == "ok")
+        & batch["reading"].notna()
+        & batch["ts"].notna()
+    )
+    if not cum.any():
+        return batch
+    out = batch.copy()
+    out.loc[cum, "metric"] = INTERVAL_METRIC
+    out.loc[cum, "value"] = np.nan
+    return out
+
+
+def save_readings(cur, load_id: str) -> int:
+    """Сохраняет показания загрузки в core.meter_readings. Возвращает число новых/изменённых показаний."""
+    cur.execute(_SQL_SAVE, (load_id,))
+    return cur.rowcount
+
+
+def fetch_reading_window(cur, load_id: str) -> pd.DataFrame:
+    """Показания core.meter_readings, от которых зависят интервалы загрузки (по счётчикам, по времени)."""
+    cur.execute(_SQL_WINDOW, (load_id,))
+    return pd.DataFrame(cur.fetchall(), columns=["meter_code", "ts", "reading"])
+
+
+def derive_intervals(window: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Разности соседних показаний окна (см. fetch_reading_window).
+    Возвращает (intervals, replaced): intervals — meter_code, ts, value; replaced — meter_code, ts
+    показаний, у которых интервала нет из-за замены счётчика (ранее посчитанный интервал удаляется).
+    Первое показание каждого счётчика в окне — только база.
+    """
+    empty = window.iloc[0:0]
+    if window.empty:
+        return empty.assign(value=pd.Series(dtype="float64"))[["meter_code", "ts", "value"]], empty[["meter_code", "ts"]]
+
+    part = window.sort_values(["meter_code", "ts"], kind="stable")
+    reading = part["reading"].astype("float64")
+    prev = part.groupby("meter_code", sort=False)["reading"].shift(1).astype("float64")
+
+    delta = reading - prev
+    negative = (delta < 0).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        capacity = 10.0 ** (np.floor(np.log10(prev.clip(lower=1).to_numpy())) + 1)
+    rollover = negative & (prev.to_numpy() >= _ROLLOVER_HIGH * capacity) & (reading.to_numpy() < _ROLLOVER_LOW * capacity)
+    delta = delta.where(~rollover, reading + capacity - prev)
+    replaced = negative & ~rollover
+    has_prior = prev.notna().to_numpy()
+
+    intervals = part.loc[has_prior & ~replaced, ["meter_code", "ts"]].assign(value=delta[has_prior & ~replaced])
+    return intervals, part.loc[replaced, ["meter_code", "ts"]]
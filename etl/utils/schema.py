@@ -1,5 +1,11 @@
 # etl/utils/schema.py
-from etl.utils.db import exec_sql, get_conn
+import hashlib
+
+from etl.utils.db import INIT_CORE_SQL, advisory_xact_lock, exec_sql, get_conn, init_db
+from etl.utils.logger import get_logger
+from etl.utils.work_queue import QUEUE_COLUMNS_DDL, ensure_queue_columns
+
+log = get_logger(__name__)
 
 DDL_STATEMENTS = [
     """
@@ -8,16 +14,19 @@ DDL_STATEMENTS = [
     """
     create table if not exists core.buildings (
         building_id uuid primary key default gen_random_uuid(),
-        external_code text not null unique
+        building_key int generated by default as identity unique,
+        external_code text not null unique,
+        district_id text
     );
     """,
     """
-    create table if not exists core.buildings (
-        building_id uuid primary key default gen_random_uuid(),
-        external_code text not null unique,
-        district_id text not null
+    create table if not exists core.districts (
+        district_key int generated by default as identity primary key,
+        district_id text not null unique,
+        name text
     );
     """,
+    "alter table core.buildings add column if not exists district_key int references core.districts(district_key);",
     """
     create table if not exists core.itp (
         itp_id uuid primary key default gen_random_uuid(),
@@ -29,10 +38,9 @@ DDL_STATEMENTS = [
     create table if not exists core.meters (
         meter_id uuid primary key default gen_random_uuid(),
         itp_id uuid not null references core.itp(itp_id) on delete cascade,
-        external_code text not null,
+        external_code text not null unique,
         metric text not null,
-        unit text not null,
-        unique(itp_id, external_code, metric)
+        unit text not null
     );
     """,
     """
@@ -53,3 +61,70 @@ def ensure_schema(settings):
     with get_conn(settings) as conn:
         for stmt in DDL_STATEMENTS:
             exec_sql(conn, stmt)
+
+
+def init_done(cur, name: str) -> bool:
+    """Выполнено ли одноразовое первичное наполнение name (отметка в core.etl_init)."""
+    cur.execute("select exists (select 1 from core.etl_init where name = %s) as done", (name,))
+    return cur.fetchone()["done"]
+
+
+def mark_init_done(cur, name: str):
+    """Отмечает первичное наполнение name выполненным (в транзакции вызывающего)."""
+    cur.execute("insert into core.etl_init (name) values (%s) on conflict (name) do nothing", (name,))
+
+
+def schema_hash() -> str:
+    """Хеш DDL_STATEMENTS, etl/sql/init_core.sql и колонок очереди: меняется при любом изменении схемы в коде."""
+    h = hashlib.sha256()
+    for stmt in (*DDL_STATEMENTS, QUEUE_COLUMNS_DDL):
+        h.update(stmt.encode("utf-8"))
+    with open(INIT_CORE_SQL, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def bootstrap(settings) -> bool:
+    """
+    ensure_schema + init_db + колонки очереди, только если схема изменилась: хеш последнего применённого
+    DDL хранится в core.etl_schema_version. При совпадении — один select вместо
+    нескольких десятков DDL на каждый запуск CLI. True — DDL выполнялся.
+    """
+    current = schema_hash()
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute("select to_regclass('core.etl_schema_version') is not null as present")
+        if cur.fetchone()["present"]:
+            cur.execute("select hash from core.etl_schema_version where id = 1")
+            row = cur.fetchone()
+            if row and row["hash"] == current:
+                return False
+
+    ensure_schema(settings)
+    init_db(settings)
+    with get_conn(settings) as conn:
+        # --worker / --steps parse,load без ingest тоже работают со status очереди;
+        # параллельный bootstrap ждёт здесь и видит уже добавленные колонки
+        with conn.cursor() as cur:
+            advisory_xact_lock(cur, "core.etl_schema_version")
+            ensure_queue_columns(cur)
+        exec_sql(
+            conn,
+            """
+            create table if not exists core.etl_schema_version (
+                id int primary key check (id = 1),
+                hash text not null,
+                applied_at timestamptz not null default now()
+            );
+            """,
+        )
+        exec_sql(
+            conn,
+            """
+            insert into core.etl_schema_version (id, hash) values (1, %s)
+            on conflict (id) do update set hash = excluded.hash, applied_at = now()
+            """,
+            (current,),
+        )
+        conn.commit()
+    log.info("schema bootstrapped", extra={"hash": current[:12]})
+    return True
@@ -0,0 +1,201 @@
+# etl/utils/stage_partitions.py
+"""
+Stage-таблицы, секционированные по load_id (partition by list): одна секция на загрузку.
+
+  - stage.stage_parsed_measurements          -> stage.spm_<load_id hex>
+  - stage.stage_parsed_measurements_enriched -> stage.spme_<load_id hex>
+
+Повторная обработка загрузки — truncate её секции (без мёртвых строк и vacuum),
+retention — drop секций загрузок старше STAGE_RETENTION_DAYS.
+stage.stage_raw_files остаётся реестром файлов (строка на файл): для удалённых
+загрузок проставляется purged_at, чтобы watch/ingest не принимали файл за новый.
+
+create table ... partition of и drop секции берут AccessExclusive-блокировку
+родителя: они ждут завершения всех транзакций, читающих/пишущих любую секцию
+таблицы, а новые запросы к таблице ждут их. Поэтому:
+  - секции создаются при ingest (create_load_partitions), одной короткой
+    транзакцией на пачку файлов, а не в parse/enrich параллельных загрузок;
+    ensure_load_partition — только страховка для загрузок без секций;
+  - retention удаляет секции по одной загрузке с lock_timeout: если таблица занята,
+    загрузка остаётся до следующего прогона, а не блокирует воркеров.
+Создание секций и миграция сериализуются advisory-блокировкой между процессами;
+миграция дополнительно берёт lock table ... access exclusive и заново проверяет
+relkind под блокировкой.
+
+load_id попадает в DDL (имя секции и for values in), поэтому перед этим он
+нормализуется через uuid.UUID: в SQL подставляется только проверенный UUID.
+"""
+import uuid
+from typing import Iterable, List
+
+from etl.utils.db import advisory_xact_lock, get_conn
+from etl.utils.logger import get_logger
+
+log = get_logger(__name__)
+
+# таблица -> (префикс имени секции, primary key)
+PARTITIONED_TABLES = {
+    "stage_parsed_measurements": ("spm", "load_id, row_num"),
+    "stage_parsed_measurements_enriched": ("spme", "load_id, row_num"),
+}
+
+# создание секций и миграция таблиц (все процессы)
+_PARTITIONS_LOCK = "stage.partitions"
+# ожидание блокировки родителя при drop секции по retention
+_DROP_LOCK_TIMEOUT = "5s"
+
+
+def _load_uuid(load_id) -> uuid.UUID:
+    """load_id -> uuid.UUID; не-UUID (в том числе попытка подставить SQL) — ValueError."""
+    return load_id if isinstance(load_id, uuid.UUID) else uuid.UUID(str(load_id))
+
+
+def partition_name(table: str, load_id: str) -> str:
+    prefix, _pk = PARTITIONED_TABLES[table]
+    return f"{prefix}_{_load_uuid(load_id).hex}"
+
+
+def _relkind(cur, table: str):
+    cur.execute(
+        """
+        select c.relkind
+        from pg_class c
+        join pg_namespace n on n.oid = c.relnamespace
+        where n.nspname = 'stage' and c.relname = %s
+        """,
+        (table,),
+    )
+    row = cur.fetchone()
+    return row["relkind"] if row else None
+
+
+def _migrate_to_partitioned(cur, table: str):
+    """
+    Переводит обычную таблицу (БД до секционирования) в секционированную с переносом данных.
+    Вызывается под _PARTITIONS_LOCK; relkind проверяется после lock table, чтобы процесс, который ждал
+    блокировку, не мигрировал таблицу повторно.
+    """
+    if _relkind(cur, table) != "r":
+        return
+    cur.execute(f"lock table stage.{table} in access exclusive mode")
+    if _relkind(cur, table) != "r":
+        return
+    _prefix, pk = PARTITIONED_TABLES[table]
+    legacy = f"{table}_legacy"
+    log.info("stage: migrating table to load_id partitions", extra={"table": table})
+
+    cur.execute(f"alter table stage.{table} rename to {legacy}")
+    # имена ограничений/индексов должны освободиться для новой таблицы
+    cur.execute("select conname from pg_constraint where conrelid = %s::regclass", (f"stage.{legacy}",))
+    for r in cur.fetchall():
+        cur.execute(f'alter table stage.{legacy} rename constraint "{r["conname"]}" to "{r["conname"]}_legacy"')
+
+    cur.execute(f"create table stage.{table} (like stage.{legacy} including defaults) partition by list (load_id)")
+    cur.execute(f"alter table stage.{table} add primary key ({pk})")
+    cur.execute(f"select distinct load_id::text as load_id from stage.{legacy}")
+    for r in cur.fetchall():
+        _create_partition(cur, table, r["load_id"])
+    cur.execute(f"insert into stage.{table} select * from stage.{legacy} on conflict do nothing")
+    cur.execute(f"drop table stage.{legacy}")
+
+
+def _create_partition(cur, table: str, load_id: str):
+    value = _load_uuid(load_id)
+    cur.execute(
+        f"""
+        create table if not exists stage.{partition_name(table, value)}
+        partition of stage.{table} for values in ('{value}')
+        """
+    )
+
+
+def _partition_exists(cur, table: str, load_id: str) -> bool:
+    cur.execute("select to_regclass(%s) is not null as present", (f"stage.{partition_name(table, load_id)}",))
+    return cur.fetchone()["present"]
+
+
+def create_load_partitions(settings, load_ids: Iterable[str]):
+    """
+    Создаёт секции загрузок во всех PARTITIONED_TABLES одной транзакцией (вызывается при ingest,
+    до параллельной обработки). Несекционированные таблицы при этом переносятся.
+    """
+    load_ids = list(load_ids)
+    if not load_ids:
+        return
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        advisory_xact_lock(cur, _PARTITIONS_LOCK)
+        for table in PARTITIONED_TABLES:
+            _migrate_to_partitioned(cur, table)
+            for load_id in load_ids:
+                if not _partition_exists(cur, table, load_id):
+                    _create_partition(cur, table, load_id)
+        conn.commit()
+
+
+def ensure_load_partition(settings, table: str, load_id: str):
+    """
+    Проверяет секцию load_id; если её нет (загрузка зарегистрирована до создания секций при ingest),
+    создаёт её отдельной короткой транзакцией, при необходимости перенося таблицу.
+    """
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        if _partition_exists(cur, table, load_id):
+            return
+        advisory_xact_lock(cur, _PARTITIONS_LOCK)
+        _migrate_to_partitioned(cur, table)
+        if not _partition_exists(cur, table, load_id):
+            _create_partition(cur, table, load_id)
+        conn.commit()
+
+
+def truncate_load_partition(cur, table: str, load_id: str):
+    """Очищает секцию load_id (в транзакции вызывающего: при ошибке старые строки вернутся)."""
+    cur.execute(f"truncate stage.{partition_name(table, load_id)}")
+
+
+def drop_expired_loads(settings, retention_days: int) -> List[str]:
+    """
+    Удаляет секции stage загрузок, зарегистрированных раньше чем retention_days дней назад,
+    и отмечает их purged_at в stage.stage_raw_files. retention_days <= 0 — хранить всё.
+    Каждая загрузка — своя транзакция с lock_timeout: загрузки, чьи таблицы заняты дольше,
+    пропускаются до следующего прогона. Возвращает удалённые load_id.
+    """
+    if not retention_days or retention_days <= 0:
+        return []
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute("select to_regclass('stage.stage_raw_files') is not null as present")
+        if not cur.fetchone()["present"]:
+            return []
+        cur.execute(
+            """
+            select load_id::text as load_id
+            from stage.stage_raw_files
+            where purged_at is null
+              and inserted_at < now() - make_interval(days => %s)
+            order by inserted_at
+            """,
+            (retention_days,),
+        )
+        candidates = [r["load_id"] for r in cur.fetchall()]
+        conn.commit()
+
+        expired, skipped = [], 0
+        for load_id in candidates:
+            try:
+                cur.execute(f"set local lock_timeout = '{_DROP_LOCK_TIMEOUT}'")
+                for table in PARTITIONED_TABLES:
+                    cur.execute(f"drop table if exists stage.{partition_name(table, load_id)}")
+                cur.execute("update stage.stage_raw_files set purged_at = now() where load_id = %s", (load_id,))
+                conn.commit()
+                expired.append(load_id)
+            except Exception as e:
+                conn.rollback()
+                # 55P03 lock_not_available: таблица занята обработкой — следующий прогон
+                if getattr(e, "sqlstate", None) != "55P03":
+                    raise
+                skipped += 1
+    if expired or skipped:
+        log.info(
+            "stage retention: dropped load partitions",
+            extra={"load_ids": len(expired), "skipped_locked": skipped, "days": retention_days},
+        )
+    return expired
@@ -0,0 +1,138 @@
+# etl/utils/step_state.py
+"""
+Состояние шагов пайплайна по load_id: stage.load_steps.
+
+Для каждого (load_id, step) хранится статус (running / done / failed), число
+попыток, время начала/окончания, длительность, число строк и текст ошибки.
+run_etl по этой таблице продолжает обработку с первого незавершённого шага и
+находит незавершённые load_id без повторного ingest. Таблица создаётся в
+etl/sql/init_core.sql.
+
+Возобновляются только загрузки, у которых есть строки в stage.load_steps (ingest
+отмечает их сразу при регистрации): загрузки, зарегистрированные до появления
+учёта шагов, и их дубликаты не считаются незавершёнными. Загрузка, у которой
+шаг упал QUEUE_MAX_ATTEMPTS раз, больше автоматически не возобновляется (вручную —
+--load-id ... --rerun).
+"""
+import os
+import time
+from typing import Callable, Iterable, List, Set
+
+from etl.utils.db import get_conn
+from etl.utils.logger import get_logger
+
+log = get_logger(__name__)
+
+# шаги, которые выполняются отдельно для каждого load_id (в порядке выполнения);
+# rolling (features.rolling_by_building) не выбирается в --steps и выполняется вместе с load
+LOAD_STEPS = ("parse", "enrich", "load", "rolling")
+
+
+def load_steps_for(steps: Iterable[str]) -> List[str]:
+    """Шаги load_id из запрошенных steps (в порядке LOAD_STEPS); rolling добавляется вместе с load."""
+    steps = set(steps)
+    return [st for st in LOAD_STEPS if st in steps or (st == "rolling" and "load" in steps)]
+
+
+def completed_steps(settings, load_id: str) -> Set[str]:
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute("select step from stage.load_steps where load_id = %s and status = 'done'", (load_id,))
+        return {r["step"] for r in cur.fetchall()}
+
+
+def pending_load_ids(settings, steps: Iterable[str], raw_dir: str = None) -> List[str]:
+    """
+    load_id из stage.stage_raw_files, у которых не завершён хотя бы один из steps (по времени регистрации).
+    Не возобновляются загрузки без учёта шагов (зарегистрированные до stage.load_steps), удалённые
+    по retention (purged_at) и исчерпавшие попытки (settings.queue_max_attempts).
+    raw_dir — только файлы из этого каталога.
+    """
+    steps = load_steps_for(steps)
+    if not steps:
+        return []
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute("select to_regclass('stage.stage_raw_files') is not null as present")
+        if not cur.fetchone()["present"]:
+            return []
+        cur.execute(
+            """
+            select f.load_id::text as load_id
+            from stage.stage_raw_files f
+            left join stage.load_steps ls
+              on ls.load_id = f.load_id
+             and ls.step = any(%s)
+             and ls.status = 'done'
+            where f.purged_at is null
+              and (%s::text is null or starts_with(f.file_path, %s::text))
+              and exists (select 1 from stage.load_steps t where t.load_id = f.load_id)
+              and not exists (
+                  select 1 from stage.load_steps x
+                  where x.load_id = f.load_id and x.step = any(%s) and x.status = 'failed' and x.attempts >= %s
+              )
+            group by f.load_id, f.inserted_at
+            having count(ls.step) < %s
+            order by f.inserted_at, f.load_id
+            """,
+            (steps, raw_dir, os.path.join(raw_dir, "") if raw_dir else None,
+             steps, settings.queue_max_attempts, len(steps)),
+        )
+        return [r["load_id"] for r in cur.fetchall()]
+
+
+def mark_done(settings, load_ids: Iterable[str], step: str, rows: int = None):
+    """Отмечает шаг завершённым без выполнения (например, ingest после регистрации файлов)."""
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.executemany(
+            """
+            insert into stage.load_steps (load_id, step, status, finished_at, duration_ms, rows)
+            values (%s, %s, 'done', now(), 0, %s)
+            on conflict (load_id, step) do update set
+                status = 'done', finished_at = now(), error = null, rows = excluded.rows
+            """,
+            [(lid, step, rows) for lid in load_ids],
+        )
+
+
+def run_step(settings, load_id: str, step: str, fn: Callable[[], object]):
+    """
+    Выполняет fn() как шаг step для load_id, фиксируя статус, время и число строк
+    (если fn вернула int). Исключение записывается как failed и пробрасывается дальше.
+    """
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            insert into stage.load_steps as ls (load_id, step, status, started_at, attempts)
+            values (%s, %s, 'running', now(), 1)
+            on conflict (load_id, step) do update set
+                status = 'running', started_at = now(), finished_at = null,
+                duration_ms = null, rows = null, error = null, attempts = ls.attempts + 1
+            """,
+            (load_id, step),
+        )
+        conn.commit()
+
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            cur.execute(
+                """
+                update stage.load_steps
+                set status = 'failed', finished_at = now(), duration_ms = %s, error = %s
+                where load_id = %s and step = %s
+                """,
+                (int((time.monotonic() - started) * 1000), str(e)[:2000], load_id, step),
+            )
+            conn.commit()
+            raise
+
+        cur.execute(
+            """
+            update stage.load_steps
+            set status = 'done', finished_at = now(), duration_ms = %s, rows = %s
+            where load_id = %s and step = %s
+            """,
+            (int((time.monotonic() - started) * 1000), result if isinstance(result, int) else None, load_id, step),
+        )
+        conn.commit()
+        return result
@@ -1,5 +1,22 @@
 # etl/utils/units.py
-from typing import Optional, Tuple
+"""
+Единицы измерения: нормализация подписей и пересчёт значений.
+
+Таблицы алиасов и коэффициентов компилируются один раз при импорте:
+  - _UNITS: каноническая подпись -> (величина, factor, offset), где
+    значение_в_базовой_единице = value * factor + offset;
+  - _METRIC_UNITS: метрика парсера -> допустимые величины и единица по умолчанию.
+
+convert_to_canonical пересчитывает колонку значений NumPy-операциями по группам
+(metric, unit): коэффициенты считаются один раз на группу, а если все группы уже
+в канонических единицах, значения возвращаются без пересчёта.
+"""
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
 
 def _clean(s: Optional[str]) -> str:
     return (s or "").strip()
@@ -11,35 +28,147 @@ def _norm_token(s: str) -> str:
     x = x.replace("ё", "е")
     return x
 
+
+# базовая (каноническая) единица каждой величины
+BASE_UNITS = {
+    "volume": "м3",
+    "flow": "м3ч",
+    "energy": "Гкал",
+    "temperature": "C",
+    "time": "час",
+}
+
+# каноническая подпись -> (величина, factor, offset) относительно базовой единицы
+_UNITS: Dict[str, Tuple[str, float, float]] = {
+    "м3": ("volume", 1.0, 0.0),
+    "л": ("volume", 1e-3, 0.0),
+    "м3ч": ("flow", 1.0, 0.0),
+    "л/с": ("flow", 3.6, 0.0),
+    "л/ч": ("flow", 1e-3, 0.0),
+    "м3/с": ("flow", 3600.0, 0.0),
+    "т/ч": ("flow", 1.0, 0.0),  # вода: 1 т ≈ 1 м3
+    "Гкал": ("energy", 1.0, 0.0),
+    "Мкал": ("energy", 1e-3, 0.0),
+    "кВт·ч": ("energy", 1.0 / 1163.0, 0.0),  # 1 Гкал = 1163 кВт·ч
+    "МВт·ч": ("energy", 1.0 / 1.163, 0.0),
+    "ГДж": ("energy", 1.0 / 4.1868, 0.0),  # 1 Гкал = 4.1868 ГДж
+    "C": ("temperature", 1.0, 0.0),
+    "K": ("temperature", 1.0, -273.15),
+    "час": ("time", 1.0, 0.0),
+    "мин": ("time", 1.0 / 60.0, 0.0),
+    "сек": ("time", 1.0 / 3600.0, 0.0),
+}
+
+# каноническая подпись -> варианты написания (сравниваются в нижнем регистре без пробелов)
+_UNIT_ALIASES = {
+    "м3": {"м3", "м³", "м^3", "m3", "m^3", "m³", "кубм", "куб.м", "кубометр", "кубометры", "куб.м.", "кубметр"},
+    "л": {"л", "l", "литр", "литры", "литров"},
+    "м3ч": {"м3/ч", "м³/ч", "м^3/ч", "м3ч", "м3час", "м3/час", "m3/h", "m^3/h", "m³/h", "m3h", "кубм/ч", "куб.м/ч"},
+    "л/с": {"л/с", "л/c", "л-с", "лсек", "л/сек", "l/s", "lps"},
+    "л/ч": {"л/ч", "л/час", "l/h", "lph"},
+    "м3/с": {"м3/с", "м³/с", "m3/s", "m³/s"},
+    "т/ч": {"т/ч", "т/час", "t/h"},
+    "Гкал": {"гкал", "гигакал", "гигакалория", "gcal"},
+    "Мкал": {"мкал", "mcal"},
+    "кВт·ч": {"квтч", "квт*ч", "квт·ч", "квт-ч", "kwh", "квтчас", "квтчч", "квтчасы"},
+    "МВт·ч": {"мвтч", "мвт*ч", "мвт·ч", "мвт-ч", "mwh"},
+    "ГДж": {"гдж", "gj"},
+    "C": {"c", "degc", "°c", "°с", "с°", "цел", "цельсий", "цельсия", "градусц", "градусыц"},
+    "K": {"k", "кельвин", "kelvin"},
+    "час": {"ч", "час", "часы", "h", "hr", "hrs", "hour", "hours"},
+    "мин": {"мин", "min", "минуты"},
+    "сек": {"сек", "с", "s", "sec"},
+}
+
+_ALIAS_INDEX = {alias: label for label, aliases in _UNIT_ALIASES.items() for alias in aliases}
+
+# метрика парсера (см. parse_and_normalize.normalize_metric) -> (допустимые величины, единица без подписи)
+_METRIC_UNITS = {
+    "SUPPLY": (("volume", "flow"), "м3"),
+    "RETURN": (("volume", "flow"), "м3"),
+    "CONSUMPTION": (("volume", "flow"), "м3"),
+    "CONSUMPTION_CUMULATIVE": (("volume",), "м3"),
+    "HEAT": (("energy",), "Гкал"),
+    "T1": (("temperature",), "C"),
+    "T2": (("temperature",), "C"),
+    "PUMP_RUNTIME_HOURS": (("time",), "час"),
+}
+
+
+@lru_cache(maxsize=1024)
 def _norm_unit(u: Optional[str]) -> str:
+    """Подпись единицы -> каноническая подпись из _UNITS; неизвестная возвращается как есть."""
     raw = (u or "").strip()
     x = raw.lower().replace(" ", "").replace("\t", "")
-    m3_aliases = {"м3", "м³", "м^3", "m3", "m^3", "m³", "кубм", "куб.м", "кубометр", "кубометры", "куб.м.", "кубметр"}
-    m3h_aliases = {"м3/ч", "м³/ч", "м^3/ч", "м3ч", "м3час", "м3/час", "m3/h", "m^3/h", "m³/h", "m3h", "кубм/ч", "куб.м/ч"}
-    lps_aliases = {"л/с", "л/c", "л-с", "лсек", "л/сек", "l/s", "lps"}
-    degc_aliases = {"c", "degc", "°c", "°с", "цел", "цельсий", "цельсия", "градусц", "градусыц"}
-    hour_aliases = {"ч", "час", "часы", "h", "hr", "hrs", "hour", "hours"}
-    if x in m3_aliases:
-        return "м3"
-    if x in m3h_aliases:
-        return "м3ч"
-    if x in lps_aliases:
-        return "л/с"
-    if x in degc_aliases:
-        return "C"
-    if x in hour_aliases:
-        return "час"
-    if x in {"гкал", "гигакал", "гигакалория", "gcal"}:
-        return "Гкал"
-    if x in {"квтч", "квт*ч", "квт·ч", "квт-ч", "kwh", "квтчас", "квтчч", "квтчасы"}:
-        return "кВт·ч"
-    return raw
+    return _ALIAS_INDEX.get(x, raw)
+
+
+@lru_cache(maxsize=1024)
+def unit_dimension(u: Optional[str]) -> Optional[str]:
+    """Величина ("volume", "flow", "energy", ...) по подписи единицы; None — подписи нет или она неизвестна."""
+    spec = _UNITS.get(_norm_unit(u))
+    return spec[0] if spec else None
+
+
+@lru_cache(maxsize=1024)
+def _conversion(metric: Optional[str], unit: Optional[str]) -> Tuple[float, float, Optional[str]]:
+    """
+    (factor, offset, целевая подпись) для пары (metric, unit).
+    Без подписи — единица метрики по умолчанию; неизвестная единица или величина,
+    недопустимая для метрики, — без пересчёта (factor=1, offset=0, подпись как есть).
+    """
+    allowed, default = _METRIC_UNITS.get(metric, ((), None))
+    label = _norm_unit(unit)
+    if not label:
+        return 1.0, 0.0, default
+    spec = _UNITS.get(label)
+    if spec is None or (allowed and spec[0] not in allowed):
+        return 1.0, 0.0, label
+    dimension, factor, offset = spec
+    return factor, offset, BASE_UNITS[dimension]
+
+
+def convert(values, from_unit: str, to_unit: str) -> np.ndarray:
+    """Пересчёт массива значений между единицами одной величины (например, кВт·ч <-> Гкал)."""
+    src, dst = _UNITS[_norm_unit(from_unit)], _UNITS[_norm_unit(to_unit)]
+    if src[0] != dst[0]:
+        raise ValueError(f"Incompatible units: {from_unit} ({src[0]}) -> {to_unit} ({dst[0]})")
+    base = np.asarray(values, dtype="float64") * src[1] + src[2]
+    return (base - dst[2]) / dst[1]
+
+
+def convert_to_canonical(metrics: pd.Series, units: pd.Series, values: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    Приводит значения к базовой единице величины по группам (metric, unit).
+    Возвращает (values, units) с тем же индексом; NaN в values остаются NaN.
+    """
+    index = values.index
+    if len(values) == 0:
+        return values, units
+
+    keys = pd.MultiIndex.from_arrays([metrics.fillna(""), units.fillna("")])
+    codes, pairs = pd.factorize(keys)
+    specs = [_conversion(m or None, u or None) for m, u in pairs]
+
+    factors = np.fromiter((s[0] for s in specs), dtype="float64", count=len(specs))
+    offsets = np.fromiter((s[1] for s in specs), dtype="float64", count=len(specs))
+    labels = np.array([s[2] for s in specs], dtype=object)
+
+    out_units = pd.Series(labels[codes], index=index, dtype=object)
+    if np.all(factors == 1.0) and np.all(offsets == 0.0):
+        return values, out_units
+
+    numeric = pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64")
+    out_values = pd.Series(numeric * factors[codes] + offsets[codes], index=index)
+    return out_values, out_units
+
 
 def normalize_metric_unit(metric: Optional[str], unit: Optional[str]) -> Tuple[str, str]:
     """
     Приводит метрику и юнит к каноническим значениям, согласованным с dbt-моделями.
     Возвращает (canonical_metric, canonical_unit), где canonical_metric использует стиль с подчёркиваниями,
     например: 'flow_supply', 'flow_return', 'consumption_period', 'consumption_cumulative', 'pump_runtime_hours', 'T1', 'T2'.
+    Меняется только подпись единицы; для пересчёта значений — convert_to_canonical.
     """
     raw_metric = _clean(metric)
     raw_unit = _clean(unit)
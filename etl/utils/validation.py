@@ -1,6 +1,7 @@
 # etl/utils/validation.py
-from typing import Optional
-from datetime import datetime, timezone
+from typing import Dict, Hashable, Iterable, Optional
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
 
 def is_reasonable_value(metric: str, value: float) -> bool:
     """
@@ -21,23 +22,138 @@ def is_reasonable_value(metric: str, value: float) -> bool:
         return False
 
 
+def _localize(dt: datetime, default_tz: str) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=ZoneInfo(default_tz))
+    return dt
+
+
 def parse_timestamp(ts_str: str, default_tz: str) -> Optional[str]:
     """
     Парсит ISO-like timestamp в isoformat с TZ. Возвращает None при ошибке.
+    Значения без TZ считаются локальным временем default_tz.
     """
-    if not ts_str:
+    dt = _parse_one(ts_str)
+    if dt is None:
+        return None
+    return _localize(dt, default_tz).isoformat()
+
+
+def _parse_one(value) -> Optional[datetime]:
+    """Медленный путь для одного значения: fromisoformat, затем dateutil (dayfirst)."""
+    if not value:
         return None
+    s = str(value).strip()
     try:
-        dt = datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
-        if dt.tzinfo is None:
-            return dt.replace(tzinfo=timezone.utc).isoformat()
-        return dt.isoformat()
+        return datetime.fromisoformat(s.replace("Z", "+00:00"))
     except Exception:
         try:
             from dateutil import parser
-            dt = parser.parse(ts_str)
-            if dt.tzinfo is None:
-                return dt.replace(tzinfo=timezone.utc).isoformat()
-            return dt.isoformat()
+            return parser.parse(s, dayfirst=True)
         except Exception:
             return None
+
+
+# Форматы, которые встречаются в выгрузках вендоров (порядок = приоритет)
+TIMESTAMP_FORMATS = (
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y",
+    "%d.%m.%y %H:%M",
+    "%d.%m.%y",
+)
+
+# cache_key (например, файл, лист и заголовок колонки) -> формат, найденный при прошлом разборе
+_FORMAT_CACHE: Dict[Hashable, str] = {}
+
+
+def infer_timestamp_format(sample: Iterable[str], min_ratio: float = 0.9) -> Optional[str]:
+    """Подбирает формат strptime, под который подходит не меньше min_ratio значений выборки."""
+    sample = [v for v in sample if v]
+    if not sample:
+        return None
+    for fmt in TIMESTAMP_FORMATS:
+        hits = 0
+        for v in sample:
+            try:
+                datetime.strptime(v, fmt)
+                hits += 1
+            except ValueError:
+                pass
+        if hits >= min_ratio * len(sample):
+            return fmt
+    return None
+
+
+def parse_timestamps(values, default_tz: str, cache_key: Hashable = None, groups=None, sample_size: int = 50):
+    """
+    Векторный разбор колонки timestamp'ов. Возвращает pd.Series (tz-aware в default_tz, NaT при ошибке).
+
+    - datetime-значения (Excel) берутся как есть;
+    - для строк формат выводится один раз по выборке (и кешируется по cache_key),
+      вся колонка разбирается этим форматом, построчный fallback — только для промахов;
+    - наивное время локализуется в default_tz. Неоднозначный час при переходе с летнего
+      времени размечается по порядку появления внутри groups (например, счётчика):
+      первое вхождение — летнее время, повторное — зимнее; несуществующий час сдвигается вперёд.
+    """
+    import numpy as np
+    import pandas as pd
+
+    s = pd.Series(values).reset_index(drop=True)
+    aware_parts = []
+    if pd.api.types.is_datetime64_any_dtype(s):
+        naive = s
+    else:
+        is_str = s.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+        is_dt = s.map(lambda v: isinstance(v, (datetime, date, np.datetime64))).to_numpy(dtype=bool)
+        naive = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+
+        if is_dt.any():
+            native = s[is_dt]
+            tz_aware = native.map(lambda v: getattr(v, "tzinfo", None) is not None).to_numpy(dtype=bool)
+            if tz_aware.any():
+                aware_parts.append(native[tz_aware])
+            naive.loc[native.index[~tz_aware]] = pd.to_datetime(native[~tz_aware], errors="coerce")
+
+        if is_str.any():
+            text = s[is_str].str.strip()
+            text = text[text != ""]
+            fmt = _FORMAT_CACHE.get(cache_key) if cache_key is not None else None
+            parsed = pd.to_datetime(text, format=fmt, errors="coerce") if fmt else None
+            if parsed is None or parsed.isna().mean() > 0.5:
+                # формата нет в кеше или он не подошёл к этому файлу — выводим заново
+                fmt = infer_timestamp_format(text.head(sample_size).tolist())
+                parsed = pd.to_datetime(text, format=fmt, errors="coerce") if fmt else pd.Series(pd.NaT, index=text.index)
+                if fmt and cache_key is not None:
+                    _FORMAT_CACHE[cache_key] = fmt
+            naive.loc[parsed.index] = parsed
+
+            misses = text[parsed.isna()]
+            if len(misses):
+                slow = misses.map(_parse_one).dropna()
+                has_tz = slow.map(lambda v: v.tzinfo is not None).to_numpy(dtype=bool)
+                if has_tz.any():
+                    aware_parts.append(slow[has_tz])
+                if (~has_tz).any():
+                    naive.loc[slow.index[~has_tz]] = pd.to_datetime(slow[~has_tz])
+
+    if naive.dt.tz is not None:
+        result = naive.dt.tz_convert(default_tz)
+    else:
+        if groups is not None:
+            keys = [pd.Series(groups).reset_index(drop=True), naive]
+        else:
+            keys = [naive]
+        first_seen = (naive.groupby(keys, dropna=False).cumcount() == 0).to_numpy()
+        result = naive.dt.tz_localize(default_tz, ambiguous=first_seen, nonexistent="shift_forward")
+
+        for part in aware_parts:
+            result.loc[part.index] = pd.to_datetime(part, utc=True).dt.tz_convert(default_tz)
+
+    return result
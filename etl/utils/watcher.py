@@ -0,0 +1,106 @@
+# etl/utils/watcher.py
+"""
+Наблюдение за RAW_DIR: находит новые/изменённые сырые файлы и отдаёт их,
+когда файл «устоялся» (размер и mtime не менялись settle_sec секунд) —
+так недописанные файлы не попадают в пайплайн.
+
+Если установлен inotify_simple (Linux), ожидание между проверками прерывается
+событиями файловой системы; иначе используется обычный polling с интервалом poll_sec.
+Источником истины в обоих случаях остаётся сканирование каталога.
+"""
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from etl.utils.logger import get_logger
+
+log = get_logger(__name__)
+
+RAW_EXTENSIONS = (".xlsx", ".xls", ".csv")
+
+try:  # опциональная зависимость
+    from inotify_simple import INotify, flags as inotify_flags
+except Exception:  # pragma: no cover - зависит от окружения
+    INotify = None
+    inotify_flags = None
+
+
+def _is_raw_file(fname: str) -> bool:
+    return not fname.startswith("~$") and fname.lower().endswith(RAW_EXTENSIONS)
+
+
+class RawDirWatcher:
+    def __init__(self, root: str, poll_sec: float = 5.0, settle_sec: float = 10.0, known: Iterable[str] = ()):
+        self.root = root
+        self.poll_sec = poll_sec
+        self.settle_sec = settle_sec
+        # path -> (size, mtime) уже переданных в обработку версий файла
+        self._done: Dict[str, Tuple[int, float]] = {}
+        # path -> (size, mtime, first_seen_monotonic) кандидатов, ждущих стабилизации
+        self._pending: Dict[str, Tuple[int, float, float]] = {}
+        for path in known:
+            st = self._stat(path)
+            if st:
+                self._done[path] = st
+        self._inotify = None
+        self._watched_dirs = set()
+        if INotify is not None:
+            try:
+                self._inotify = INotify()
+            except Exception as e:
+                log.warning("inotify unavailable, falling back to polling: %s", e)
+        log.info("watcher init", extra={"root": root, "inotify": self._inotify is not None, "known": len(self._done)})
+
+    @staticmethod
+    def _stat(path: str) -> Optional[Tuple[int, float]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def _watch_dir(self, path: str):
+        if self._inotify is None or path in self._watched_dirs:
+            return
+        mask = inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE
+        try:
+            self._inotify.add_watch(path, mask)
+            self._watched_dirs.add(path)
+        except OSError as e:
+            log.warning("Can't watch dir %s: %s", path, e)
+
+    def _scan(self) -> List[str]:
+        files = []
+        if not os.path.isdir(self.root):
+            return files
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            self._watch_dir(dirpath)
+            files.extend(os.path.join(dirpath, f) for f in filenames if _is_raw_file(f))
+        return files
+
+    def poll(self) -> List[str]:
+        """Одна проверка: возвращает устоявшиеся новые/изменённые файлы (и помечает их переданными)."""
+        now = time.monotonic()
+        ready = []
+        for path in self._scan():
+            st = self._stat(path)
+            if st is None or self._done.get(path) == st:
+                continue
+            prev = self._pending.get(path)
+            if prev is None or prev[:2] != st:
+                # новый кандидат или файл ещё пишется — отсчёт стабильности заново
+                self._pending[path] = (st[0], st[1], now)
+                continue
+            if now - prev[2] >= self.settle_sec and time.time() - st[1] >= self.settle_sec:
+                ready.append(path)
+        for path in ready:
+            size, mtime, _ = self._pending.pop(path)
+            self._done[path] = (size, mtime)
+        return sorted(ready)
+
+    def wait(self):
+        """Ждёт до следующей проверки: событие inotify или истечение poll_sec."""
+        if self._inotify is not None:
+            self._inotify.read(timeout=int(self.poll_sec * 1000))
+        else:
+            time.sleep(self.poll_sec)
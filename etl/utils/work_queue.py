@@ -0,0 +1,274 @@
+# etl/utils/work_queue.py
+"""
+Очередь загрузок поверх stage.stage_raw_files для нескольких воркеров (процессов/хостов).
+
+Колонки очереди: status (pending / running / done / failed), attempts, leased_by,
+lease_until, heartbeat_at, finished_at, last_error.
+
+  - claim: воркер забирает самую раннюю доступную загрузку через
+    select ... for update skip locked — конкурирующие воркеры не ждут друг друга
+    и не получают одну загрузку дважды. Доступны pending, failed с attempts < max
+    и running с истёкшей арендой (воркер упал или завис);
+  - heartbeat: пока загрузка обрабатывается, аренда продлевается фоновым потоком;
+  - assert_lease: шаг воркера перед commit проверяет, что аренда всё ещё его, и
+    блокирует строку очереди до commit — воркер с истёкшей арендой (её уже
+    забрал другой) ничего не фиксирует;
+  - finish: итоговый статус и снятие аренды (у воркера — только своей).
+
+Запуск: python -m etl.run_etl --worker (сколько угодно) и python -m etl.run_etl
+--coordinator (один: ingest, ожидание опустошения очереди, publish).
+"""
+import os
+import socket
+import threading
+from typing import Dict, List, Optional
+
+from etl.utils.db import get_conn
+from etl.utils.logger import get_logger
+
+log = get_logger(__name__)
+
+QUEUE_STATUSES = ("pending", "running", "done", "failed")
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# колонки очереди; текст входит в хеш схемы (etl/utils/schema.schema_hash), bootstrap добавляет их
+QUEUE_COLUMNS_DDL = """
+alter table stage.stage_raw_files
+    add column status text,
+    add column attempts int not null default 0,
+    add column leased_by text,
+    add column lease_until timestamptz,
+    add column heartbeat_at timestamptz,
+    add column finished_at timestamptz,
+    add column last_error text
+"""
+
+
+def ensure_queue_columns(cur):
+    """
+    Добавляет колонки очереди (один раз: alter table берёт эксклюзивную блокировку, поэтому
+    при уже существующих колонках ничего не выполняется). Вызывается из bootstrap и ingest.
+    Загрузки, зарегистрированные до появления очереди, считаются обработанными, если в
+    stage.load_steps у них завершён load или нет ни одного шага (до учёта шагов) — иначе
+    воркеры после обновления заново забрали бы всю историю; остальные — pending.
+    """
+    cur.execute(
+        """
+        select
+            to_regclass('stage.stage_raw_files') is not null as present,
+            to_regclass('stage.load_steps') is not null as has_steps,
+            exists (
+                select 1 from information_schema.columns
+                where table_schema = 'stage' and table_name = 'stage_raw_files' and column_name = 'status'
+            ) as migrated
+        """
+    )
+    state = cur.fetchone()
+    if not state["present"] or state["migrated"]:
+        return
+    cur.execute(QUEUE_COLUMNS_DDL)
+    if state["has_steps"]:
+        cur.execute(
+            """
+            update stage.stage_raw_files f
+            set status = 'done'
+            where exists (
+                select 1 from stage.load_steps ls
+                where ls.load_id = f.load_id and ls.step = 'load' and ls.status = 'done'
+            )
+            or not exists (select 1 from stage.load_steps ls where ls.load_id = f.load_id)
+            """
+        )
+    else:
+        cur.execute("update stage.stage_raw_files set status = 'done'")
+    cur.execute("update stage.stage_raw_files set status = 'pending' where status is null")
+    cur.execute("alter table stage.stage_raw_files alter column status set default 'pending'")
+    cur.execute("alter table stage.stage_raw_files alter column status set not null")
+    cur.execute(
+        """
+        create index if not exists idx_stage_raw_files_queue
+        on stage.stage_raw_files (inserted_at)
+        where status in ('pending', 'running', 'failed')
+        """
+    )
+
+
+_CLAIMABLE = """
+    purged_at is null
+    and (
+        status = 'pending'
+        or (status = 'failed' and attempts < %(max_attempts)s)
+        or (status = 'running' and lease_until < now())
+    )
+"""
+
+
+def claim(settings, worker: str, lease_sec: float, max_attempts: int) -> Optional[str]:
+    """Забирает одну загрузку в аренду на lease_sec секунд. None — брать нечего."""
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute(
+            f"""
+            update stage.stage_raw_files f
+            set status = 'running',
+                attempts = f.attempts + 1,
+                leased_by = %(worker)s,
+                lease_until = now() + make_interval(secs => %(lease)s),
+                heartbeat_at = now()
+            where f.load_id = (
+                select load_id
+                from stage.stage_raw_files
+                where {_CLAIMABLE}
+                order by inserted_at, load_id
+                limit 1
+                for update skip locked
+            )
+            returning f.load_id::text as load_id, f.attempts
+            """,
+            {"worker": worker, "lease": lease_sec, "max_attempts": max_attempts},
+        )
+        row = cur.fetchone()
+        conn.commit()
+    if row:
+        log.info("queue: claimed", extra={"load_id": row["load_id"], "attempt": row["attempts"], "worker": worker})
+        return row["load_id"]
+    return None
+
+
+def heartbeat(settings, load_id: str, worker: str, lease_sec: float) -> bool:
+    """Продлевает аренду. False — аренду перехватил другой воркер (истекла)."""
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            update stage.stage_raw_files
+            set lease_until = now() + make_interval(secs => %s), heartbeat_at = now()
+            where load_id = %s and leased_by = %s and status = 'running'
+            """,
+            (lease_sec, load_id, worker),
+        )
+        conn.commit()
+        return cur.rowcount == 1
+
+
+class LeaseLost(RuntimeError):
+    """Аренда загрузки истекла и/или перешла к другому воркеру."""
+
+
+def assert_lease(cur, load_id: str, worker: Optional[str]):
+    """
+    В транзакции шага: аренда load_id принадлежит worker и не истекла, иначе LeaseLost.
+    Строка очереди блокируется до commit/rollback, поэтому между проверкой и commit аренду
+    не заберёт другой воркер (claim пропускает заблокированные строки). worker=None — не воркер.
+    """
+    if worker is None:
+        return
+    cur.execute(
+        """
+        select 1
+        from stage.stage_raw_files
+        where load_id = %s and leased_by = %s and status = 'running' and lease_until > now()
+        for update
+        """,
+        (load_id, worker),
+    )
+    if cur.fetchone() is None:
+        raise LeaseLost(f"lease on {load_id} is no longer held by {worker}")
+
+
+def finish(settings, load_id: str, status: str, error: str = None, worker: str = None) -> bool:
+    """
+    Итоговый статус загрузки (done / failed / pending — если обработаны не все шаги), аренда снимается.
+    С worker статус пишется, только если аренда всё ещё его. Возвращает, записан ли статус.
+    """
+    if status not in QUEUE_STATUSES:
+        raise ValueError(f"Unknown queue status '{status}'. Allowed: {QUEUE_STATUSES}")
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            update stage.stage_raw_files
+            set status = %s, last_error = %s, leased_by = null, lease_until = null, finished_at = now()
+            where load_id = %s and (%s::text is null or leased_by = %s)
+            """,
+            (status, error[:2000] if error else None, load_id, worker, worker),
+        )
+        conn.commit()
+        if cur.rowcount != 1:
+            log.warning("queue: finish skipped, lease not held", extra={"load_id": load_id, "worker": worker})
+            return False
+        return True
+
+
+def queue_counts(settings, max_attempts: int) -> Dict[str, int]:
+    """Число загрузок по статусам и claimable — сколько воркеры могут забрать прямо сейчас."""
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute(
+            f"""
+            select
+                count(*) filter (where status = 'pending') as pending,
+                count(*) filter (where status = 'running') as running,
+                count(*) filter (where status = 'done') as done,
+                count(*) filter (where status = 'failed') as failed,
+                count(*) filter (where {_CLAIMABLE}) as claimable
+            from stage.stage_raw_files
+            where purged_at is null
+            """,
+            {"max_attempts": max_attempts},
+        )
+        return dict(cur.fetchone())
+
+
+def server_time(settings):
+    """Время БД — общие часы для воркеров и координатора на разных хостах."""
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute("select now() as now")
+        return cur.fetchone()["now"]
+
+
+def done_since(settings, since) -> List[str]:
+    """load_id, успешно обработанные (любым воркером) начиная с момента since."""
+    with get_conn(settings) as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            select load_id::text as load_id
+            from stage.stage_raw_files
+            where status = 'done' and finished_at >= %s
+            order by finished_at
+            """,
+            (since,),
+        )
+        return [r["load_id"] for r in cur.fetchall()]
+
+
+class Lease:
+    """Контекст обработки: фоновый поток продлевает аренду каждые lease_sec / 3 секунд."""
+
+    def __init__(self, settings, load_id: str, worker: str, lease_sec: float):
+        self.settings = settings
+        self.load_id = load_id
+        self.worker = worker
+        self.lease_sec = lease_sec
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{load_id[:8]}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_sec / 3):
+            try:
+                if not heartbeat(self.settings, self.load_id, self.worker, self.lease_sec):
+                    self.lost = True
+                    log.warning("queue: lease lost", extra={"load_id": self.load_id, "worker": self.worker})
+                    return
+            except Exception:
+                log.exception("queue: heartbeat failed", extra={"load_id": self.load_id})
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
@@ -1,10 +1,10 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
-# Историческая догрузка: итерация по датам и запуск ETL для data/raw/YYYY-MM-DD
+# Историческая догрузка каталогов data/raw/YYYY-MM-DD за диапазон дат
 # Использование:
 #   scripts/backfill_history.sh 2025-01-01 2025-01-07
-# Примечание: если GNU date недоступен (macOS), скрипт fallback на Python для генерации дат.
+#   BACKFILL_WORKERS=8 scripts/backfill_history.sh 2025-01-01 2025-03-31
 
 if [[ $# -ne 2 ]]; then
   echo "Usage: $0 START_DATE END_DATE  (формат YYYY-MM-DD)"
@@ -30,42 +30,23 @@ if command -v docker &>/dev/null; then
     echo "Не найден docker compose"; exit 1
   fi
 else
-  echo "Docker не установлен. Для локального режима запускайте для каждого дня:
-DATABASE_URL=... RAW_DIR=... RUN_MODE=once python -m etl.run_etl"
+  echo "Docker не установлен. Для локального режима:
+DATABASE_URL=... RAW_DIR=.../data/raw python -m etl.run_etl --backfill ${START_DATE} ${END_DATE}"
   exit 1
 fi
 
-# Генератор дат в диапазоне (перекрываем различия GNU/BSD date)
-gen_dates() {
-  python3 - "$START_DATE" "$END_DATE" << 'PYCODE'
-import sys, datetime
-s = datetime.date.fromisoformat(sys.argv[1])
-e = datetime.date.fromisoformat(sys.argv[2])
-if s > e:
-    sys.exit("START_DATE > END_DATE")
-d = s
-while d <= e:
-    print(d.isoformat())
-    d += datetime.timedelta(days=1)
-PYCODE
-}
-
 pushd "${INFRA_DIR}" >/dev/null
 
-for day in $(gen_dates); do
-  RAW_DIR_DAY="${RAW_ROOT}/${day}"
-  LOG_FILE="${LOG_DIR}/backfill_${day}.log"
-  if [[ ! -d "${RAW_DIR_DAY}" ]]; then
-    echo "[WARN] Пропуск: нет каталога ${RAW_DIR_DAY}" | tee -a "${LOG_FILE}"
-    continue
-  fi
-  echo "[INFO] Backfill ${day} (RAW_DIR=${RAW_DIR_DAY})" | tee -a "${LOG_FILE}"
-  ${DC} run --rm \
-    -e RAW_DIR="/app/data/raw/${day}" \
-    -e RUN_MODE="once" \
-    dataops 2>&1 | tee -a "${LOG_FILE}"
-done
+# Все дни обрабатываются одним процессом (пул воркеров, один publish в конце).
+# Уже обработанные дни пропускаются (artifacts/run_logs/backfill_state.json); --force — обработать заново.
+LOG_FILE="${LOG_DIR}/backfill_${START_DATE}_${END_DATE}.log"
+echo "[INFO] Backfill ${START_DATE}..${END_DATE} (RAW_DIR=${RAW_ROOT})" | tee -a "${LOG_FILE}"
+${DC} run --rm \
+  -e RAW_DIR="/app/data/raw" \
+  -e RUN_MODE="once" \
+  dataops python -m etl.run_etl --backfill "${START_DATE}" "${END_DATE}" --workers "${BACKFILL_WORKERS:-4}" \
+  2>&1 | tee -a "${LOG_FILE}"
 
 popd >/dev/null
 
-echo "[INFO] Backfill завершен. Логи: ${LOG_DIR}/backfill_*.log"
\ No newline at end of file
+echo "[INFO] Backfill завершен. Лог: ${LOG_FILE}"
@@ -0,0 +1,44 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+# Замер времени старта CLI (импорт etl.run_etl и --help) и проверка, что тяжёлые
+# модули (pandas, pyarrow, psycopg, dotenv) не импортируются до выполнения шагов.
+# Использование:
+#   scripts/bench_startup.sh [RUNS]
+#   DATABASE_URL=postgresql://... scripts/bench_startup.sh 10   # + повторный bootstrap схемы
+
+RUNS="${1:-5}"
+REPO_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+cd "${REPO_ROOT}"
+
+TIMEFORMAT="%R"
+
+bench() {
+  local label="$1"; shift
+  local times=()
+  for _ in $(seq 1 "${RUNS}"); do
+    times+=("$( { time "$@" >/dev/null 2>&1; } 2>&1 )")
+  done
+  printf '%s\n' "${times[@]}" | sort -n | awk -v label="${label}" -v n="${RUNS}" '
+    { t[NR] = $1 }
+    END { printf "[INFO] %-28s min=%.3fs median=%.3fs (runs=%d)\n", label, t[1], t[int((NR + 1) / 2)], n }'
+}
+
+bench "import etl.run_etl" python -c "import etl.run_etl"
+bench "python -m etl.run_etl --help" python -m etl.run_etl --help
+
+python - <<'PY'
+import sys
+import etl.run_etl  # noqa: F401
+
+heavy = [m for m in ("pandas", "pyarrow", "numpy", "psycopg", "dotenv") if m in sys.modules]
+print("[INFO] heavy modules after import:", ", ".join(heavy) if heavy else "none")
+sys.exit(1 if heavy else 0)
+PY
+
+if [[ -n "${DATABASE_URL:-}" ]]; then
+  # первый вызов может выполнить DDL, последующие должны сводиться к одному select хеша
+  python -c "from etl.utils.config import Settings; from etl.utils.schema import bootstrap; bootstrap(Settings.from_env())"
+  bench "bootstrap (schema current)" python -c \
+    "from etl.utils.config import Settings; from etl.utils.schema import bootstrap; assert not bootstrap(Settings.from_env())"
+fi
@@ -0,0 +1,48 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+# Локальный прогон очереди загрузок: координатор + N воркеров против одной БД.
+# Воркеры можно запускать и на других хостах с тем же DATABASE_URL (python -m etl.run_etl --worker).
+# Использование:
+#   DATABASE_URL=postgresql://... RAW_DIR=/path/to/data/raw scripts/run_workers_local.sh 4
+
+WORKERS="${1:-4}"
+
+if [[ -z "${DATABASE_URL:-}" ]]; then
+  echo "DATABASE_URL не задан"; exit 1
+fi
+
+REPO_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+LOG_DIR="${REPO_ROOT}/artifacts/run_logs"
+mkdir -p "${LOG_DIR}"
+LOG_TS="$(date +%Y%m%d-%H%M%S)"
+
+cd "${REPO_ROOT}"
+
+# 1) регистрация файлов: все новые load_id попадают в очередь (status = pending)
+echo "[INFO] ingest (RAW_DIR=${RAW_DIR:-<default>})"
+python -m etl.run_etl --steps ingest 2>&1 | tee -a "${LOG_DIR}/queue_ingest-${LOG_TS}.log"
+
+# 2) координатор (запускается до воркеров, чтобы publish учёл все загрузки) ждёт опустошения
+#    очереди и выполняет publish один раз
+python -m etl.run_etl --coordinator --steps publish >"${LOG_DIR}/queue_coordinator-${LOG_TS}.log" 2>&1 &
+COORDINATOR_PID=$!
+
+# 3) воркеры разбирают очередь и выходят, когда она пуста
+PIDS=()
+for i in $(seq 1 "${WORKERS}"); do
+  python -m etl.run_etl --worker --exit-when-empty >"${LOG_DIR}/queue_worker${i}-${LOG_TS}.log" 2>&1 &
+  PIDS+=("$!")
+done
+echo "[INFO] Запущено воркеров: ${WORKERS} (логи: ${LOG_DIR}/queue_*-${LOG_TS}.log)"
+
+STATUS=0
+wait "${COORDINATOR_PID}" || STATUS=$?
+
+FAILED=0
+for pid in "${PIDS[@]}"; do
+  wait "${pid}" || FAILED=1
+done
+
+echo "[INFO] Готово (coordinator exit=${STATUS}, workers failed=${FAILED})"
+exit $(( STATUS || FAILED ))
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from etl.utils.validation import parse_timestamps
+
+
+def test_parse_timestamps_datetime64_column():
+    # read_excel отдаёт ячейки-даты колонкой datetime64
+    values = pd.Series(pd.to_datetime(["2025-01-15 10:00", "2025-01-15 11:00", None]))
+
+    result = parse_timestamps(values, "Europe/Moscow")
+
+    assert str(result.dt.tz) == "Europe/Moscow"
+    assert result.iloc[0] == pd.Timestamp("2025-01-15 10:00", tz="Europe/Moscow")
+    assert result.iloc[1] == pd.Timestamp("2025-01-15 11:00", tz="Europe/Moscow")
+    assert pd.isna(result.iloc[2])
+
+
+def test_parse_timestamps_strings_with_format_inference():
+    values = pd.Series(["15.01.2025 10:00", "15.01.2025 11:00", ""])
+
+    result = parse_timestamps(values, "Europe/Moscow")
+
+    assert result.iloc[0] == pd.Timestamp("2025-01-15 10:00", tz="Europe/Moscow")
+    assert result.iloc[1] == pd.Timestamp("2025-01-15 11:00", tz="Europe/Moscow")
+    assert pd.isna(result.iloc[2])